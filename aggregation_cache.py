@@ -0,0 +1,102 @@
+# aggregation_cache.py
+# Bounded in-process cache for aggregation results with stale-while-revalidate refreshes.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+AGGREGATION_CACHE_SIZE = int(os.getenv("AGGREGATION_CACHE_SIZE", "128"))
+AGGREGATION_CACHE_TTL = float(os.getenv("AGGREGATION_CACHE_TTL", "300"))
+
+
+class AggregationCache:
+    """LRU cache with a time-to-live.
+
+    Keys are expected to contain the data version, so a write to the underlying collections
+    produces new keys and old entries simply age out of the LRU. Entries that outlive the TTL
+    are still served while a background thread recomputes them.
+    """
+
+    def __init__(self, max_entries=AGGREGATION_CACHE_SIZE, ttl=AGGREGATION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "recompute_seconds_total": 0.0,
+            "recompute_seconds_max": 0.0,
+        }
+
+    def get(self, key, compute):
+        """Returns the cached value for key, calling compute() on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                value, computed_at = entry
+                if time.monotonic() - computed_at < self.ttl:
+                    self._stats["hits"] += 1
+                    return value
+                self._stats["stale_hits"] += 1
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(target=self._refresh, args=(key, compute), daemon=True).start()
+                return value
+            self._stats["misses"] += 1
+
+        value = self._compute(compute)
+        self._store(key, value)
+        return value
+
+    def _compute(self, compute):
+        started = time.perf_counter()
+        value = compute()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["recompute_seconds_total"] += elapsed
+            self._stats["recompute_seconds_max"] = max(self._stats["recompute_seconds_max"], elapsed)
+        return value
+
+    def _refresh(self, key, compute):
+        try:
+            value = self._compute(compute)
+            self._store(key, value)
+            with self._lock:
+                self._stats["refreshes"] += 1
+        except Exception as e:
+            # The stale value stays in place and the next request past the TTL retries.
+            print(f"Background refresh of cache entry {key!r} failed: {e}")
+            with self._lock:
+                self._stats["refresh_errors"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit/miss/recompute counters together with the current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+            stats["ttl_seconds"] = self.ttl
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        return stats
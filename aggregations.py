@@ -0,0 +1,116 @@
+# aggregations.py
+# Frequency aggregations over the ama_log collection used by the dashboards.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from category_mapping import fold_counts, get_mappings
+from data_version import SOURCE_COLLECTION
+
+# Tag arrays shown on the tags dashboard, counted per element
+TAG_FIELDS = ["tags.bibelreferenzen", "tags.hauptthemen", "tags.theologische_konzepte"]
+
+# Dimensions shown on the questions dashboard: response key -> (field path, apply mapping)
+QUESTION_DIMENSIONS = {
+    "category": ("question_abstraction.categorization.category", True),
+    "subcategory": ("question_abstraction.categorization.subcategory", True),
+    "type": ("question_abstraction.categorization.type", True),
+    "complexity": ("question_abstraction.categorization.complexity", False),
+    "main_goal": ("question_abstraction.intent.main_goal", True),
+    "information_goal": ("question_abstraction.semantic.information_goal", True),
+    "domain": ("question_abstraction.semantic.domain", True),
+}
+
+# Fields whose number of distinct values grows with the collection (information_goal is close to one per
+# document). $facet returns all its groups in one result document, which MongoDB caps at 16 MB, so these
+# fields are counted by aggregations of their own, whose results are returned through a cursor.
+HIGH_CARDINALITY_FIELDS = TAG_FIELDS + ["question_abstraction.semantic.information_goal"]
+
+# "facet" computes all dimensions in one collection scan, "parallel" runs one pipeline per dimension concurrently.
+CATEGORIZATION_MODE = os.getenv("CATEGORIZATION_MODE", "facet")
+CATEGORIZATION_WORKERS = int(os.getenv("CATEGORIZATION_WORKERS", "4"))
+
+
+def _field_filter(field_path):
+    return {field_path: {"$exists": True, "$ne": ""}}
+
+
+def build_field_pipeline(field_path):
+    """Builds the stages that count the raw values of one field, most frequent first."""
+    pipeline = [{"$match": _field_filter(field_path)}]
+
+    # Fields below "tags." hold arrays and are counted per element
+    if field_path.startswith("tags."):
+        pipeline.append({"$unwind": f"${field_path}"})
+        pipeline.append({"$match": {field_path: {"$ne": ""}}})
+
+    pipeline.append({"$group": {"_id": f"${field_path}", "count": {"$sum": 1}}})
+    pipeline.append({"$sort": {"count": -1}})
+    return pipeline
+
+
+def aggregate_field(db, field_path, apply_mapping=False):
+    """Returns [{'_id': value, 'count': n}, ...] for one field, most frequent first.
+
+    With apply_mapping, the distinct raw values are folded into their canonical terms
+    in memory instead of joining category_mappings for every row.
+    """
+    rows = list(db[SOURCE_COLLECTION].aggregate(build_field_pipeline(field_path)))
+    if apply_mapping:
+        return fold_counts(rows, get_mappings(db))
+    return rows
+
+
+def build_facet_pipeline(dimensions):
+    """Builds a single pipeline that computes every dimension in one pass over the collection."""
+    field_paths = [field_path for field_path, _ in dimensions.values()]
+    return [
+        {"$match": {"$or": [_field_filter(field_path) for field_path in field_paths]}},
+        # Only the aggregated fields are carried into $facet, which keeps its working set small
+        {"$project": {field_path: 1 for field_path in field_paths}},
+        {
+            "$facet": {
+                name: build_field_pipeline(field_path) for name, (field_path, _) in dimensions.items()
+            }
+        },
+    ]
+
+
+def facet_dimensions(dimensions):
+    """Returns the dimensions that are safe to compute inside one $facet, i.e. not of HIGH_CARDINALITY_FIELDS."""
+    return {name: dimension for name, dimension in dimensions.items() if dimension[0] not in HIGH_CARDINALITY_FIELDS}
+
+
+def aggregate_dimensions_single_pass(db, dimensions):
+    """Computes the dimensions with one $facet aggregation, and each high-cardinality field with its own."""
+    faceted = facet_dimensions(dimensions)
+    result = next(db[SOURCE_COLLECTION].aggregate(build_facet_pipeline(faceted)), {}) if faceted else {}
+    mappings = get_mappings(db)
+    counts = {}
+    for name, (field_path, apply_mapping) in dimensions.items():
+        if name not in faceted:
+            counts[name] = aggregate_field(db, field_path, apply_mapping)
+        elif apply_mapping:
+            counts[name] = fold_counts(result.get(name, []), mappings)
+        else:
+            counts[name] = result.get(name, [])
+    return counts
+
+
+def aggregate_dimensions_parallel(db, dimensions, max_workers=CATEGORIZATION_WORKERS):
+    """Computes all dimensions concurrently, one aggregation per dimension."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            name: executor.submit(aggregate_field, db, field_path, apply_mapping)
+            for name, (field_path, apply_mapping) in dimensions.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def aggregate_dimensions(db, dimensions, mode=CATEGORIZATION_MODE):
+    """Computes all dimensions using the configured execution mode."""
+    if mode == "parallel":
+        return aggregate_dimensions_parallel(db, dimensions)
+    if mode == "facet":
+        return aggregate_dimensions_single_pass(db, dimensions)
+    raise ValueError(f"Unknown categorization mode '{mode}'. Use 'facet' or 'parallel'.")
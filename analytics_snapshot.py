@@ -0,0 +1,428 @@
+# analytics_snapshot.py
+# Columnar snapshot of the dashboard dimensions. Every tag field and question field is dictionary-encoded
+# into a vocabulary of distinct values and two NumPy arrays in CSR layout: `indices` holds the term ids of
+# all documents one after another, `indptr[i]:indptr[i + 1]` delimits those of document i. Frequencies,
+# raw or folded into canonical terms, are then a bincount over `indices` instead of an $unwind/$group.
+#
+# The arrays are stored as .npy files and opened memory-mapped, so all worker processes of a server share
+# the same pages. New documents are appended by _id as a new segment, which leaves the existing files
+# untouched; a delete (which bumps the ama_log version counter) triggers a full rebuild.
+#
+# Usage:
+#   python analytics_snapshot.py build     # rebuild the snapshot from scratch
+#   python analytics_snapshot.py refresh   # append documents inserted since the last build or refresh
+
+import argparse
+import os
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from bson import ObjectId, json_util
+
+from aggregations import QUESTION_DIMENSIONS, TAG_FIELDS
+from category_mapping import get_mappings
+from data_version import SOURCE_COLLECTION, get_data_version
+from database import get_db
+from projections import get_path
+
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes are then only serialized within one process
+    fcntl = None
+
+SNAPSHOT_FIELDS = TAG_FIELDS + [field_path for field_path, _ in QUESTION_DIMENSIONS.values()]
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "mongo")  # "snapshot" serves the dashboards from here
+ANALYTICS_SNAPSHOT_DIR = os.getenv("ANALYTICS_SNAPSHOT_DIR", "analytics_snapshot")
+SNAPSHOT_READ_BATCH_SIZE = 5000
+SNAPSHOT_MAX_SEGMENTS = int(os.getenv("ANALYTICS_SNAPSHOT_MAX_SEGMENTS", "32"))
+CURRENT_FILE = "current.json"
+LOCK_FILE = "refresh.lock"
+
+_MISSING = object()
+
+
+def field_values(doc, field_path):
+    """Returns the values of one field that the dashboard aggregation of that field would count.
+
+    Mirrors build_field_pipeline: a missing field or "" counts nothing, and tag arrays are counted per
+    element, except that an array containing "" fails the pipeline's $ne: "" match as a whole.
+    Values that cannot be dictionary keys (sub-documents, nested arrays) are skipped.
+    """
+    value = get_path(doc, field_path, _MISSING)
+    if value is _MISSING or value == "":
+        return []
+    if field_path.startswith("tags."):
+        if value is None:
+            return []  # $unwind drops null
+        if isinstance(value, list):
+            return [] if "" in value else [element for element in value if not isinstance(element, (dict, list))]
+        return [value] if not isinstance(value, dict) else []
+    return [value] if not isinstance(value, (dict, list)) else []
+
+
+class _ColumnBuilder:
+    """Collects the term ids of appended documents for one field."""
+
+    def __init__(self, vocabulary):
+        self.vocabulary = list(vocabulary)
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.vocabulary)}
+        self.indices = []
+        self.lengths = []
+
+    def append(self, values):
+        for value in values:
+            term_id = self.term_ids.get(value)
+            if term_id is None:
+                term_id = self.term_ids[value] = len(self.vocabulary)
+                self.vocabulary.append(value)
+            self.indices.append(term_id)
+        self.lengths.append(len(values))
+
+
+class SnapshotSegment:
+    """The documents added by one build or refresh: their memory-mapped columns and the terms they introduced."""
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as meta_file:
+            # Extended JSON, so that non-string values (numbers, dates, ObjectIds) keep their type
+            meta = json_util.loads(meta_file.read())
+        self.document_count = meta["document_count"]
+        self.new_terms = meta["new_terms"]
+        self.columns = {
+            field_path: (
+                np.load(os.path.join(path, f"{field_path}.indptr.npy"), mmap_mode="r"),
+                np.load(os.path.join(path, f"{field_path}.indices.npy"), mmap_mode="r"),
+            )
+            for field_path in self.new_terms
+        }
+
+
+class SnapshotGeneration:
+    """The segments listed by one manifest, read as a single snapshot. Immutable once opened."""
+
+    def __init__(self, manifest, segments):
+        self.manifest = manifest
+        self.segments = segments
+        fields = set.intersection(*(set(segment.new_terms) for segment in segments)) if segments else set()
+        # Term ids are global: every segment only stores the terms it added to the vocabulary
+        self.vocabularies = {
+            field_path: [term for segment in segments for term in segment.new_terms[field_path]]
+            for field_path in fields
+        }
+        self.source_version = tuple(manifest["source_version"])
+        self.high_water_id = ObjectId(manifest["high_water_id"]) if manifest["high_water_id"] else None
+        self._folds = {}
+        self._folds_version = None
+        self._lock = threading.Lock()
+
+    @property
+    def document_count(self):
+        return self.manifest["document_count"]
+
+    @property
+    def segment_names(self):
+        return list(self.manifest["segments"])
+
+    def matches(self, source_version):
+        """Returns whether the snapshot was taken at the given DataVersion.source."""
+        return self.source_version == _source_version_key(source_version)
+
+    def counts(self, field_path):
+        """Returns the number of occurrences of every term id of the field."""
+        counts = np.zeros(len(self.vocabularies[field_path]), dtype=np.int64)
+        for segment in self.segments:
+            _, indices = segment.columns[field_path]
+            counts += np.bincount(indices, minlength=len(counts))
+        return counts
+
+    def entries(self, field_path):
+        """Returns (document numbers, term ids) of every occurrence of the field, in document order."""
+        doc_ids, term_ids = [], []
+        first_document = 0
+        for segment in self.segments:
+            indptr, indices = segment.columns[field_path]
+            doc_ids.append(first_document + np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr)))
+            term_ids.append(np.asarray(indices, dtype=np.int64))
+            first_document += segment.document_count
+        if not doc_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(doc_ids), np.concatenate(term_ids)
+
+    def canonical_fold(self, field_path, mappings, mappings_version):
+        """Returns (canonical terms, canonical id of every term id), computed once per field and mappings version."""
+        with self._lock:
+            if self._folds_version == mappings_version and field_path in self._folds:
+                return self._folds[field_path]
+        canonical_ids = {}
+        term_to_canonical = np.empty(len(self.vocabularies[field_path]), dtype=np.int64)
+        for term_id, term in enumerate(self.vocabularies[field_path]):
+            target = mappings.get(term, term)
+            term_to_canonical[term_id] = canonical_ids.setdefault(target, len(canonical_ids))
+        fold = (list(canonical_ids), term_to_canonical)
+        with self._lock:
+            # Folds of an older mappings version are never asked for again
+            if self._folds_version != mappings_version:
+                self._folds = {}
+                self._folds_version = mappings_version
+            self._folds[field_path] = fold
+        return fold
+
+    def frequencies(self, field_path, mappings=None, mappings_version=None):
+        """Returns [{'_id': value, 'count': n}, ...], folded into canonical terms if mappings are given."""
+        counts = self.counts(field_path)
+        if mappings is None:
+            return _rows(self.vocabularies[field_path], counts)
+        canonical_terms, term_to_canonical = self.canonical_fold(field_path, mappings, mappings_version)
+        folded = np.bincount(term_to_canonical, weights=counts, minlength=len(canonical_terms)).astype(np.int64)
+        return _rows(canonical_terms, folded)
+
+
+def _rows(terms, counts):
+    """Returns [{'_id': term, 'count': n}] for the non-zero counts, most frequent first."""
+    present = np.flatnonzero(counts)
+    order = present[np.argsort(-counts[present], kind="stable")]
+    return [{"_id": terms[index], "count": int(counts[index])} for index in order]
+
+
+def _source_version_key(source_version):
+    counter, newest_id = source_version
+    return (counter, str(newest_id) if newest_id is not None else None)
+
+
+class AnalyticsSnapshot:
+    """Keeps a snapshot directory in step with ama_log and answers frequency queries from it.
+
+    The directory holds append-only segments and a manifest (current.json) listing the segments of the
+    current snapshot. A refresh writes a segment with the new documents and then replaces the manifest
+    atomically, so readers keep using the previous snapshot until the new one is complete.
+    """
+
+    def __init__(self, directory=ANALYTICS_SNAPSHOT_DIR, fields=SNAPSHOT_FIELDS):
+        self.directory = directory
+        self.fields = list(fields)
+        self._generation = None
+        self._segments = {}
+        # _lock only guards swapping in a new generation; _refresh_mutex is held while one is built
+        self._lock = threading.Lock()
+        self._refresh_mutex = threading.Lock()
+        self._background_refresh = None
+
+    @contextmanager
+    def _refresh_lock(self):
+        # Serializes refreshes across threads of this process and across processes sharing the directory
+        with self._refresh_mutex:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, LOCK_FILE), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE), encoding="utf-8") as manifest_file:
+                return json_util.loads(manifest_file.read())
+        except FileNotFoundError:
+            return None
+
+    def _open_current(self):
+        """Returns the snapshot current on disk, reopening it if another process has replaced it."""
+        manifest = self._read_manifest()
+        if manifest is None:
+            return None
+        generation = self._generation
+        if generation is not None and generation.manifest == manifest:
+            return generation
+        # Segments stay mapped from one generation to the next; only new ones are opened
+        segments = {
+            name: self._segments.get(name) or SnapshotSegment(os.path.join(self.directory, name))
+            for name in manifest["segments"]
+        }
+        generation = SnapshotGeneration(manifest, list(segments.values()))
+        with self._lock:
+            self._generation = generation
+            self._segments = segments
+        return generation
+
+    def _next_segment_name(self):
+        numbers = [int(entry[4:]) for entry in os.listdir(self.directory) if entry.startswith("seg-")]
+        return f"seg-{max(numbers, default=0) + 1:06d}"
+
+    def _write_segment(self, builders, vocabulary_sizes, document_count):
+        name = self._next_segment_name()
+        path = os.path.join(self.directory, name)
+        os.makedirs(path)
+        for field_path, builder in builders.items():
+            indptr = np.concatenate([[0], np.cumsum(builder.lengths, dtype=np.int64)])
+            np.save(os.path.join(path, f"{field_path}.indptr.npy"), indptr.astype(np.int64))
+            np.save(os.path.join(path, f"{field_path}.indices.npy"), np.array(builder.indices, dtype=np.int32))
+        meta = {
+            "document_count": document_count,
+            "new_terms": {
+                field_path: builder.vocabulary[vocabulary_sizes[field_path]:] for field_path, builder in builders.items()
+            },
+        }
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as meta_file:
+            meta_file.write(json_util.dumps(meta, ensure_ascii=False))
+        return name
+
+    def _publish(self, manifest, replaced):
+        # Readers find the new snapshot through an atomic replace of the manifest
+        temporary = os.path.join(self.directory, CURRENT_FILE + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as manifest_file:
+            manifest_file.write(json_util.dumps(manifest))
+        os.replace(temporary, os.path.join(self.directory, CURRENT_FILE))
+        # Segments of the replaced snapshot stay for readers that are just opening it; older ones are
+        # removed (processes that still map their files keep them readable until they let go)
+        kept = set(manifest["segments"]) | set(replaced.segment_names if replaced is not None else [])
+        for entry in os.listdir(self.directory):
+            if entry.startswith("seg-") and entry not in kept:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def write_documents(self, documents, source_version, base=None):
+        """Appends the documents (in _id order) to base, or starts a new snapshot with them, and returns it."""
+        os.makedirs(self.directory, exist_ok=True)
+        vocabulary_sizes = {
+            field_path: len(base.vocabularies.get(field_path, [])) if base is not None else 0
+            for field_path in self.fields
+        }
+        builders = {
+            field_path: _ColumnBuilder(base.vocabularies.get(field_path, []) if base is not None else [])
+            for field_path in self.fields
+        }
+        high_water_id = base.high_water_id if base is not None else None
+        appended = 0
+        for doc in documents:
+            for field_path, builder in builders.items():
+                builder.append(field_values(doc, field_path))
+            high_water_id = doc["_id"]
+            appended += 1
+        segments = base.segment_names if base is not None else []
+        if appended or base is None:
+            segments = segments + [self._write_segment(builders, vocabulary_sizes, appended)]
+        manifest = {
+            "segments": segments,
+            "source_version": _source_version_key(source_version),
+            "high_water_id": str(high_water_id) if high_water_id else None,
+            "document_count": (base.document_count if base is not None else 0) + appended,
+        }
+        self._publish(manifest, self._generation)
+        return self._open_current()
+
+    def _append_documents(self, db, base, source_version):
+        _, newest_id = source_version
+        id_filter = {}
+        if base is not None and base.high_water_id is not None:
+            id_filter["$gt"] = base.high_water_id
+        if newest_id is not None:
+            # Bounded by the version that the snapshot will be labelled with
+            id_filter["$lte"] = ObjectId(newest_id)
+        query = {"_id": id_filter} if id_filter else {}
+        projection = {field_path: 1 for field_path in self.fields}
+        cursor = db[SOURCE_COLLECTION].find(query, projection).sort("_id", 1).batch_size(SNAPSHOT_READ_BATCH_SIZE)
+        return self.write_documents(cursor, source_version, base)
+
+    def rebuild(self, db):
+        """Builds a new snapshot of the whole collection in a single segment."""
+        source_version = get_data_version(db).source
+        with self._refresh_lock():
+            self._open_current()
+            return self._append_documents(db, None, source_version)
+
+    def refresh(self, db):
+        """Appends the documents inserted since the snapshot was taken as a new segment.
+
+        The snapshot is rebuilt instead after deletions, which cannot be applied by appending, and once it
+        has SNAPSHOT_MAX_SEGMENTS segments, which merges them.
+        """
+        source_version = get_data_version(db).source
+        with self._refresh_lock():
+            current = self._open_current()
+            if current is not None and current.matches(source_version):
+                return current
+            if current is not None and self._needs_rebuild(current, source_version):
+                current = None
+            return self._append_documents(db, current, source_version)
+
+    def _needs_rebuild(self, generation, source_version):
+        return (generation.source_version[0] != source_version[0]
+                or len(generation.segments) >= SNAPSHOT_MAX_SEGMENTS
+                or bool(set(self.fields) - set(generation.vocabularies)))
+
+    def _refreshing(self):
+        return self._background_refresh is not None and self._background_refresh.is_alive()
+
+    def refresh_in_background(self, db):
+        """Starts a refresh on a daemon thread unless one is already running in this process."""
+        with self._lock:
+            if self._refreshing():
+                return
+            self._background_refresh = threading.Thread(target=self._refresh_logged, args=(db,), daemon=True)
+            self._background_refresh.start()
+
+    def _refresh_logged(self, db):
+        try:
+            self.refresh(db)
+        except Exception as e:
+            print(f"Background refresh of the analytics snapshot failed: {e}")
+
+    def current(self, db, rebuild=True):
+        """Returns the snapshot matching the current data version, refreshing it if needed.
+
+        Readers of an up-to-date snapshot take no lock; only a reader that needs newer data waits for the
+        refresh that builds it. With rebuild=False the reader only waits for new documents to be appended:
+        a build or rebuild runs in the background, and the previous snapshot (None if there is none yet)
+        is returned meanwhile.
+        """
+        source_version = get_data_version(db).source
+        generation = self._generation
+        if generation is not None and generation.matches(source_version):
+            return generation
+        if not rebuild:
+            generation = self._open_current()
+            if generation is not None and generation.matches(source_version):
+                return generation
+            if generation is None or self._needs_rebuild(generation, source_version) or self._refreshing():
+                self.refresh_in_background(db)
+                return generation
+        return self.refresh(db)
+
+    def frequencies(self, db, field_path, apply_mapping=False):
+        """Returns [{'_id': value, 'count': n}, ...] like aggregate_field, most frequent first."""
+        generation = self.current(db)
+        if not apply_mapping:
+            return generation.frequencies(field_path)
+        return generation.frequencies(field_path, get_mappings(db), get_data_version(db).mappings)
+
+    def dimensions(self, db, dimensions):
+        """Returns {name: frequencies} like aggregate_dimensions."""
+        return {
+            name: self.frequencies(db, field_path, apply_mapping)
+            for name, (field_path, apply_mapping) in dimensions.items()
+        }
+
+
+analytics = AnalyticsSnapshot()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or refresh the columnar analytics snapshot.")
+    parser.add_argument("command", choices=["build", "refresh"])
+    args = parser.parse_args(argv)
+
+    db = get_db()
+    generation = analytics.rebuild(db) if args.command == "build" else analytics.refresh(db)
+    print(f"Snapshot of {generation.document_count} documents in {len(generation.segments)} segment(s) "
+          f"in {analytics.directory}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
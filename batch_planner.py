@@ -0,0 +1,123 @@
+# batch_planner.py
+# Token-budgeted, adaptively sized batches of terms for the LLM mapping process. Failed or incomplete
+# batches are split in half and requeued, so a single bad reply costs at most a few terms.
+
+import json
+import os
+from collections import Counter, deque
+
+from term_normalization import estimate_tokens
+
+LLM_TOKEN_BUDGET = int(os.getenv("LLM_TOKEN_BUDGET", "8000"))  # prompt plus reply, per request
+LLM_TARGET_LATENCY = float(os.getenv("LLM_TARGET_LATENCY", "30"))  # seconds
+MAX_BATCH_TERMS = 500
+MAX_TERM_ATTEMPTS = 3
+GROWTH_FACTOR = 1.25
+SLOW_FACTOR = 0.75
+FAILURE_FACTOR = 0.5
+
+
+def term_cost(term):
+    """Estimated tokens a term adds to a request: once in the prompt, and as key and value in the reply."""
+    return 3 * estimate_tokens(json.dumps(term, ensure_ascii=False)) + 2
+
+
+class AdaptiveBatchSize:
+    """Maximum terms per batch, grown after fast successes and shrunk after slow or failed requests."""
+
+    def __init__(self, initial=MAX_BATCH_TERMS, minimum=1, maximum=MAX_BATCH_TERMS, target_latency=LLM_TARGET_LATENCY):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._size = float(min(max(initial, minimum), maximum))
+
+    @property
+    def value(self):
+        return int(self._size)
+
+    def _scale(self, factor):
+        self._size = min(max(self._size * factor, self.minimum), self.maximum)
+
+    def record_success(self, latency):
+        self._scale(SLOW_FACTOR if latency > self.target_latency else GROWTH_FACTOR)
+
+    def record_failure(self):
+        self._scale(FAILURE_FACTOR)
+
+
+class BatchPlanner:
+    """Hands out (field_path, terms) batches that fit the token budget and the current batch size.
+
+    Terms of a failed batch are split in half and put back at the front of the queue. A term that keeps
+    failing on its own, or that replies keep leaving out, is given up after MAX_TERM_ATTEMPTS and
+    reported in failed_terms.
+    """
+
+    def __init__(self, terms_by_field, base_tokens=0, budget=LLM_TOKEN_BUDGET, batch_size=None):
+        self.base_tokens = base_tokens
+        self.budget = budget
+        self.batch_size = batch_size or AdaptiveBatchSize()
+        # Sorted so that a rerun over the same terms starts with the same batches (and prompts)
+        self._pending = deque(
+            (field_path, sorted(terms, key=str)) for field_path, terms in terms_by_field.items() if terms
+        )
+        self._attempts = Counter()
+        self.failed_terms = {field_path: [] for field_path in terms_by_field}
+
+    def has_pending(self):
+        return bool(self._pending)
+
+    def next_batch(self):
+        """Returns the next (field_path, terms) batch, or None if nothing is pending."""
+        if not self._pending:
+            return None
+        field_path, terms = self._pending.popleft()
+        tokens = self.base_tokens
+        size = 0
+        # At least one term per batch, even if it alone exceeds the budget
+        while size < len(terms) and size < self.batch_size.value:
+            tokens += term_cost(terms[size])
+            if size and tokens > self.budget:
+                break
+            size += 1
+        if size < len(terms):
+            self._pending.appendleft((field_path, terms[size:]))
+        return field_path, terms[:size]
+
+    def _requeue(self, field_path, terms, count_attempt):
+        retry = []
+        for term in terms:
+            if count_attempt:
+                self._attempts[(field_path, term)] += 1
+            if self._attempts[(field_path, term)] >= MAX_TERM_ATTEMPTS:
+                self.failed_terms[field_path].append(term)
+            else:
+                retry.append(term)
+        if len(retry) > 1:
+            middle = len(retry) // 2
+            self._pending.appendleft((field_path, retry[middle:]))
+            self._pending.appendleft((field_path, retry[:middle]))
+        elif retry:
+            self._pending.appendleft((field_path, retry))
+
+    def report_success(self, field_path, batch, mappings, latency=None):
+        """Returns the mappings for the batch's own terms and requeues the terms the reply left out.
+
+        latency is None for replies that did not come from the API (e.g. the response cache).
+        """
+        mapped = {term: mappings[term] for term in batch if isinstance(term, str) and isinstance(mappings.get(term), str)}
+        missing = [term for term in batch if term not in mapped]
+        if missing:
+            # An incomplete reply is usually a truncated one: the batch was too large
+            self.batch_size.record_failure()
+            # The model saw these terms and skipped them, so this counts as an attempt for each
+            self._requeue(field_path, missing, count_attempt=True)
+        elif latency is not None:
+            self.batch_size.record_success(latency)
+        return mapped
+
+    def report_failure(self, field_path, batch):
+        """Shrinks the batch size and requeues the batch in two halves."""
+        self.batch_size.record_failure()
+        # Halving terminates on its own; only a term that fails on its own uses up attempts
+        self._requeue(field_path, batch, count_attempt=len(batch) == 1)
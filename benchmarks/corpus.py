@@ -0,0 +1,164 @@
+# benchmarks/corpus.py
+# Seeded generator of synthetic ama_log documents with the structure of the real collection: a
+# question_abstraction, Zipf-distributed tags (a few themes dominate, most are rare), spelling variants
+# of the same terms, Markdown answers, and category_mappings for part of the vocabulary.
+
+import random
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from data_version import MAPPINGS_COLLECTION, SOURCE_COLLECTION
+
+DEFAULT_SEED = 42
+INSERT_BATCH_SIZE = 5000
+ZIPF_EXPONENT = 1.1
+MAPPED_SHARE = 0.6  # share of the vocabulary that already has a mapping
+
+BOOKS = ["Gen", "Ex", "Ps", "Spr", "Jes", "Jer", "Mt", "Mk", "Lk", "Joh", "Apg", "Röm", "1Kor", "Gal", "Eph", "Hebr", "Offb"]
+THEME_STEMS = ["Gnade", "Glaube", "Hoffnung", "Liebe", "Vergebung", "Gebet", "Schöpfung", "Gemeinde", "Taufe",
+               "Abendmahl", "Heiligung", "Leid", "Gerechtigkeit", "Frieden", "Mission", "Ehe", "Familie", "Arbeit"]
+CONCEPT_STEMS = ["Trinität", "Erlösung", "Sünde", "Rechtfertigung", "Offenbarung", "Inkarnation", "Eschatologie",
+                 "Bund", "Prädestination", "Sakrament", "Auferstehung", "Heiliger Geist"]
+CATEGORIES = ["Ethik", "Theologie", "Bibelauslegung", "Kirchengeschichte", "Seelsorge", "Apologetik", "Praxis"]
+QUESTION_TYPES = ["Sachfrage", "Verständnisfrage", "Entscheidungsfrage", "Meinungsfrage"]
+COMPLEXITIES = ["niedrig", "mittel", "hoch"]
+MAIN_GOALS = ["verstehen", "entscheiden", "lernen", "trösten", "argumentieren"]
+DOMAINS = ["Altes Testament", "Neues Testament", "Dogmatik", "Ethik", "Praktische Theologie"]
+QUALIFIERS = ["", " im Alltag", " und Zweifel", " in der Bibel", " heute", " nach Paulus", " bei Jesus", " im AT"]
+
+
+def _variants(term):
+    # Case, whitespace and punctuation variants, as produced by different LLM runs for the same tag
+    return [term, term.lower(), f"{term} ", term.replace(" ", "-")]
+
+
+def build_vocabulary(stems, size, rnd):
+    """Returns `size` distinct terms built from stems and qualifiers, most common first."""
+    terms = [stem + qualifier for qualifier in QUALIFIERS for stem in stems]
+    while len(terms) < size:
+        terms.append(f"{rnd.choice(stems)} {len(terms)}")
+    return terms[:size]
+
+
+def zipf_weights(size, exponent=ZIPF_EXPONENT):
+    cumulative, total = [], 0.0
+    for rank in range(1, size + 1):
+        total += 1 / rank ** exponent
+        cumulative.append(total)
+    return cumulative
+
+
+class CorpusGenerator:
+    """Generates the same documents for the same seed and size.
+
+    By default information_goal repeats a few phrases; with unique_goals every document gets its own, as
+    in the real collection, where the field is close to free text.
+    """
+
+    def __init__(self, size, seed=DEFAULT_SEED, unique_goals=False):
+        self.size = size
+        self.unique_goals = unique_goals
+        self.rnd = random.Random(seed)
+        # The vocabulary grows sub-linearly with the corpus, like new tags in the real collection
+        vocabulary_size = max(50, int(size ** 0.6))
+        self.themes = build_vocabulary(THEME_STEMS, vocabulary_size, self.rnd)
+        self.concepts = build_vocabulary(CONCEPT_STEMS, max(30, vocabulary_size // 2), self.rnd)
+        self.subcategories = build_vocabulary(CATEGORIES, max(20, vocabulary_size // 4), self.rnd)
+        self.references = [f"{book} {chapter},{verse}" for book in BOOKS for chapter in range(1, 21) for verse in (1, 5, 12)]
+        self._weights = {
+            name: zipf_weights(len(values))
+            for name, values in (("themes", self.themes), ("concepts", self.concepts),
+                                 ("subcategories", self.subcategories), ("references", self.references))
+        }
+        self._started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def _pick(self, name, count):
+        values = getattr(self, name)
+        picked = self.rnd.choices(values, cum_weights=self._weights[name], k=count)
+        # Every tenth tag is a spelling variant of a known term
+        return list(dict.fromkeys(
+            self.rnd.choice(_variants(term)) if self.rnd.random() < 0.1 else term for term in picked
+        ))
+
+    def _answer(self, index, themes, references):
+        lines = [f"# Antwort {index}", "", f"Die Frage berührt **{', '.join(themes) or 'Grundfragen'}**.", ""]
+        for reference in references:
+            lines.append(f"- *{reference}*: {' '.join(self.rnd.choices(THEME_STEMS, k=12))}.")
+        lines += ["", "| Aspekt | Bedeutung |", "|---|---|"]
+        lines += [f"| {self.rnd.choice(CONCEPT_STEMS)} | {' '.join(self.rnd.choices(THEME_STEMS, k=6))} |" for _ in range(3)]
+        lines += ["", " ".join(self.rnd.choices(THEME_STEMS + CONCEPT_STEMS, k=self.rnd.randint(80, 300))) + "."]
+        return "\n".join(lines)
+
+    def document_id(self, index):
+        # Timestamp of the creation time, counter of the index: unique and in insertion order
+        created = self._started + timedelta(seconds=index * 37)
+        return ObjectId(int(created.timestamp()).to_bytes(4, "big") + bytes(4) + index.to_bytes(4, "big"))
+
+    def _information_goal(self, index, themes, category):
+        goal = f"Bedeutung von {themes[0] if themes else category}"
+        return f"{goal} für Frage {index}" if self.unique_goals else goal
+
+    def document(self, index):
+        rnd = self.rnd
+        themes = self._pick("themes", rnd.randint(0, 5))
+        references = self._pick("references", rnd.randint(0, 4))
+        category = rnd.choice(CATEGORIES)
+        doc = {
+            "_id": self.document_id(index),
+            "question_abstraction": {
+                "categorization": {
+                    "category": rnd.choice(_variants(category)) if rnd.random() < 0.05 else category,
+                    "subcategory": self._pick("subcategories", 1)[0],
+                    "type": rnd.choice(QUESTION_TYPES),
+                    "complexity": rnd.choice(COMPLEXITIES),
+                },
+                "intent": {"main_goal": rnd.choice(MAIN_GOALS)},
+                "semantic": {
+                    "information_goal": self._information_goal(index, themes, category),
+                    "domain": rnd.choice(DOMAINS),
+                },
+            },
+            "tags": {
+                "bibelreferenzen": references,
+                "hauptthemen": themes,
+                "theologische_konzepte": self._pick("concepts", rnd.randint(0, 3)),
+            },
+            "reply": {"completion": {"choices": [{"message": {"content": self._answer(index, themes, references)}}]}},
+        }
+        if rnd.random() < 0.05:
+            del doc["question_abstraction"]["semantic"]
+        return doc
+
+    def documents(self):
+        for index in range(self.size):
+            yield self.document(index)
+
+    def mappings(self):
+        """Returns category_mappings documents for MAPPED_SHARE of the vocabulary, variants included."""
+        rnd = random.Random(self.size)
+        mappings = {}
+        for field_path, terms in (("tags.hauptthemen", self.themes), ("tags.theologische_konzepte", self.concepts),
+                                  ("question_abstraction.categorization.subcategory", self.subcategories)):
+            for term in terms[: int(len(terms) * MAPPED_SHARE)]:
+                target = term.split(" ")[0] if rnd.random() < 0.5 else term
+                for variant in _variants(term):
+                    mappings.setdefault(variant, {"_id": variant, "target": target, "field_path": field_path})
+        return list(mappings.values())
+
+
+def seed_database(db, size, seed=DEFAULT_SEED, batch_size=INSERT_BATCH_SIZE, unique_goals=False):
+    """Replaces ama_log and category_mappings of db with a generated corpus of `size` documents."""
+    generator = CorpusGenerator(size, seed, unique_goals)
+    db[SOURCE_COLLECTION].drop()
+    db[MAPPINGS_COLLECTION].drop()
+    batch = []
+    for doc in generator.documents():
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            db[SOURCE_COLLECTION].insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db[SOURCE_COLLECTION].insert_many(batch, ordered=False)
+    db[MAPPINGS_COLLECTION].insert_many(generator.mappings(), ordered=False)
+    return generator
@@ -0,0 +1,194 @@
+# benchmarks/run.py
+# Times the dashboard aggregations, the network graph, the document view, the unmapped-term discovery
+# and the LLM mapping pipeline (against a local stub LLM) on generated corpora of increasing size, and
+# writes a JSON report that later runs can be compared against.
+#
+# Usage:
+#   python -m benchmarks.run                                   # 10k, 100k and 1M documents
+#   python -m benchmarks.run --sizes 10000 --report report.json
+#   python -m benchmarks.run --sizes 10000 --baseline report.json   # exit 1 on regressions
+#   python -m benchmarks.run --unique-goals                    # one information_goal per document
+#
+# Needs a local mongod (MONGODB_URI, default mongodb://localhost:27017). The benchmark database
+# (--database, default ama_bench) is dropped and reseeded for every size; no other database is touched.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.corpus import DEFAULT_SEED, seed_database
+from benchmarks.stub_llm import DEFAULT_DELAY, StubLLMServer
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_REPEAT = 3
+VIEW_SAMPLE_SIZE = 200
+DEFAULT_TOLERANCE = 0.25  # a median this much above the baseline counts as a regression
+BENCHMARK_DATABASE_PREFIX = "ama_bench"
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    return {
+        "runs": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def measure(function, repeat):
+    """Runs function `repeat` times and returns the summary of its durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return summarize(durations)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_size(db, size, seed, repeat, stub, unique_goals=False):
+    """Seeds a corpus of `size` documents and returns {benchmark name: summary}."""
+    # Imported here: the modules read MONGO_DB_NAME and STRAICO_BASE_URL when they are first imported
+    import main
+    from aggregations import QUESTION_DIMENSIONS, aggregate_dimensions, aggregate_field
+    from data_version import invalidate_local_version
+    from index_manager import ensure_indexes
+    from llm_mapper import RESPONSE_CACHE_COLLECTION, get_unmapped_terms, get_unmapped_terms_by_field
+    from mapping_jobs import JOBS_COLLECTION, claim_job, enqueue_job, finish_job, run_mapping_job
+    from network_graph import generate_network_data, rebuild_network_cache
+
+    results = {}
+    print(f"Seeding {size} documents...")
+    started = time.perf_counter()
+    generator = seed_database(db, size, seed, unique_goals=unique_goals)
+    results["seed"] = summarize([time.perf_counter() - started])
+    ensure_indexes(db)
+    invalidate_local_version()
+
+    for field_path in ("tags.bibelreferenzen", "tags.hauptthemen", "tags.theologische_konzepte"):
+        apply_mapping = field_path != "tags.bibelreferenzen"
+        results[f"aggregate_field:{field_path}"] = measure(lambda: aggregate_field(db, field_path, apply_mapping), repeat)
+    results["aggregate_dimensions"] = measure(lambda: aggregate_dimensions(db, QUESTION_DIMENSIONS), repeat)
+    results["generate_network_data"] = measure(lambda: generate_network_data(db), repeat)
+    results["rebuild_network_cache"] = measure(lambda: rebuild_network_cache(db), 1)
+
+    # The document view through the full Flask stack, on random documents
+    client = main.create_app(start_mapping_workers=False).test_client()
+    indexes = random.Random(seed).sample(range(size), min(size, VIEW_SAMPLE_SIZE))
+    sample = [generator.document_id(index) for index in indexes]
+    for show in ("answer", "all"):
+        durations = []
+        for doc_id in sample:
+            started = time.perf_counter()
+            response = client.get(f"/view/{doc_id}?show={show}")
+            durations.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"/view/{doc_id}?show={show} returned {response.status_code}")
+        results[f"view_document:{show}"] = summarize(durations)
+
+    results["get_unmapped_terms:tags.hauptthemen"] = measure(lambda: get_unmapped_terms(db, "tags.hauptthemen"), repeat)
+    results["get_unmapped_terms_by_field"] = measure(lambda: get_unmapped_terms_by_field(db), repeat)
+
+    # The mapping pipeline writes mappings, so it runs last and once
+    db[JOBS_COLLECTION].drop()
+    db[RESPONSE_CACHE_COLLECTION].drop()
+    calls_before = stub.calls
+    job_id = enqueue_job(db)
+    job = claim_job(db, "benchmark")
+    started = time.perf_counter()
+    status, message = run_mapping_job(db, job, "benchmark")
+    elapsed = time.perf_counter() - started
+    finish_job(db, job_id, "benchmark", status, message)
+    job = db[JOBS_COLLECTION].find_one({"_id": job_id})
+    results["mapping_pipeline"] = dict(
+        summarize([elapsed]), status=status, terms=job.get("total", 0), llm_requests=stub.calls - calls_before,
+    )
+    return results
+
+
+def find_regressions(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns messages for every benchmark whose median exceeds the baseline's by more than tolerance."""
+    regressions = []
+    for size, benchmarks in report["results"].items():
+        for name, summary in benchmarks.items():
+            previous = baseline.get("results", {}).get(size, {}).get(name)
+            if previous and name != "seed" and summary["median"] > previous["median"] * (1 + tolerance):
+                regressions.append(
+                    f"{name} at {size} documents: {summary['median']:.4f}s, baseline {previous['median']:.4f}s"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AMA-B viewer on generated corpora.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma-separated corpus sizes (default: 10000,100000,1000000).")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Runs per benchmark (default: 3).")
+    parser.add_argument("--database", default=BENCHMARK_DATABASE_PREFIX)
+    parser.add_argument("--unique-goals", action="store_true",
+                        help="Give every document its own information_goal, like the real collection.")
+    parser.add_argument("--llm-delay", type=float, default=DEFAULT_DELAY, help="Seconds per stub LLM request.")
+    parser.add_argument("--report", default="benchmark_report.json", help="Path of the JSON report.")
+    parser.add_argument("--baseline", help="Report of an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if not args.database.startswith(BENCHMARK_DATABASE_PREFIX):
+        parser.error(f"--database must start with '{BENCHMARK_DATABASE_PREFIX}'; it is dropped and reseeded.")
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with StubLLMServer(delay=args.llm_delay) as stub:
+        os.environ["MONGO_DB_NAME"] = args.database
+        os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+        os.environ["STRAICO_BASE_URL"] = stub.url
+        os.environ["STRAICO_API_KEY"] = "benchmark"
+        from database import get_db
+
+        db = get_db()
+        report = {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "mongodb": db.client.server_info()["version"],
+            "seed": args.seed,
+            "unique_goals": args.unique_goals,
+            "repeat": args.repeat,
+            "llm_delay": args.llm_delay,
+            "results": {},
+        }
+        for size in sizes:
+            report["results"][str(size)] = benchmark_size(db, size, args.seed, args.repeat, stub, args.unique_goals)
+            for name, summary in report["results"][str(size)].items():
+                print(f"{size:>9} {name:<45} median {summary['median']:.4f}s")
+
+    with open(args.report, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"Report written to {args.report}.")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            regressions = find_regressions(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
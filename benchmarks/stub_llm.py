@@ -0,0 +1,79 @@
+# benchmarks/stub_llm.py
+# Local stand-in for the Straico prompt completion API: maps every term of a mapping prompt to a canonical
+# form after a fixed delay, so the mapping pipeline can be timed and tested without API costs or network
+# jitter. It can also rate-limit the first requests and cut off long replies, to exercise the retries.
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_DELAY = 0.05  # seconds per request
+
+
+def first_word(term):
+    return str(term).strip().split(" ")[0].capitalize()
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        stub = self.server
+        if stub.record_call() <= stub.rate_limited_calls:
+            self._respond(429, {"success": False, "error": "rate limited"})
+            return
+        time.sleep(stub.delay)
+        terms = json.loads(body["message"].split("**NEW TERMS TO MAP:**")[1].split("\n\nRespond")[0])
+        content = json.dumps({term: stub.canonical(term) for term in terms}, ensure_ascii=False)
+        if stub.max_terms and len(terms) > stub.max_terms:
+            # Cut off mid-JSON, like a reply hitting the output limit
+            content = content[: len(content) // 2]
+        self._respond(201, {"success": True, "data": {"completion": {"choices": [{"message": {"content": content}}]}}})
+
+    def _respond(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """Serves StubLLMHandler on a free local port in a background thread and counts the requests.
+
+    The first rate_limited_calls requests are answered with 429, and replies to batches of more than
+    max_terms terms are truncated. delay and max_terms may be changed while the server runs.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay=DEFAULT_DELAY, canonical=first_word, rate_limited_calls=0, max_terms=None):
+        super().__init__(("127.0.0.1", 0), StubLLMHandler)
+        self.delay = delay
+        self.canonical = canonical
+        self.rate_limited_calls = rate_limited_calls
+        self.max_terms = max_terms
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def record_call(self):
+        """Counts a request and returns its number, starting at 1."""
+        with self._lock:
+            self.calls += 1
+            return self.calls
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,60 @@
+# category_mapping.py
+# In-memory view of the category_mappings collection used to fold raw terms into canonical terms.
+
+import threading
+from collections import Counter
+
+from data_version import MAPPINGS_COLLECTION, get_data_version
+
+
+class MappingSnapshot:
+    """Holds {original_term: canonical_term} and reloads it only when the mappings version changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._mappings = {}
+
+    def get(self, db):
+        version = get_data_version(db).mappings
+        with self._lock:
+            if self._version != version:
+                self._mappings = load_mappings(db)
+                self._version = version
+            return self._mappings
+
+
+def load_mappings(db):
+    """Reads every mapping into a dict. Mappings without a target are ignored."""
+    return {
+        doc["_id"]: doc["target"]
+        for doc in db[MAPPINGS_COLLECTION].find({}, {"target": 1})
+        if doc.get("target") is not None
+    }
+
+
+def fold_counts(rows, mappings):
+    """Merges grouped [{'_id': term, 'count': n}] rows by their canonical term, most frequent first.
+
+    Grouping happens on the raw values first, so this runs once per distinct term
+    instead of once per tag occurrence.
+    """
+    counts = Counter()
+    # Non-hashable values (arrays, sub-documents) cannot be mapped and are passed through unchanged
+    passthrough = []
+    for row in rows:
+        try:
+            counts[mappings.get(row["_id"], row["_id"])] += row["count"]
+        except TypeError:
+            passthrough.append(row)
+    folded = [{"_id": term, "count": count} for term, count in counts.items()] + passthrough
+    folded.sort(key=lambda row: row["count"], reverse=True)
+    return folded
+
+
+_snapshot = MappingSnapshot()
+
+
+def get_mappings(db):
+    """Returns the process-wide mapping snapshot, reloading it if category_mappings changed."""
+    return _snapshot.get(db)
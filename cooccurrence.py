@@ -0,0 +1,154 @@
+# cooccurrence.py
+# Co-occurrence of the terms of any two dimensions (tag fields or question fields), raw or folded into
+# canonical terms, computed from the columnar analytics snapshot instead of a double $unwind per pair.
+#
+# For a dimension, the snapshot's CSR columns form a binary document x term incidence matrix. The
+# co-occurrence matrix of two dimensions is the sparse product A^T B of their incidence matrices: entry
+# (x, y) is the number of documents that contain both x and y. It is built with NumPy on the sparse
+# (document, term) entries, and weighted on demand by count, pointwise mutual information or lift.
+
+import numpy as np
+
+from aggregations import QUESTION_DIMENSIONS
+from category_mapping import get_mappings
+from data_version import get_data_version
+
+# Dimensions that can be paired: name -> (field path, folded into canonical terms by default)
+COOCCURRENCE_DIMENSIONS = {
+    "bibelreferenzen": ("tags.bibelreferenzen", False),
+    "hauptthemen": ("tags.hauptthemen", True),
+    "theologische_konzepte": ("tags.theologische_konzepte", True),
+    **QUESTION_DIMENSIONS,
+}
+WEIGHTS = ["count", "pmi", "lift"]
+DEFAULT_TOP_K = 20
+MAX_TOP_K = 1000
+
+
+def incidence(generation, field_path, canonical_fold=None):
+    """Returns (terms, doc ids, term ids) of the non-zero entries of a dimension's binary incidence matrix.
+
+    canonical_fold is a (canonical terms, canonical id of every term id) pair as returned by
+    SnapshotGeneration.canonical_fold; without it, the raw terms are used. Entries are sorted by
+    document, and a term occurring several times in one document (e.g. two variants of the same
+    canonical term) is counted once.
+    """
+    terms = generation.vocabularies[field_path]
+    doc_ids, term_ids = generation.entries(field_path)
+    if canonical_fold is not None:
+        terms, term_to_canonical = canonical_fold
+        term_ids = term_to_canonical[term_ids]
+    keys = np.unique(doc_ids * max(len(terms), 1) + term_ids)
+    return terms, keys // max(len(terms), 1), keys % max(len(terms), 1)
+
+
+def sparse_product(x_docs, x_terms, y_docs, y_terms, document_count):
+    """Returns (x ids, y ids, counts) of the non-zero entries of A^T B for two incidence matrices.
+
+    Both inputs are sorted by document. Every x entry of a document is paired with every y entry of
+    the same document, and equal (x, y) pairs are summed.
+    """
+    y_per_doc = np.bincount(y_docs, minlength=document_count)
+    y_start = np.concatenate([[0], np.cumsum(y_per_doc)[:-1]])
+    repeats = y_per_doc[x_docs]
+    pair_x = np.repeat(x_terms, repeats)
+    # Position of each pair within its x entry's run, offset by the start of that document's y entries
+    run_start = np.repeat(np.cumsum(repeats) - repeats, repeats)
+    pair_y = y_terms[np.repeat(y_start[x_docs], repeats) + np.arange(len(pair_x)) - run_start]
+    y_size = int(y_terms.max()) + 1 if len(y_terms) else 1
+    keys, counts = np.unique(pair_x * y_size + pair_y, return_counts=True)
+    return keys // y_size, keys % y_size, counts
+
+
+class CooccurrenceMatrix:
+    """Document co-occurrence counts of the terms of two dimensions, with their document frequencies."""
+
+    def __init__(self, x_terms, y_terms, rows, cols, counts, x_frequencies, y_frequencies, document_count,
+                 symmetric=False):
+        self.x_terms = x_terms
+        self.y_terms = y_terms
+        self.rows = rows
+        self.cols = cols
+        self.counts = counts
+        self.x_frequencies = x_frequencies
+        self.y_frequencies = y_frequencies
+        self.document_count = document_count
+        self.symmetric = symmetric
+        self._x_index = None
+
+    def weights(self, weight="count"):
+        """Returns the weight of every non-zero entry: its count, its PMI (log2) or its lift."""
+        if weight == "count":
+            return self.counts.astype(np.float64)
+        lift = (self.counts * self.document_count) / (
+            self.x_frequencies[self.rows].astype(np.float64) * self.y_frequencies[self.cols]
+        )
+        if weight == "lift":
+            return lift
+        if weight == "pmi":
+            return np.log2(lift)
+        raise ValueError(f"Unknown weight '{weight}'. Use one of: {', '.join(WEIGHTS)}.")
+
+    def _strongest(self, selected, weight, top_k):
+        weights = self.weights(weight)[selected]
+        # Strongest first; equal weights are ordered by the number of shared documents
+        order = np.lexsort((-self.counts[selected], -weights))[:top_k]
+        return selected[order], weights[order]
+
+    def _pair(self, entry, value):
+        return {
+            "source": self.x_terms[self.rows[entry]],
+            "target": self.y_terms[self.cols[entry]],
+            "count": int(self.counts[entry]),
+            "weight": float(value),
+        }
+
+    def top_pairs(self, weight="count", top_k=DEFAULT_TOP_K, min_count=1):
+        """Returns the top_k strongest pairs that share at least min_count documents."""
+        selected = self.counts >= min_count
+        if self.symmetric:
+            # Pairing a dimension with itself: skip the diagonal and the mirrored half
+            selected &= self.rows < self.cols
+        entries, values = self._strongest(np.flatnonzero(selected), weight, top_k)
+        return [self._pair(entry, value) for entry, value in zip(entries, values)]
+
+    def neighbours(self, term, weight="count", top_k=DEFAULT_TOP_K, min_count=1):
+        """Returns the top_k strongest partners of an x term, or None if the term does not occur."""
+        if self._x_index is None:
+            self._x_index = {value: index for index, value in enumerate(self.x_terms)}
+        index = self._x_index.get(term)
+        if index is None or not self.x_frequencies[index]:
+            return None
+        selected = (self.rows == index) & (self.counts >= min_count)
+        if self.symmetric:
+            selected &= self.cols != index
+        entries, values = self._strongest(np.flatnonzero(selected), weight, top_k)
+        return [self._pair(entry, value) for entry, value in zip(entries, values)]
+
+
+def build_matrix(generation, x_field, y_field, x_fold=None, y_fold=None):
+    """Computes the CooccurrenceMatrix of two fields of a snapshot generation."""
+    document_count = generation.document_count
+    x_terms, x_docs, x_ids = incidence(generation, x_field, x_fold)
+    y_terms, y_docs, y_ids = incidence(generation, y_field, y_fold)
+    rows, cols, counts = sparse_product(x_docs, x_ids, y_docs, y_ids, document_count)
+    return CooccurrenceMatrix(
+        x_terms, y_terms, rows, cols, counts,
+        np.bincount(x_ids, minlength=len(x_terms)), np.bincount(y_ids, minlength=len(y_terms)),
+        document_count, symmetric=x_field == y_field and x_fold is y_fold,
+    )
+
+
+def cooccurrence_matrix(db, generation, x, y, x_mapped=None, y_mapped=None):
+    """Returns the CooccurrenceMatrix of two dimensions of COOCCURRENCE_DIMENSIONS in a snapshot generation.
+
+    x_mapped / y_mapped fold the terms into their canonical terms; None uses the dimension's default.
+    """
+    folds = []
+    for name, mapped in ((x, x_mapped), (y, y_mapped)):
+        field_path, mapped_by_default = COOCCURRENCE_DIMENSIONS[name]
+        if mapped if mapped is not None else mapped_by_default:
+            folds.append(generation.canonical_fold(field_path, get_mappings(db), get_data_version(db).mappings))
+        else:
+            folds.append(None)
+    return build_matrix(generation, COOCCURRENCE_DIMENSIONS[x][0], COOCCURRENCE_DIMENSIONS[y][0], *folds)
@@ -0,0 +1,60 @@
+# data_version.py
+# Tracks a version token per collection so that derived results (caches, ETags) can be invalidated.
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+SOURCE_COLLECTION = "ama_log"
+MAPPINGS_COLLECTION = "category_mappings"
+NETWORK_CACHE_COLLECTION = "ama_log_network_cache"
+VERSIONS_COLLECTION = "data_versions"
+
+# Reading the version costs two small queries; it is re-read at most once per interval unless bumped locally.
+VERSION_CHECK_INTERVAL = float(os.getenv("DATA_VERSION_CHECK_INTERVAL", "2"))
+
+DataVersion = namedtuple("DataVersion", ["source", "mappings", "network_cache"])
+
+_lock = threading.Lock()
+_cached_version = None
+_checked_at = 0.0
+
+
+def bump_version(db, collection_name):
+    """Records a write to a collection. Counters live in MongoDB so every process sees the change."""
+    db[VERSIONS_COLLECTION].update_one({"_id": collection_name}, {"$inc": {"version": 1}}, upsert=True)
+    invalidate_local_version()
+
+
+def invalidate_local_version():
+    """Forces the next get_data_version() call to re-read the counters."""
+    global _cached_version
+    with _lock:
+        _cached_version = None
+
+
+def _read_data_version(db):
+    counters = {doc["_id"]: doc.get("version", 0) for doc in db[VERSIONS_COLLECTION].find()}
+    # Documents are inserted by an external producer that does not bump a counter; ObjectIds grow
+    # monotonically, so the newest _id changes whenever new documents arrive.
+    newest_doc = db[SOURCE_COLLECTION].find_one(sort=[("_id", -1)], projection={"_id": 1})
+    newest_id = str(newest_doc["_id"]) if newest_doc else None
+    return DataVersion(
+        source=(counters.get(SOURCE_COLLECTION, 0), newest_id),
+        mappings=counters.get(MAPPINGS_COLLECTION, 0),
+        network_cache=counters.get(NETWORK_CACHE_COLLECTION, 0),
+    )
+
+
+def get_data_version(db):
+    """Returns the current DataVersion, re-reading it from MongoDB at most every VERSION_CHECK_INTERVAL seconds."""
+    global _cached_version, _checked_at
+    with _lock:
+        if _cached_version is not None and time.monotonic() - _checked_at < VERSION_CHECK_INTERVAL:
+            return _cached_version
+    version = _read_data_version(db)
+    with _lock:
+        _cached_version = version
+        _checked_at = time.monotonic()
+    return version
@@ -0,0 +1,74 @@
+# database.py
+# The process-wide MongoDB client shared by the web application, the mapping workers and the command
+# line tools. The client is created on first use and connects lazily, so importing a module or forking
+# a worker process does not open connections; every process then reuses one connection pool.
+
+import os
+import threading
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+from instrumentation import mongo_command_listener
+
+load_dotenv()
+
+DB_NAME = os.getenv("MONGO_DB_NAME", "ama_browser")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+# e.g. 'secondaryPreferred' to move the dashboards' reads off the primary of a replica set
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def client_options():
+    """Returns the MongoClient keyword arguments built from the MONGO_* settings."""
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+        # Attributes commands to requests for the Server-Timing header and /metrics
+        "event_listeners": [mongo_command_listener],
+        # No connection until the first operation; importing and forking stay cheap
+        "connect": False,
+    }
+
+
+def get_client():
+    """Returns the client of the current process, creating it on first use."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            # A client inherited through fork() is not safe to use; the child builds its own pool
+            mongodb_uri = os.getenv("MONGODB_URI")
+            if not mongodb_uri:
+                raise ValueError("MONGODB_URI is not set. Please check the environment variable or .env file.")
+            _client = MongoClient(mongodb_uri, **client_options())
+            _client_pid = pid
+    return _client
+
+
+def get_db():
+    """Returns the application database (ama_browser unless MONGO_DB_NAME is set) on the shared client."""
+    return get_client()[DB_NAME]
+
+
+def close_client():
+    """Closes the client of the current process; the next get_client() opens a new one."""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client, _client_pid = None, None
@@ -0,0 +1,119 @@
+# document_export.py
+# Keyset pagination and streaming export of ama_log documents for downstream analytics.
+
+import csv
+import io
+import itertools
+import json
+import re
+from datetime import datetime
+
+from bson import ObjectId
+
+from category_mapping import get_mappings
+from data_version import SOURCE_COLLECTION
+from llm_mapper import FIELDS_TO_MAP
+from projections import get_path
+
+DEFAULT_EXPORT_FIELDS = ["question_abstraction", "tags"]
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 500
+FIELD_PATH_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+
+class MongoJSONEncoder(json.JSONEncoder):
+    """Encodes the BSON types found in ama_log documents."""
+
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        return json.JSONEncoder.default(self, obj)
+
+
+def parse_fields(fields_argument):
+    """Parses a comma-separated list of dotted field paths. Raises ValueError for invalid paths."""
+    if not fields_argument:
+        return list(DEFAULT_EXPORT_FIELDS)
+    fields = [field.strip() for field in fields_argument.split(",") if field.strip()]
+    invalid = [field for field in fields if not FIELD_PATH_PATTERN.match(field)]
+    if invalid:
+        raise ValueError(f"Invalid field path(s): {', '.join(invalid)}")
+    return fields
+
+
+def build_projection(field_paths):
+    """Builds an inclusion projection, dropping paths already covered by a parent path (MongoDB rejects those)."""
+    projection = {}
+    for path in sorted(set(field_paths)):
+        if not any(path.startswith(included + ".") for included in projection):
+            projection[path] = 1
+    return projection
+
+
+def canonical_terms(doc, mappings):
+    """Returns {field_path: canonical value(s)} for every mapped field present in the document."""
+    canonical = {}
+    for field_path in FIELDS_TO_MAP:
+        value = get_path(doc, field_path)
+        if isinstance(value, list):
+            canonical[field_path] = [mappings.get(term, term) if isinstance(term, str) else term for term in value]
+        elif isinstance(value, str):
+            canonical[field_path] = mappings.get(value, value)
+    return canonical
+
+
+def build_keyset_filter(after_id=None):
+    """Builds the filter of the documents following after_id, read in _id order."""
+    return {"_id": {"$gt": after_id}} if after_id else {}
+
+
+def find_page(db, after_id=None, limit=DEFAULT_PAGE_SIZE, fields=None):
+    """Returns ({'documents': [...], 'next_after': id or None}) for the documents following after_id."""
+    projection = build_projection(fields or DEFAULT_EXPORT_FIELDS)
+    documents = list(db[SOURCE_COLLECTION].find(build_keyset_filter(after_id), projection).sort("_id", 1).limit(limit))
+    # A full page means there may be more; the client continues with ?after=<next_after>
+    next_after = documents[-1]["_id"] if len(documents) == limit else None
+    return {"documents": documents, "next_after": next_after}
+
+
+def iter_export_records(db, fields, include_canonical=False, after_id=None):
+    """Yields one flat record per document in _id order, reading the collection in batches."""
+    projection = build_projection(fields + (FIELDS_TO_MAP if include_canonical else []))
+    mappings = get_mappings(db) if include_canonical else None
+    cursor = db[SOURCE_COLLECTION].find(build_keyset_filter(after_id), projection).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    for doc in cursor:
+        record = {"_id": doc["_id"]}
+        for field in fields:
+            record[field] = get_path(doc, field)
+        if include_canonical:
+            record["canonical"] = canonical_terms(doc, mappings)
+        yield record
+
+
+def to_ndjson(records):
+    for record in records:
+        yield json.dumps(record, cls=MongoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def _csv_cell(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, ObjectId):
+        return str(value)
+    # Nested values (sub-documents, tag arrays) are written as JSON inside the cell
+    return json.dumps(value, cls=MongoJSONEncoder, ensure_ascii=False)
+
+
+def to_csv(records, fields, include_canonical=False):
+    columns = ["_id"] + fields + (["canonical"] if include_canonical else [])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    rows = ([_csv_cell(record.get(column)) for column in columns] for record in records)
+    for row in itertools.chain([columns], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
@@ -0,0 +1,59 @@
+# gunicorn.conf.py
+# Production server settings; gunicorn reads this file from the working directory.
+#
+# Usage:
+#   gunicorn                                  # uses wsgi_app below
+#   WEB_CONCURRENCY=4 GUNICORN_THREADS=16 gunicorn
+#
+# Each worker process serves requests on a pool of threads (the 'gthread' worker), so that the
+# Server-Sent Events streams of the tags dashboard do not block a whole process. With preload_app
+# the application and its warm caches are built once in the master process and shared by the
+# forked workers; every worker opens its own MongoDB pool on first use (see database.py).
+
+import multiprocessing
+import os
+
+from database import close_client
+
+wsgi_app = "main:create_app(start_mapping_workers=False)"
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Idle keep-alive connections hold a thread only between requests; a few seconds suit a reverse proxy
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Recycling workers bounds the growth of the in-process caches; the jitter avoids simultaneous restarts
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+
+
+def when_ready(server):
+    if preload_app and os.getenv("WARM_CACHES_ON_STARTUP", "1") == "1":
+        import main
+        try:
+            main.warm_caches()
+        except Exception as e:
+            server.log.warning(f"Could not warm the caches: {e}")
+    # The master does not serve requests; its connections must not be inherited by the workers
+    close_client()
+
+
+def post_worker_init(worker):
+    from mapping_jobs import MAPPING_WORKERS
+    if MAPPING_WORKERS > 0:
+        worker.wsgi.extensions["mapping_workers"].start()
+
+
+def worker_exit(server, worker):
+    # A running mapping job stops at its next checkpoint and goes back to the queue for another worker
+    mapping_workers = getattr(worker, "wsgi", None) and worker.wsgi.extensions.get("mapping_workers")
+    if mapping_workers:
+        mapping_workers.stop(timeout=graceful_timeout)
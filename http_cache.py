@@ -0,0 +1,91 @@
+# http_cache.py
+# Conditional requests and compression for the dashboard JSON APIs. The ETag of a response is derived
+# from the data version of the collections it is computed from, so a client holding the current body
+# gets a 304 without the aggregation running, and other clients share one compressed body.
+
+import functools
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, make_response, request
+
+from data_version import get_data_version
+from database import get_db
+
+API_CACHE_MAX_AGE = int(os.getenv("API_CACHE_MAX_AGE", "0"))  # seconds a browser may skip revalidation
+GZIP_MIN_SIZE = 1024  # bytes; smaller bodies are not worth compressing
+GZIP_LEVEL = 6
+COMPRESSED_BODY_CACHE_SIZE = 64
+
+
+def make_etag(version_parts, path, query_string):
+    """Returns the ETag for a response computed at the given data version parts for path and query."""
+    digest = hashlib.sha1(repr((version_parts, path, query_string)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CompressedBodyCache:
+    """Keeps the most recent gzip-compressed bodies, so an unchanged body is compressed only once."""
+
+    def __init__(self, max_entries=COMPRESSED_BODY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, body):
+        # Hashing is an order of magnitude cheaper than compressing
+        key = hashlib.sha1(body).digest()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        with self._lock:
+            self._entries[key] = compressed
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compressed
+
+
+compressed_bodies = CompressedBodyCache()
+
+
+def _set_cache_headers(response, etag):
+    response.set_etag(etag, weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = API_CACHE_MAX_AGE
+    response.cache_control.must_revalidate = True
+    response.vary.add("Accept-Encoding")
+
+
+def conditional_json(*dependencies):
+    """Decorates a JSON view whose body depends only on the named DataVersion fields and the request URL.
+
+    A request whose If-None-Match carries the current ETag gets a 304 before the view runs. Other
+    successful responses get the ETag and Cache-Control headers and, if the client accepts it, a
+    gzip-compressed body. Error responses and responses the view marked no-store pass through unchanged.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version = get_data_version(get_db())
+            etag = make_etag(tuple(getattr(version, name) for name in dependencies), request.path, request.query_string)
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                _set_cache_headers(response, etag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.cache_control.no_store:
+                return response
+            _set_cache_headers(response, etag)
+            body = response.get_data()
+            if len(body) >= GZIP_MIN_SIZE and request.accept_encodings["gzip"] > 0:
+                response.set_data(compressed_bodies.get(body))
+                response.headers["Content-Encoding"] = "gzip"
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,184 @@
+# index_manager.py
+# Declares the indexes required by the application's query shapes, creates them and audits query plans.
+#
+# Usage:
+#   python index_manager.py ensure   # create missing indexes
+#   python index_manager.py audit    # explain every pipeline and report COLLSCANs and in-memory sorts
+
+import argparse
+import json
+import sys
+
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from aggregations import (
+    HIGH_CARDINALITY_FIELDS,
+    QUESTION_DIMENSIONS,
+    TAG_FIELDS,
+    build_facet_pipeline,
+    build_field_pipeline,
+    facet_dimensions,
+)
+from data_version import MAPPINGS_COLLECTION, SOURCE_COLLECTION
+from database import get_db
+from document_export import DEFAULT_EXPORT_FIELDS, build_keyset_filter, build_projection
+from llm_mapper import (
+    FIELDS_TO_MAP, LLM_CACHE_TTL_DAYS, RESPONSE_CACHE_COLLECTION, build_unmapped_terms_field_pipeline,
+    build_unmapped_terms_pipeline,
+)
+from mapping_jobs import JOBS_COLLECTION, job_indexes
+from navigation import build_document_with_neighbours_pipeline
+from network_graph import SOURCE_FIELD, TARGET_FIELD, build_links_pipeline, build_new_documents_query
+from projections import projection_for_view
+
+QUESTION_FIELDS = [field_path for field_path, _ in QUESTION_DIMENSIONS.values()]
+
+# Stands in for a document id in the audited query shapes; the plan does not depend on its value
+SAMPLE_ID = ObjectId("0" * 24)
+
+# Plan stages that indicate a missing or unusable index. A $sort after $group works on the grouped
+# result, is not part of the query plan and is therefore not reported.
+PROBLEM_STAGES = {"COLLSCAN": "collection scan", "SORT": "in-memory sort"}
+
+
+def _partial_index(field_path):
+    # Every hot query filters with {field: {"$exists": True, ...}}, so documents without the field never need
+    # an index entry. For the tag arrays the index is multikey: one entry per array element.
+    return IndexModel(
+        [(field_path, ASCENDING)],
+        name=f"{field_path}_partial",
+        partialFilterExpression={field_path: {"$exists": True}},
+    )
+
+
+def declared_indexes():
+    """Returns {collection_name: [IndexModel, ...]} for all indexes the application relies on."""
+    source_fields = list(dict.fromkeys(TAG_FIELDS + QUESTION_FIELDS + FIELDS_TO_MAP))
+    return {
+        SOURCE_COLLECTION: [_partial_index(field_path) for field_path in source_fields],
+        MAPPINGS_COLLECTION: [
+            # Serves distinct("target") and mapping snapshot reads from the index alone
+            IndexModel([("target", ASCENDING), ("_id", ASCENDING)], name="target_covering"),
+            # Lets incremental runs select the mappings of one field written since a given time
+            IndexModel([("field_path", ASCENDING), ("updated_at", ASCENDING)], name="field_path_updated_at"),
+        ],
+        RESPONSE_CACHE_COLLECTION: [
+            # Cached replies embed the preferred canons of their run and go stale as the canons evolve
+            IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=LLM_CACHE_TTL_DAYS * 86400),
+        ],
+        JOBS_COLLECTION: job_indexes(),
+    }
+
+
+def ensure_indexes(db):
+    """Creates every declared index that does not exist yet and returns the names that could not be created."""
+    failed = []
+    for collection_name, index_models in declared_indexes().items():
+        for index_model in index_models:
+            name = index_model.document["name"]
+            try:
+                db[collection_name].create_indexes([index_model])
+            except OperationFailure as e:
+                # Typically an existing index with the same keys but different options; it is left untouched.
+                print(f"Could not create index '{name}' on '{collection_name}': {e}")
+                failed.append(name)
+    return failed
+
+
+def audited_query_shapes():
+    """Returns (name, collection, kind, query) for every query shape the application issues."""
+    faceted_dimensions = facet_dimensions(QUESTION_DIMENSIONS)
+    shapes = [("questions_categorization", SOURCE_COLLECTION, "aggregate", build_facet_pipeline(faceted_dimensions))]
+    for field_path in TAG_FIELDS + QUESTION_FIELDS:
+        shapes.append((f"aggregate_field:{field_path}", SOURCE_COLLECTION, "aggregate", build_field_pipeline(field_path)))
+    shapes.append((f"network:{SOURCE_FIELD}x{TARGET_FIELD}", SOURCE_COLLECTION, "aggregate", build_links_pipeline()))
+    refresh_filter, refresh_projection = build_new_documents_query(SAMPLE_ID, SAMPLE_ID)
+    shapes.append((
+        "network:refresh_new_documents", SOURCE_COLLECTION, "find",
+        {"filter": refresh_filter, "projection": refresh_projection},
+    ))
+    faceted_fields = [field_path for field_path in FIELDS_TO_MAP if field_path not in HIGH_CARDINALITY_FIELDS]
+    shapes.append(("unmapped_terms", SOURCE_COLLECTION, "aggregate", build_unmapped_terms_pipeline(faceted_fields)))
+    for field_path in FIELDS_TO_MAP:
+        if field_path in HIGH_CARDINALITY_FIELDS:
+            pipeline = build_unmapped_terms_field_pipeline(field_path)
+            shapes.append((f"unmapped_terms:{field_path}", SOURCE_COLLECTION, "aggregate", pipeline))
+    shapes.append(("canonical_terms", MAPPINGS_COLLECTION, "distinct", "target"))
+    shapes.append(("navigation:first", SOURCE_COLLECTION, "find", {"filter": {}, "sort": {"_id": 1}}))
+    shapes.append(("navigation:last", SOURCE_COLLECTION, "find", {"filter": {}, "sort": {"_id": -1}}))
+    shapes.append((
+        "navigation:document_with_neighbours", SOURCE_COLLECTION, "aggregate",
+        build_document_with_neighbours_pipeline(SAMPLE_ID, projection_for_view("all")),
+    ))
+    # Pages of /api/documents and /api/export
+    shapes.append((
+        "documents:keyset", SOURCE_COLLECTION, "find",
+        {"filter": build_keyset_filter(SAMPLE_ID), "sort": {"_id": 1}, "projection": build_projection(DEFAULT_EXPORT_FIELDS)},
+    ))
+    return shapes
+
+
+def _explain(db, collection_name, kind, query):
+    if kind == "aggregate":
+        command = {"aggregate": collection_name, "pipeline": query, "cursor": {}}
+    elif kind == "distinct":
+        command = {"distinct": collection_name, "key": query}
+    else:
+        command = {"find": collection_name, "limit": 1, **query}
+    return db.command("explain", command, verbosity="queryPlanner")
+
+
+def find_problem_stages(explain_output):
+    """Returns the problem stages found in the winning plans of an explain result."""
+    problems = []
+
+    def walk(node, in_winning_plan):
+        if isinstance(node, dict):
+            stage = node.get("stage")
+            if in_winning_plan and stage in PROBLEM_STAGES:
+                problems.append(PROBLEM_STAGES[stage])
+            for key, value in node.items():
+                # Rejected plans are alternatives the planner discarded and must not be reported
+                if key == "rejectedPlans":
+                    continue
+                walk(value, in_winning_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_winning_plan)
+
+    walk(explain_output, False)
+    return problems
+
+
+def audit_query_plans(db):
+    """Explains every query shape and returns a list of {'query', 'collection', 'problems'} reports."""
+    reports = []
+    for name, collection_name, kind, query in audited_query_shapes():
+        try:
+            problems = find_problem_stages(_explain(db, collection_name, kind, query))
+        except OperationFailure as e:
+            problems = [f"explain failed: {e}"]
+        reports.append({"query": name, "collection": collection_name, "problems": problems})
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage and audit the MongoDB indexes of the AMA-B viewer.")
+    parser.add_argument("command", choices=["ensure", "audit"])
+    args = parser.parse_args(argv)
+
+    db = get_db()
+    if args.command == "ensure":
+        failed = ensure_indexes(db)
+        print("All indexes are in place." if not failed else f"Indexes not created: {', '.join(failed)}")
+        return 1 if failed else 0
+
+    reports = audit_query_plans(db)
+    print(json.dumps(reports, indent=2, ensure_ascii=False))
+    return 1 if any(report["problems"] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# instrumentation.py
+# Request-level instrumentation. A pymongo CommandListener attributes every MongoDB command to the
+# request that issued it; each response reports its db, markdown and render time in a Server-Timing
+# header, and /metrics serves the process's counters and histograms in the Prometheus text format.
+#
+# Metrics live in the memory of each process: with several gunicorn workers, every scrape reaches one
+# of them, so scrape each worker (or run a single worker per container) for complete numbers.
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, before_render_template, g, request, template_rendered
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label combination."""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label combination, with their sum and count."""
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._series[key] = (counts, total + value)
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(tuple(labels[name] for name in self.labels))
+            return series[0][-1] if series else 0
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, key, [("le", _format_number(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+
+def render_metrics():
+    """Returns all metrics of this process in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time until the response is returned, by route.", ("method", "route", "status")
+)
+HTTP_REQUEST_MONGO_COMMANDS = Histogram(
+    "http_request_mongodb_commands", "MongoDB commands issued per request, by route.", ("route",), COMMAND_COUNT_BUCKETS
+)
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongodb_command_duration_seconds", "Duration of MongoDB commands, by command name.", ("command",)
+)
+MONGO_COMMAND_FAILURES = Counter("mongodb_command_failures_total", "Failed MongoDB commands, by command name.", ("command",))
+
+
+class RequestTimings:
+    """Seconds spent per phase (db, markdown, render) and MongoDB commands issued while serving one request."""
+
+    def __init__(self):
+        self.phases = {}
+        self.db_commands = 0
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_command(self, seconds):
+        with self._lock:
+            self.db_commands += 1
+            self.phases["db"] = self.phases.get("db", 0.0) + seconds
+
+    def server_timing(self, total_seconds):
+        """Returns the Server-Timing header value, durations in milliseconds."""
+        with self._lock:
+            entries = [f'db;dur={self.phases.get("db", 0.0) * 1000:.1f};desc="{self.db_commands} commands"']
+            entries += [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in self.phases.items() if phase != "db"]
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# Commands run on the thread of the request that issues them; threads started by a request (e.g. the
+# parallel categorization mode) do not inherit it, and their commands only reach the process metrics.
+_current_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def timed(phase):
+    """Adds the time spent in the block to the given phase of the current request, if any."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(phase, time.perf_counter() - started)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records the duration of every command in the process metrics and in the current request's timings."""
+
+    def started(self, event):
+        pass
+
+    def _record(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.observe(seconds, command=event.command_name)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add_command(seconds)
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        MONGO_COMMAND_FAILURES.inc(command=event.command_name)
+        self._record(event)
+
+
+mongo_command_listener = MongoCommandListener()
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.request_timings = RequestTimings()
+    g.request_timings_token = _current_timings.set(g.request_timings)
+
+
+def _finish_request(response):
+    timings = g.get("request_timings")
+    if timings is None:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    # The rule, not the path, so that /view/<id> is one series instead of one per document
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=str(response.status_code))
+    HTTP_REQUEST_MONGO_COMMANDS.observe(timings.db_commands, route=route)
+    response.headers["Server-Timing"] = timings.server_timing(elapsed)
+    return response
+
+
+def _end_request(exception=None):
+    token = g.pop("request_timings_token", None)
+    if token is not None:
+        _current_timings.reset(token)
+
+
+def _start_render(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def _stop_render(sender, template, context, **extra):
+    started = g.pop("render_started", None)
+    timings = g.get("request_timings")
+    if started is not None and timings is not None:
+        timings.add("render", time.perf_counter() - started)
+
+
+def metrics():
+    return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def init_app(app):
+    """Adds the per-request timings, the Server-Timing header and the /metrics endpoint to app."""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_stop_render, app)
+    app.add_url_rule("/metrics", "metrics", metrics)
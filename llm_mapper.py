@@ -1,23 +1,53 @@
 # llm_mapper.py
 # This script will contain the logic for semantic category aggregation using an LLM.
 
+import asyncio
+import hashlib
+import logging
 import os
 import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+import httpx
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from aio_straico import straico_client
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from aio_straico import aio_straico_client
+from aggregations import HIGH_CARDINALITY_FIELDS
+from data_version import MAPPINGS_COLLECTION, SOURCE_COLLECTION, bump_version
+from database import get_db
+from instrumentation import Counter, Histogram
+from batch_planner import MAX_BATCH_TERMS, AdaptiveBatchSize, BatchPlanner
+from term_normalization import CANON_CANDIDATES_PER_BATCH, CanonTfidfIndex, estimate_tokens
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- Configuration ---
-MONGO_URI = os.getenv("MONGODB_URI")
 STRAICO_API_KEY = os.getenv("STRAICO_API_KEY")
-DB_NAME = "ama_browser"  # Explicitly set the correct database name
-SOURCE_COLLECTION = "ama_log"
-MAPPINGS_COLLECTION = "category_mappings"
+RESPONSE_CACHE_COLLECTION = "llm_response_cache"
 LLM_MODEL = 'anthropic/claude-3.5-sonnet'
 #LLM_MODEL = 'google/gemini-2.5-flash'
+# Point STRAICO_BASE_URL at a local stub server to exercise the mapper without the real API
+STRAICO_BASE_URL = os.getenv("STRAICO_BASE_URL")
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_TIMEOUT = 120  # seconds per request
+LLM_BACKOFF_BASE = 1.0  # seconds
+LLM_BACKOFF_MAX = 30.0
+MAPPING_WRITE_BATCH_SIZE = 1000
+LLM_CACHE_TTL_DAYS = int(os.getenv("LLM_CACHE_TTL_DAYS", "30"))
+
+LLM_BATCH_SECONDS = Histogram(
+    "llm_batch_duration_seconds", "Duration of mapping requests to the LLM API, including retries.",
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+LLM_BATCHES = Counter("llm_batches_total", "Mapping batches by outcome (success, failure, cache_hit).", ("outcome",))
+LLM_TOKENS = Counter("llm_tokens_total", "Estimated tokens sent to (prompt) and received from (completion) the LLM.", ("kind",))
 
 # Fields to be analyzed for mapping
 FIELDS_TO_MAP = [
@@ -30,58 +60,61 @@ FIELDS_TO_MAP = [
 ]
 
 
-# --- Database Connection ---
-def get_db():
-    """Establishes a connection to the MongoDB database."""
-    client = MongoClient(MONGO_URI)
-    return client[DB_NAME]
+def build_unmapped_terms_field_pipeline(field_path):
+    """Builds the stages that list the distinct, not yet mapped terms of one field."""
+    return [
+        {'$match': {field_path: {'$exists': True, '$ne': ""}}},
+        {'$unwind': f'${field_path}'},
+        {'$group': {'_id': f'${field_path}'}},
+        {'$match': {'_id': {'$nin': [None, ""]}}},
+        # Anti-join on the server: each lookup is a point read on the mappings' _id index
+        {'$lookup': {'from': MAPPINGS_COLLECTION, 'localField': '_id', 'foreignField': '_id', 'as': 'mapping'}},
+        {'$match': {'mapping': {'$size': 0}}},
+        {'$project': {'_id': 1}},
+    ]
 
 
-def get_unmapped_terms(db, field_path):
-    """Finds unique terms in the source collection that are not yet in the mappings collection."""
-    print(f"\n--- Analyzing field: {field_path} ---")
+def build_unmapped_terms_pipeline(field_paths):
+    """Builds one aggregation that lists the distinct, not yet mapped terms of several fields in a single scan.
 
-    pipeline = [
-        {'$match': {field_path: {'$exists': True, '$ne': None, '$ne': ""}}},
-        {'$project': {field_path: 1}},
-        {'$unwind': f'${field_path}'},
-        {'$group': {'_id': f'${field_path}'}}
+    $facet output names cannot contain dots, so the branches are named by position in field_paths.
+    """
+    return [
+        {'$match': {'$or': [{field_path: {'$exists': True, '$ne': ""}} for field_path in field_paths]}},
+        {'$project': {field_path: 1 for field_path in field_paths}},
+        {'$facet': {f'field_{i}': build_unmapped_terms_field_pipeline(field_path) for i, field_path in enumerate(field_paths)}},
     ]
-    try:
-        source_terms = {doc['_id'] for doc in db[SOURCE_COLLECTION].aggregate(pipeline) if doc['_id']}
-        print(f"Found {len(source_terms)} unique terms in source collection.")
-    except Exception as e:
-        print(f"Error fetching source terms for {field_path}: {e}")
-        return []
 
-    try:
-        if MAPPINGS_COLLECTION not in db.list_collection_names():
-            print(f"Mappings collection '{MAPPINGS_COLLECTION}' does not exist. Assuming 0 mappings.")
-            mapped_terms = set()
-        else:
-            mapped_terms = {doc['_id'] for doc in db[MAPPINGS_COLLECTION].find({}, {'_id': 1})}
-        print(f"Found {len(mapped_terms)} existing mappings.")
-    except Exception as e:
-        print(f"Error fetching mapped terms for {field_path}: {e}")
-        mapped_terms = set()
 
-    unmapped_terms = list(source_terms - mapped_terms)
-    print(f"Found {len(unmapped_terms)} new, unmapped terms.")
-    
-    return unmapped_terms
+def get_unmapped_terms_by_field(db, field_paths=FIELDS_TO_MAP):
+    """Returns {field_path: [unmapped terms]} for all fields.
 
+    The low-cardinality fields share one $facet scan; the terms of HIGH_CARDINALITY_FIELDS could exceed
+    the 16 MB limit of its single result document and are listed through a cursor per field.
+    """
+    print(f"\n--- Analyzing {len(field_paths)} fields for unmapped terms ---")
+    faceted = [field_path for field_path in field_paths if field_path not in HIGH_CARDINALITY_FIELDS]
+    result = next(db[SOURCE_COLLECTION].aggregate(build_unmapped_terms_pipeline(faceted)), {}) if faceted else {}
+    unmapped_by_field = {}
+    for field_path in field_paths:
+        if field_path in faceted:
+            docs = result.get(f'field_{faceted.index(field_path)}', [])
+        else:
+            docs = db[SOURCE_COLLECTION].aggregate(build_unmapped_terms_field_pipeline(field_path))
+        unmapped_by_field[field_path] = [doc['_id'] for doc in docs]
+        print(f"Found {len(unmapped_by_field[field_path])} new, unmapped terms for {field_path}.")
+    return unmapped_by_field
 
-def get_mappings_from_llm(terms_to_map, existing_canons=None, batch_size=500):
-    """Sends a list of terms to an LLM in batches and requests mappings to a canonical form."""
-    if not terms_to_map:
-        print("No new terms to map. Skipping LLM call.")
-        return {}
 
-    print(f"\n--- Sending {len(terms_to_map)} terms to LLM for mapping in batches of {batch_size} ---")
-    all_mappings = {}
+def get_unmapped_terms(db, field_path):
+    """Finds unique terms of one field in the source collection that are not yet in the mappings collection."""
+    return get_unmapped_terms_by_field(db, [field_path])[field_path]
+
 
+def build_mapping_prompt(batch, existing_canons=None):
+    """Builds the prompt asking the LLM to map a batch of terms to canonical German terms."""
     # Construct the base of the prompt with instructions
-    prompt_base = f"""Analyze the following list of categories. Some are duplicates or variations of each other.
+    prompt = f"""Analyze the following list of categories. Some are duplicates or variations of each other.
 Your task is to create a JSON object that maps each of these terms to a single, consistent, canonical form.
 
 **IMPORTANT INSTRUCTIONS:**
@@ -91,64 +124,287 @@ Your task is to create a JSON object that maps each of these terms to a single,
 """
 
     if existing_canons:
-        prompt_base += f"""\n**PREFERRED CANONICAL TERMS (in German):**
-{json.dumps(existing_canons, indent=2)}
+        prompt += f"""\n**PREFERRED CANONICAL TERMS (in German):**
+{json.dumps(sorted(existing_canons, key=str), indent=2, ensure_ascii=False)}
 """
 
-    for i in range(0, len(terms_to_map), batch_size):
-        batch = terms_to_map[i:i + batch_size]
-        print(f"Processing batch {i // batch_size + 1}/{(len(terms_to_map) + batch_size - 1) // batch_size}...")
-
-        # Add the new terms to the prompt for the current batch
-        prompt = prompt_base + f"""\n**NEW TERMS TO MAP:**
-{json.dumps(batch, indent=2)}
+    # Add the new terms to the prompt for the current batch
+    prompt += f"""\n**NEW TERMS TO MAP:**
+{json.dumps(batch, indent=2, ensure_ascii=False)}
 
 Respond with ONLY the JSON object, like this: {{\"original_term_1\": \"canonical_term_1\", \"original_term_2\": \"canonical_term_1\", ...}}."""
+    return prompt
 
-        try:
-            # Set a reasonable timeout for the client initialization
-            with straico_client(API_KEY=STRAICO_API_KEY, timeout=120) as client: # 2-minute timeout
-                print("Awaiting response from LLM for batch...")
-                reply = client.prompt_completion(LLM_MODEL, prompt)
-                response_content = reply['completion']['choices'][0]['message']['content']
-                print("LLM response for batch received.")
-                
-                batch_mappings = json.loads(response_content)
-                all_mappings.update(batch_mappings)
 
-        except Exception as e:
-            print(f"An error occurred during the LLM API call for a batch: {e}")
-            # We can decide to either stop or continue with the next batch.
-            # For now, we'll just print the error and continue.
-            pass
+class LLMRequestError(Exception):
+    """Raised when the LLM API answers a prompt completion with an error status."""
 
-    return all_mappings
+    def __init__(self, status_code, message):
+        super().__init__(f"LLM request failed with status {status_code}: {message}")
+        self.status_code = status_code
 
+    @property
+    def retryable(self):
+        return self.status_code == 429 or self.status_code >= 500
 
 
+def _raise_request_failure(request, response):
+    # aio_straico returns None on failure unless a callback is set; raising keeps the status code for the retry logic
+    raise LLMRequestError(response.status_code, response.text[:200])
 
-def save_mappings_to_db(db, field_path, mappings):
-    """Saves the LLM-generated mappings to the category_mappings collection."""
-    if not mappings:
-        print("No mappings to save.")
-        return
 
-    print(f"\n--- Saving {len(mappings)} mappings for field '{field_path}' to database ---")
-    mappings_collection = db[MAPPINGS_COLLECTION]
-    
-    for original_term, canonical_term in mappings.items():
-        # Use upsert=True to insert if not exists, or update if exists
-        result = mappings_collection.update_one(
+def parse_mapping_reply(reply):
+    """Extracts the {term: canonical_term} object from a prompt completion reply. Raises ValueError if malformed."""
+    if reply is None:
+        raise ValueError("Empty reply from LLM.")
+    try:
+        response_content = reply['completion']['choices'][0]['message']['content']
+        mappings = json.loads(response_content)
+    except (KeyError, IndexError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Malformed LLM reply: {e}") from e
+    if not isinstance(mappings, dict):
+        raise ValueError("LLM reply is not a JSON object.")
+    return mappings
+
+
+class LLMResponseCache:
+    """Persistent cache of parsed LLM replies keyed by a hash of model and prompt.
+
+    Prompts are built deterministically (sorted terms and canons), so rerunning a mapping after a
+    partial failure replays the batches that already succeeded from the cache instead of the API.
+    """
+
+    def __init__(self, db, model=LLM_MODEL):
+        self.collection = db[RESPONSE_CACHE_COLLECTION]
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        # get/put run on worker threads (asyncio.to_thread), so the counters need a lock
+        self._lock = threading.Lock()
+
+    def key(self, prompt):
+        return hashlib.sha256(f"{self.model}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, prompt):
+        """Returns the cached {term: canonical_term} for prompt, or None."""
+        cached = self.collection.find_one({'_id': self.key(prompt)}, {'mappings_json': 1})
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.tokens_saved += estimate_tokens(prompt) + estimate_tokens(cached['mappings_json'])
+        return json.loads(cached['mappings_json'])
+
+    def put(self, prompt, mappings):
+        # Stored as a JSON string: terms may contain '.' or start with '$', which field names cannot
+        self.collection.replace_one(
+            {'_id': self.key(prompt)},
+            {'model': self.model, 'mappings_json': json.dumps(mappings, ensure_ascii=False), 'created_at': datetime.now(timezone.utc)},
+            upsert=True
+        )
+
+    def stats(self):
+        return {'cache_hits': self.hits, 'cache_misses': self.misses, 'cache_tokens_saved': self.tokens_saved}
+
+
+def backoff_delay(attempt, base=LLM_BACKOFF_BASE, cap=LLM_BACKOFF_MAX):
+    """Returns the delay before retry number attempt (0-based): exponential backoff with full jitter."""
+    # Full jitter spreads the retries of concurrent batches that failed together (e.g. on a 429)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def _request_batch_mappings(client, prompt, label, max_retries=LLM_MAX_RETRIES):
+    """Sends one batch prompt, retrying rate limits, server errors and transport errors with backoff.
+
+    A malformed reply raises ValueError right away: repeating the same prompt usually truncates
+    again, so the caller splits the batch instead.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            reply = await client.prompt_completion(LLM_MODEL, prompt)
+            return parse_mapping_reply(reply)
+        except LLMRequestError as e:
+            if not e.retryable:
+                raise
+            error = e
+        except httpx.TransportError as e:
+            # Timeouts and dropped connections are worth another try
+            error = e
+        if attempt == max_retries:
+            raise error
+        delay = backoff_delay(attempt)
+        print(f"{label}: attempt {attempt + 1} failed ({error}). Retrying in {delay:.1f}s.")
+        await asyncio.sleep(delay)
+
+
+def _base_prompt_tokens(canon_index):
+    # Upper bound for the prompt without terms: the template plus the longest canons a batch could be offered
+    if canon_index is None:
+        return estimate_tokens(build_mapping_prompt([]))
+    longest_canons = sorted(canon_index.canons, key=len)[-CANON_CANDIDATES_PER_BATCH:]
+    return estimate_tokens(build_mapping_prompt([], longest_canons))
+
+
+async def map_fields_async(terms_by_field, existing_canons=None, max_batch_terms=MAX_BATCH_TERMS,
+                           concurrency=LLM_CONCURRENCY, on_batch_done=None, response_cache=None,
+                           api_key=None, base_url=None):
+    """Maps the terms of several fields concurrently, sharing one client session.
+
+    `concurrency` workers take batches from a BatchPlanner, which sizes them to the token budget and
+    adapts the size to observed latency and failures. Failed or incomplete batches are split and
+    retried. Returns ({field_path: {term: canonical_term}}, failed_terms), where failed_terms counts the
+    terms given up on; they stay unmapped and are picked up by the next run. After each batch,
+    `on_batch_done(field_path, mapped, settled)` runs on a worker thread with the batch's new mappings and
+    the number of terms settled (mapped or given up), e.g. to checkpoint them. With a response_cache,
+    prompts answered before cost no API call.
+    """
+    mappings_by_field = {field_path: {} for field_path in terms_by_field}
+    # Each prompt only carries the canons most similar to its own terms, so its size does not grow with the vocabulary
+    canon_index = CanonTfidfIndex(existing_canons) if existing_canons else None
+    planner = BatchPlanner(
+        terms_by_field, base_tokens=_base_prompt_tokens(canon_index), batch_size=AdaptiveBatchSize(maximum=max_batch_terms)
+    )
+    if not planner.has_pending():
+        return mappings_by_field, 0
+
+    total_terms = sum(len(terms) for terms in terms_by_field.values())
+    print(f"\n--- Sending {total_terms} terms to LLM with up to {concurrency} concurrent requests ---")
+    condition = asyncio.Condition()
+    in_flight = 0
+    batch_count = 0
+
+    async def process(client, batch, label):
+        prompt = build_mapping_prompt(batch, canon_index.select(batch) if canon_index else None)
+        cached = await asyncio.to_thread(response_cache.get, prompt) if response_cache is not None else None
+        if cached is not None:
+            LLM_BATCHES.inc(outcome="cache_hit")
+            return cached, None
+        started = time.monotonic()
+        batch_mappings = await _request_batch_mappings(client, prompt, label)
+        latency = time.monotonic() - started
+        LLM_BATCH_SECONDS.observe(latency)
+        LLM_TOKENS.inc(estimate_tokens(prompt), kind="prompt")
+        LLM_TOKENS.inc(estimate_tokens(json.dumps(batch_mappings, ensure_ascii=False)), kind="completion")
+        if response_cache is not None:
+            await asyncio.to_thread(response_cache.put, prompt, batch_mappings)
+        return batch_mappings, latency
+
+    async def run_batch(client, field_path, batch, label):
+        failed_before = len(planner.failed_terms[field_path])
+        mapped = {}
+        try:
+            batch_mappings, latency = await process(client, batch, label)
+        except Exception as e:
+            if isinstance(e, LLMRequestError) and not e.retryable:
+                # e.g. an invalid API key: every other batch would fail the same way
+                raise
+            print(f"{label} failed: {e}. Splitting and retrying.")
+            LLM_BATCHES.inc(outcome="failure")
+            planner.report_failure(field_path, batch)
+        else:
+            if latency is not None:
+                LLM_BATCHES.inc(outcome="success")
+            mapped = planner.report_success(field_path, batch, batch_mappings, latency)
+            mappings_by_field[field_path].update(mapped)
+            print(f"{label}: received {len(mapped)} mappings.")
+        settled = len(mapped) + len(planner.failed_terms[field_path]) - failed_before
+        if on_batch_done and settled:
+            await asyncio.to_thread(on_batch_done, field_path, mapped, settled)
+
+    async def worker(client):
+        nonlocal in_flight, batch_count
+        while True:
+            async with condition:
+                # Wait while other workers may still requeue halves of a failed batch
+                await condition.wait_for(lambda: planner.has_pending() or in_flight == 0)
+                job = planner.next_batch()
+                if job is None:
+                    return
+                in_flight += 1
+                batch_count += 1
+                field_path, batch = job
+                label = f"Batch {batch_count} ({field_path}, {len(batch)} terms)"
+            try:
+                await run_batch(client, field_path, batch, label)
+            finally:
+                async with condition:
+                    in_flight -= 1
+                    condition.notify_all()
+
+    async with aio_straico_client(
+        API_KEY=api_key or STRAICO_API_KEY,
+        STRAICO_BASE_URL=base_url or STRAICO_BASE_URL,
+        on_request_failure_callback=_raise_request_failure,
+        timeout=LLM_TIMEOUT,
+    ) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+
+    failed_terms = sum(len(terms) for terms in planner.failed_terms.values())
+    if failed_terms:
+        print(f"Gave up on {failed_terms} terms: {planner.failed_terms}")
+    return mappings_by_field, failed_terms
+
+
+def map_fields(terms_by_field, existing_canons=None, **options):
+    """Synchronous entry point for map_fields_async, e.g. from a background thread."""
+    return asyncio.run(map_fields_async(terms_by_field, existing_canons, **options))
+
+
+def get_mappings_from_llm(terms_to_map, existing_canons=None, max_batch_terms=MAX_BATCH_TERMS):
+    """Sends a list of terms to an LLM in concurrent batches and requests mappings to a canonical form."""
+    if not terms_to_map:
+        print("No new terms to map. Skipping LLM call.")
+        return {}
+    mappings_by_field, _ = map_fields({None: terms_to_map}, existing_canons, max_batch_terms=max_batch_terms)
+    return mappings_by_field[None]
+
+
+def build_mapping_updates(field_path, mappings, now=None):
+    """Builds one upsert per mapping, recording the source field and the time of the write."""
+    now = now or datetime.now(timezone.utc)
+    return [
+        UpdateOne(
             {'_id': original_term},
-            {'$set': {'target': canonical_term}},
+            {'$set': {'target': canonical_term, 'field_path': field_path, 'updated_at': now}},
             upsert=True
         )
-        if result.upserted_id:
-            print(f"Inserted new mapping: '{original_term}' -> '{canonical_term}'")
-        elif result.modified_count:
-            print(f"Updated existing mapping: '{original_term}' -> '{canonical_term}'")
+        for original_term, canonical_term in mappings.items()
+    ]
+
 
-    print("Mappings saved successfully.")
+def save_mappings_to_db(db, field_path, mappings):
+    """Saves the LLM-generated mappings to the category_mappings collection in unordered bulk writes.
+
+    Returns {'inserted': n, 'updated': n, 'errors': n}.
+    """
+    summary = {'inserted': 0, 'updated': 0, 'errors': 0}
+    if not mappings:
+        logger.debug("No mappings to save for field '%s'.", field_path)
+        return summary
+
+    updates = build_mapping_updates(field_path, mappings)
+    mappings_collection = db[MAPPINGS_COLLECTION]
+    for i in range(0, len(updates), MAPPING_WRITE_BATCH_SIZE):
+        chunk = updates[i:i + MAPPING_WRITE_BATCH_SIZE]
+        try:
+            result = mappings_collection.bulk_write(chunk, ordered=False)
+        except BulkWriteError as e:
+            # With ordered=False the rest of the chunk is still written; only the failed upserts are lost
+            result_details = e.details
+            summary['inserted'] += result_details.get('nUpserted', 0)
+            summary['updated'] += result_details.get('nModified', 0)
+            summary['errors'] += len(result_details.get('writeErrors', []))
+            logger.warning("%d mappings for field '%s' could not be saved.", len(result_details.get('writeErrors', [])), field_path)
+            continue
+        summary['inserted'] += result.upserted_count
+        summary['updated'] += result.modified_count
+        logger.debug("Saved mapping chunk %d for field '%s': %s", i // MAPPING_WRITE_BATCH_SIZE + 1, field_path, result.bulk_api_result)
+
+    bump_version(db, MAPPINGS_COLLECTION)
+    logger.debug("Saved %d mappings for field '%s': %s", len(mappings), field_path, summary)
+    return summary
 
 
 if __name__ == "__main__":
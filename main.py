@@ -1,56 +1,38 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for
-from pymongo import MongoClient
+from flask import Blueprint, Flask, Response, current_app, render_template, jsonify, request, redirect, url_for, stream_with_context
+from pymongo.errors import PyMongoError
 from bson import ObjectId
 import os
 import json
 from dotenv import load_dotenv
+from database import get_db
+from aggregations import aggregate_field, aggregate_dimensions, QUESTION_DIMENSIONS
+from aggregation_cache import AggregationCache
+from analytics_snapshot import ANALYTICS_BACKEND, analytics
+from cooccurrence import COOCCURRENCE_DIMENSIONS, DEFAULT_TOP_K, MAX_TOP_K, WEIGHTS, cooccurrence_matrix
+from data_version import SOURCE_COLLECTION, bump_version, get_data_version
+from network_graph import load_network, prune_network, remove_document_edges, update_network_cache
+from network_layout import SOURCE_NODE_TYPE, TARGET_NODE_TYPE
+from http_cache import conditional_json
+from index_manager import ensure_indexes
+import instrumentation
+from navigation import NavigationIndex, fetch_with_neighbours
+from markdown_render import render_answer, render_cache_stats
+from projections import ID_PROJECTION, projection_for_view
+from document_export import (MongoJSONEncoder, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_fields, find_page,
+                             iter_export_records, to_ndjson, to_csv)
 
 # Load environment variables from .env file, if available
 load_dotenv()
 
-app = Flask(__name__)
+# Routes are registered on a blueprint; create_app() builds the application around it
+views = Blueprint('views', __name__)
 
 # Custom Jinja2 filter to convert Python dict to JSON string
-import json
-from bson import ObjectId
-
-@app.template_filter('tojson')
+@views.app_template_filter('tojson')
 def tojson_filter(value, indent=None):
-    class CustomEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, ObjectId):
-                return str(obj)
-            return json.JSONEncoder.default(self, obj)
-    return json.dumps(value, indent=indent, cls=CustomEncoder)
-
-
-# Initialize MongoDB connection
-def get_mongo_client():
-    """Creates and returns a MongoDB client."""
-    mongodb_uri = os.environ.get('MONGODB_URI')
-    if not mongodb_uri:
-        raise ValueError("MONGODB_URI is not set. Please check the environment variable or .env file.")
-    return MongoClient(mongodb_uri)
-
-try:
-    client = get_mongo_client()
-    # Test connection
-    client.admin.command('ping')
-    db = client["ama_browser"]
-    collection = db["ama_log"]
-    print("Successfully connected to MongoDB.")
-except Exception as e:
-    print(f"\nERROR: Could not connect to MongoDB.")
-    print(f"Details: {e}")
-    print("\nPlease ensure MONGODB_URI is set correctly in your .env file.")
-    print("Example: MONGODB_URI=mongodb://localhost:27017/your_db\n")
-    # Exit gracefully instead of crashing with a long traceback
-    import sys
-    sys.exit(1)
-
-# Global constants for collection names
-SOURCE_COLLECTION = "ama_log"
-MAPPINGS_COLLECTION = "category_mappings"
+    return json.dumps(value, indent=indent, cls=MongoJSONEncoder)
+
+navigation_index = NavigationIndex()
 
 def get_collection_schema(collection):
     """Analyzes the collection to get a set of all unique field paths."""
@@ -71,22 +53,20 @@ def get_collection_schema(collection):
         find_fields(doc)
     return fields
 
-@app.route('/')
+@views.route('/')
 def index():
-    last_doc = collection.find_one(sort=[('_id', -1)])
-    if last_doc:
-        return redirect(url_for('view_document', id=last_doc['_id'], show='answer'))
+    _, last_doc_id = navigation_index.bounds(get_db())
+    if last_doc_id:
+        return redirect(url_for('.view_document', id=last_doc_id, show='answer'))
     else:
         # Handle case where collection is empty
         return "No documents found in the collection.", 404
 
-import markdown
-
 def get_answer_content(doc):
     """Safely retrieves the answer content and converts it from Markdown to HTML."""
     try:
-        markdown_content = doc['reply']['completion']['choices'][0]['message']['content']
-        return markdown.markdown(markdown_content, extensions=['fenced_code', 'tables'])
+        with instrumentation.timed('markdown'):
+            return render_answer(doc)
     except (KeyError, IndexError, TypeError):
         return "<p>Answer content not found at the expected path (reply.completion.choices[0].message.content).</p>"
 
@@ -121,27 +101,24 @@ def get_categorized_tags(doc):
 
     return categorized_tags
 
-@app.route('/view/<id>')
+@views.route('/view/<id>')
 def view_document(id):
-    doc = collection.find_one({'_id': ObjectId(id)})
-    if not doc:
-        return "Document not found", 404
-
     show_view = request.args.get('show', 'all')
 
     # Handle deprecated 'question' view by redirecting to 'all'
     if show_view == 'question':
         show_view = 'all'
 
-    # Get the first and last document IDs for navigation
-    first_doc = collection.find_one(sort=[('_id', 1)])
-    last_doc = collection.find_one(sort=[('_id', -1)])
-    first_doc_id = first_doc['_id'] if first_doc else None
-    last_doc_id = last_doc['_id'] if last_doc else None
+    db = get_db()
+    doc, previous_doc_id, next_doc_id = fetch_with_neighbours(db, ObjectId(id), projection_for_view(show_view))
+    if not doc:
+        return "Document not found", 404
+
+    first_doc_id, last_doc_id = navigation_index.bounds(db)
 
-    # Determine if the current document is the first or the last
-    is_on_first_document = (doc['_id'] == first_doc_id)
-    is_on_last_document = (doc['_id'] == last_doc_id)
+    # The neighbours are exact even if the cached bounds lag behind a concurrent insert or delete
+    is_on_first_document = previous_doc_id is None
+    is_on_last_document = next_doc_id is None
 
     # --- Prepare Page Title --- #
     # Safely get the information_goal for a more descriptive page title.
@@ -162,6 +139,8 @@ def view_document(id):
         'active_page': show_view, # The 'show' parameter determines the active page
         'first_doc_id': first_doc_id,
         'last_doc_id': last_doc_id,
+        'previous_doc_id': previous_doc_id,
+        'next_doc_id': next_doc_id,
         'is_on_first_document': is_on_first_document,
         'is_on_last_document': is_on_last_document,
         'answer_content': None,  # Default to None
@@ -180,326 +159,299 @@ def view_document(id):
     else:
         return render_template('index.html', **template_context)
 
-@app.route('/next/<id>')
+# The viewer links directly to the neighbouring documents; these routes remain for existing links.
+@views.route('/next/<id>')
 def next_document(id):
-    current_doc = collection.find_one({'_id': ObjectId(id)})
-    if not current_doc:
-        return "Document not found", 404
-
-    next_doc = collection.find_one({'_id': {'$gt': ObjectId(id)}}, sort=[('_id', 1)])
+    next_doc = get_db()[SOURCE_COLLECTION].find_one({'_id': {'$gt': ObjectId(id)}}, sort=[('_id', 1)], projection=ID_PROJECTION)
     if next_doc:
         show_view = request.args.get('show', 'all')
-        return redirect(url_for('view_document', id=next_doc['_id'], show=show_view))
+        return redirect(url_for('.view_document', id=next_doc['_id'], show=show_view))
     else:
         return "No next document", 404
 
-@app.route('/previous/<id>')
+@views.route('/previous/<id>')
 def previous_document(id):
-    current_doc = collection.find_one({'_id': ObjectId(id)})
-    if not current_doc:
-        return "Document not found", 404
-
-    previous_doc = collection.find_one({'_id': {'$lt': ObjectId(id)}}, sort=[('_id', -1)])
+    previous_doc = get_db()[SOURCE_COLLECTION].find_one({'_id': {'$lt': ObjectId(id)}}, sort=[('_id', -1)], projection=ID_PROJECTION)
     if previous_doc:
         show_view = request.args.get('show', 'all')
-        return redirect(url_for('view_document', id=previous_doc['_id'], show=show_view))
+        return redirect(url_for('.view_document', id=previous_doc['_id'], show=show_view))
     else:
         return "No previous document", 404
 
-@app.route('/delete/<id>', methods=['POST'])
+@views.route('/delete/<id>', methods=['POST'])
 def delete_document(id):
+    db = get_db()
+    collection = db[SOURCE_COLLECTION]
     try:
-        result = collection.delete_one({'_id': ObjectId(id)})
-        if result.deleted_count == 1:
+        # The tags of the deleted document are needed to subtract its edges from the network cache
+        deleted_doc = collection.find_one_and_delete({'_id': ObjectId(id)}, projection={'tags': 1})
+        if deleted_doc:
+            bump_version(db, SOURCE_COLLECTION)
+            remove_document_edges(db, deleted_doc)
             # After deletion, redirect to the next available document or home
-            next_doc = collection.find_one({'_id': {'$gt': ObjectId(id)}}, sort=[('_id', 1)])
+            next_doc = collection.find_one({'_id': {'$gt': ObjectId(id)}}, sort=[('_id', 1)], projection=ID_PROJECTION)
             if next_doc:
-                return redirect(url_for('view_document', id=next_doc['_id']))
+                return redirect(url_for('.view_document', id=next_doc['_id']))
             else:
                 # If no next document, try to find a previous one
-                previous_doc = collection.find_one({'_id': {'$lt': ObjectId(id)}}, sort=[('_id', -1)])
+                previous_doc = collection.find_one({'_id': {'$lt': ObjectId(id)}}, sort=[('_id', -1)], projection=ID_PROJECTION)
                 if previous_doc:
-                    return redirect(url_for('view_document', id=previous_doc['_id']))
+                    return redirect(url_for('.view_document', id=previous_doc['_id']))
                 else:
                     # If no other documents, redirect to a default page or show a message
-                    return redirect(url_for('index')) # Redirect to index, which will handle empty collection
+                    return redirect(url_for('.index')) # Redirect to index, which will handle empty collection
         else:
             return "Document not found or could not be deleted", 404
     except Exception as e:
         return f"Error deleting document: {e}", 500
 
+# Aggregation results are reused until ama_log or category_mappings change (see data_version.py)
+aggregation_cache = AggregationCache()
+
+VALID_TAG_TYPES = ["bibelreferenzen", "hauptthemen", "theologische_konzepte"]
+
 def _aggregate_field(field_path, apply_mapping=False):
-    pipeline = [
-        {
-            "$match": {
-                field_path: {"$exists": True, "$ne": None, "$ne": ""}
-            }
-        }
-    ]
-
-    # Check if the field is an array (e.g., tags.hauptthemen) and needs unwinding
-    # This is a heuristic; a more robust solution would involve schema analysis
-    if field_path.startswith("tags."):
-        pipeline.append({"$unwind": f"${field_path}"})
-        # Ensure the unwound field is not empty after unwind
-        pipeline.append({"$match": {field_path: {"$ne": None, "$ne": ""}}})
-
-    if apply_mapping:
-        # Add $lookup stage to join with the category_mappings collection
-        pipeline.append({
-            "$lookup": {
-                "from": MAPPINGS_COLLECTION,
-                "localField": field_path,
-                "foreignField": "_id",
-                "as": "mapping_data"
-            }
-        })
-        # Add $addFields stage to use the mapped value if available, otherwise the original
-        pipeline.append({
-            "$addFields": {
-                "_id_normalized": {
-                    "$cond": {
-                        "if": {"$gt": [{"$size": "$mapping_data"}, 0]},
-                        "then": {"$arrayElemAt": ["$mapping_data.target", 0]},
-                        "else": f"${field_path}"
-                    }
-                }
-            }
-        })
-        # Group by the normalized field
-        pipeline.append({
-            "$group": {
-                "_id": "$_id_normalized",
-                "count": {"$sum": 1}
-            }
-        })
-    else:
-        # Group by the original field
-        pipeline.append({
-            "$group": {
-                "_id": f"${field_path}",
-                "count": {"$sum": 1}
-            }
-        })
-
-    pipeline.append({
-        "$sort": {
-            "count": -1
-        }
-    })
-    return list(db[SOURCE_COLLECTION].aggregate(pipeline))
-
-@app.route('/api/questions_categorization')
+    db = get_db()
+    key = (field_path, apply_mapping, get_data_version(db))
+    if ANALYTICS_BACKEND == 'snapshot':
+        return aggregation_cache.get(key, lambda: analytics.frequencies(db, field_path, apply_mapping))
+    return aggregation_cache.get(key, lambda: aggregate_field(db, field_path, apply_mapping))
+
+def _questions_categorization():
+    db = get_db()
+    key = ('questions_categorization', get_data_version(db))
+    if ANALYTICS_BACKEND == 'snapshot':
+        return aggregation_cache.get(key, lambda: analytics.dimensions(db, QUESTION_DIMENSIONS))
+    return aggregation_cache.get(key, lambda: aggregate_dimensions(db, QUESTION_DIMENSIONS))
+
+def _tag_frequency(tag_type):
+    field_path = f"tags.{tag_type}"
+    # Bibelreferenzen should not be mapped
+    return _aggregate_field(field_path, apply_mapping=tag_type != "bibelreferenzen")
+
+def warm_caches():
+    """Computes the dashboard aggregations and the navigation bounds ahead of the first request.
+
+    Run in a preloading server's master process, the warm caches are inherited by every forked worker.
+    """
+    navigation_index.bounds(get_db())
+    # /api/cooccurrence reads the snapshot whichever backend serves the dashboards
+    analytics.refresh(get_db())
+    _questions_categorization()
+    for tag_type in VALID_TAG_TYPES:
+        _tag_frequency(tag_type)
+
+@views.route('/api/questions_categorization')
+@conditional_json('source', 'mappings')
 def get_questions_categorization():
-    data = {
-        "category": _aggregate_field("question_abstraction.categorization.category", apply_mapping=True),
-        "subcategory": _aggregate_field("question_abstraction.categorization.subcategory", apply_mapping=True),
-        "type": _aggregate_field("question_abstraction.categorization.type", apply_mapping=True),
-        "complexity": _aggregate_field("question_abstraction.categorization.complexity", apply_mapping=False), # No mapping for complexity
-        "main_goal": _aggregate_field("question_abstraction.intent.main_goal", apply_mapping=True),
-        "information_goal": _aggregate_field("question_abstraction.semantic.information_goal", apply_mapping=True),
-        "domain": _aggregate_field("question_abstraction.semantic.domain", apply_mapping=True)
-    }
-    return jsonify(data)
+    return jsonify(_questions_categorization())
 
-@app.route('/api/tag_frequency/<tag_type>')
+@views.route('/api/tag_frequency/<tag_type>')
+@conditional_json('source', 'mappings')
 def get_tag_frequency(tag_type):
-    valid_tag_types = ["bibelreferenzen", "hauptthemen", "theologische_konzepte"]
-    if tag_type not in valid_tag_types:
-        return jsonify({"error": "Invalid tag type. Valid types are: " + ", ".join(valid_tag_types)}), 400
-
-    field_path = f"tags.{tag_type}"
+    if tag_type not in VALID_TAG_TYPES:
+        return jsonify({"error": "Invalid tag type. Valid types are: " + ", ".join(VALID_TAG_TYPES)}), 400
+    return jsonify(_tag_frequency(tag_type))
 
-    # Bibelreferenzen should not be mapped
-    if tag_type == "bibelreferenzen":
-        results = _aggregate_field(field_path, apply_mapping=False)
-    else:
-        results = _aggregate_field(field_path, apply_mapping=True)
-
-    return jsonify(results)
-
-def generate_network_data():
-    # Aggregation to get the links (edges) and their counts
-    links_pipeline = [
-        {
-            "$match": {
-                "tags.bibelreferenzen": {"$exists": True, "$ne": []},
-                "tags.hauptthemen": {"$exists": True, "$ne": []}
-            }
-        },
-        {
-            "$unwind": "$tags.bibelreferenzen"
-        },
-        {
-            "$unwind": "$tags.hauptthemen"
-        },
-        {
-            "$group": {
-                "_id": {
-                    "source": "$tags.bibelreferenzen",
-                    "target": "$tags.hauptthemen"
-                },
-                "value": {"$sum": 1}
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "source": "$_id.source",
-                "target": "$_id.target",
-                "value": "$value"
-            }
-        }
-    ]
-    links_data = list(db[SOURCE_COLLECTION].aggregate(links_pipeline))
-
-    # Extract unique nodes from the links data
-    nodes_set = set()
-    for link in links_data:
-        nodes_set.add((link['source'], 'bibelreferenz'))
-        nodes_set.add((link['target'], 'hauptthema'))
-
-    nodes_data = []
-    for node_id, node_type in nodes_set:
-        nodes_data.append({"id": node_id, "type": node_type})
-
-    return {"nodes": nodes_data, "links": links_data}
-
-def update_network_cache():
-    network_data = generate_network_data()
-    cache_collection = db["ama_log_network_cache"]
-    # Clear existing cache and insert new data
-    cache_collection.delete_many({})
-    cache_collection.insert_one({"_id": "network_data", "data": network_data})
-    return True
-
-@app.route('/api/update_network_cache')
+@views.route('/api/update_network_cache')
 def trigger_update_network_cache():
-    update_network_cache()
-    return jsonify({"message": "Network cache updated successfully."})
+    """Counts the edges of new documents, or rebuilds the whole cache with ?full=1."""
+    full = request.args.get('full', '0') == '1'
+    result = update_network_cache(get_db(), full=full)
+    return jsonify({"message": "Network cache updated successfully.", **result})
 
-@app.route('/api/bible_theme_network')
+@views.route('/api/bible_theme_network')
+@conditional_json('network_cache')
 def bible_theme_network():
-    cache_collection = db["ama_log_network_cache"]
-    cached_data = cache_collection.find_one({"_id": "network_data"})
-    if cached_data and "data" in cached_data:
-        return jsonify(cached_data["data"])
+    """Returns the cached network, optionally pruned with ?min_weight=, ?top_k= and ?max_nodes=."""
+    pruning = {}
+    for parameter in ('min_weight', 'top_k', 'max_nodes'):
+        value = request.args.get(parameter)
+        if value is None:
+            continue
+        if not value.isdigit():
+            return jsonify({"error": f"Invalid value for '{parameter}'. Expected a non-negative integer."}), 400
+        pruning[parameter] = int(value)
+
+    network_data = load_network(get_db())
+    if network_data is not None:
+        return jsonify(prune_network(network_data, **pruning))
     else:
         return jsonify({"error": "Network data not found in cache. Please run /api/update_network_cache first."}), 404
 
-@app.route('/questions_dashboard')
+def _cooccurrence_matrix(generation, x, y, mapped=None):
+    db = get_db()
+    # Keyed by the snapshot's own version: a previous snapshot served during a rebuild is cached as such
+    key = ('cooccurrence', x, y, mapped, generation.source_version, get_data_version(db).mappings)
+    return aggregation_cache.get(key, lambda: cooccurrence_matrix(db, generation, x, y, mapped, mapped))
+
+@views.route('/api/cooccurrence')
+@conditional_json('source', 'mappings')
+def cooccurrence():
+    """Returns the strongest pairs of ?x= and ?y= terms, or the partners of one x term with ?term=.
+
+    ?weight= is count, pmi or lift; ?top_k= and ?min_count= limit the result, ?mapped=0/1 overrides
+    whether the terms are folded into their canonical terms.
+    """
+    x, y = request.args.get('x'), request.args.get('y')
+    if x not in COOCCURRENCE_DIMENSIONS or y not in COOCCURRENCE_DIMENSIONS:
+        return jsonify({"error": "Invalid dimension. Valid dimensions are: " + ", ".join(COOCCURRENCE_DIMENSIONS)}), 400
+    weight = request.args.get('weight', 'count')
+    if weight not in WEIGHTS:
+        return jsonify({"error": "Invalid weight. Valid weights are: " + ", ".join(WEIGHTS)}), 400
+    limits = {'top_k': DEFAULT_TOP_K, 'min_count': 1}
+    for parameter in limits:
+        value = request.args.get(parameter)
+        if value is None:
+            continue
+        if not value.isdigit():
+            return jsonify({"error": f"Invalid value for '{parameter}'. Expected a non-negative integer."}), 400
+        limits[parameter] = int(value)
+    limits['top_k'] = min(limits['top_k'], MAX_TOP_K)
+    mapped = request.args.get('mapped')
+    if mapped not in (None, '0', '1'):
+        return jsonify({"error": "Invalid value for 'mapped'. Expected 0 or 1."}), 400
+
+    # Building or rebuilding the snapshot scans the whole collection; it is never done inside a request
+    db = get_db()
+    generation = analytics.current(db, rebuild=False)
+    if generation is None:
+        response = jsonify({"error": "The analytics snapshot is being built. Please retry shortly."})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    matrix = _cooccurrence_matrix(generation, x, y, None if mapped is None else mapped == '1')
+    result = {"x": x, "y": y, "weight": weight, "documents": matrix.document_count}
+    term = request.args.get('term')
+    if term is None:
+        response = jsonify(dict(result, pairs=matrix.top_pairs(weight, **limits)))
+    else:
+        neighbours = matrix.neighbours(term, weight, **limits)
+        if neighbours is None:
+            return jsonify({"error": f"Term '{term}' does not occur in dimension '{x}'."}), 404
+        response = jsonify(dict(result, term=term, neighbours=neighbours))
+    if not generation.matches(get_data_version(db).source):
+        # Computed from the previous snapshot; it must not be cached under the ETag of the current data
+        response.cache_control.no_store = True
+    return response
+
+def _parse_after_id():
+    after = request.args.get('after')
+    if after and not ObjectId.is_valid(after):
+        raise ValueError("Invalid value for 'after'. Expected a document id.")
+    return ObjectId(after) if after else None
+
+@views.route('/api/documents')
+def list_documents():
+    """Returns a page of documents in _id order. Continue with ?after=<next_after> until it is null."""
+    try:
+        after_id = _parse_after_id()
+        fields = parse_fields(request.args.get('fields'))
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    page = find_page(get_db(), after_id=after_id, limit=limit, fields=fields)
+    return Response(json.dumps(page, cls=MongoJSONEncoder), mimetype='application/json')
+
+@views.route('/api/export')
+def export_documents():
+    """Streams selected fields of all documents as NDJSON (default) or CSV, optionally with canonical mapped terms."""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Invalid format. Valid formats are: ndjson, csv"}), 400
+    try:
+        after_id = _parse_after_id()
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    include_canonical = request.args.get('mapped', '0') == '1'
+
+    records = iter_export_records(get_db(), fields, include_canonical=include_canonical, after_id=after_id)
+    if export_format == 'csv':
+        body = to_csv(records, fields, include_canonical=include_canonical)
+        headers = {'Content-Disposition': 'attachment; filename=ama_log_export.csv'}
+        return Response(stream_with_context(body), mimetype='text/csv', headers=headers)
+    return Response(stream_with_context(to_ndjson(records)), mimetype='application/x-ndjson')
+
+@views.route('/api/cache_stats')
+def get_cache_stats():
+    """Returns the hit, miss and recompute-time counters of the aggregation and Markdown caches."""
+    return jsonify({**aggregation_cache.stats(), "markdown": render_cache_stats()})
+
+@views.route('/questions_dashboard')
 def questions_dashboard():
-    last_doc = collection.find_one(sort=[('_id', -1)])
-    return render_template('questions_dashboard.html', page_title='Questions Dashboard', active_page='questions_dashboard', last_doc_id=last_doc['_id'] if last_doc else None)
+    _, last_doc_id = navigation_index.bounds(get_db())
+    return render_template('questions_dashboard.html', page_title='Questions Dashboard', active_page='questions_dashboard', last_doc_id=last_doc_id)
 
-@app.route('/tags_dashboard')
+@views.route('/tags_dashboard')
 def tags_dashboard():
-    last_doc = collection.find_one(sort=[('_id', -1)])
-    return render_template('tags_dashboard.html', page_title='Tags Dashboard', active_page='tags_dashboard', last_doc_id=last_doc['_id'] if last_doc else None)
+    _, last_doc_id = navigation_index.bounds(get_db())
+    return render_template('tags_dashboard.html', page_title='Tags Dashboard', active_page='tags_dashboard', last_doc_id=last_doc_id)
 
-@app.route('/network_graph_view')
+@views.route('/network_graph_view')
 def network_graph_view():
-    last_doc = collection.find_one(sort=[('_id', -1)])
-    return render_template('bible_theme_network.html', page_title='Network Graph', active_page='network_graph_view', last_doc_id=last_doc['_id'] if last_doc else None)
+    _, last_doc_id = navigation_index.bounds(get_db())
+    return render_template('bible_theme_network.html', page_title='Network Graph', active_page='network_graph_view', last_doc_id=last_doc_id,
+                           source_node_type=SOURCE_NODE_TYPE, target_node_type=TARGET_NODE_TYPE)
 
 # --- LLM-Powered Semantic Aggregation ---
-import threading
-from llm_mapper import get_db as get_mapper_db, get_unmapped_terms, get_mappings_from_llm, save_mappings_to_db, FIELDS_TO_MAP
-
-# Global state to track the mapping process
-llm_mapping_status = {
-    "status": "idle",  # Can be "idle", "running", "finished", "error"
-    "message": "Process has not been started yet.",
-    "progress": 0,
-    "total": 0
-}
-
-def run_llm_mapping_process():
-    """The actual mapping process, designed to be run in a background thread."""
-    global llm_mapping_status
-    had_errors = False
-    
-    try:
-        print("Background mapping process started.")
-        db = get_mapper_db()
-        
-        # 1. Get the list of already existing canonical terms
-        print("Fetching existing canonical terms...")
-        existing_canons = list(db[MAPPINGS_COLLECTION].distinct("target"))
-        print(f"Found {len(existing_canons)} unique canonical terms.")
-
-        llm_mapping_status['total'] = len(FIELDS_TO_MAP)
-        llm_mapping_status['progress'] = 0
-
-        for i, field in enumerate(FIELDS_TO_MAP):
-            llm_mapping_status['message'] = f"Analyzing field: {field}"
-            print(f"Processing field ({i+1}/{len(FIELDS_TO_MAP)}): {field}")
-
-            new_terms = get_unmapped_terms(db, field)
-            
-            if new_terms:
-                llm_mapping_status['message'] = f"Found {len(new_terms)} new terms for '{field}'. Sending to LLM."
-                # 2. Pass the existing canons to the LLM function
-                llm_mappings = get_mappings_from_llm(new_terms, existing_canons=existing_canons)
-                
-                if llm_mappings:
-                    llm_mapping_status['message'] = f"Saving {len(llm_mappings)} new mappings for '{field}'."
-                    save_mappings_to_db(db, field, llm_mappings)
-                    # 3. Update our list of canons with any new ones that might have been created
-                    for target in llm_mappings.values():
-                        if target not in existing_canons:
-                            existing_canons.append(target)
-                else:
-                    print(f"No mappings returned from LLM for field: {field}. This may indicate an API error.")
-                    had_errors = True # Mark that an error occurred
-            else:
-                print(f"No new terms to map for field: {field}")
-
-            llm_mapping_status['progress'] = i + 1
-
-        if had_errors:
-            llm_mapping_status['status'] = 'error'
-            llm_mapping_status['message'] = "Process completed with errors. Some terms could not be mapped."
-            print("Background mapping process finished with errors.")
-        else:
-            llm_mapping_status['status'] = 'finished'
-            llm_mapping_status['message'] = f"Mapping process completed successfully. Processed {len(FIELDS_TO_MAP)} fields."
-            print("Background mapping process finished successfully.")
+from mapping_jobs import MappingWorkerPool, MAPPING_WORKERS, enqueue_job, get_job_status
+from mapping_events import JobStatusBroadcaster
 
-    except Exception as e:
-        error_message = f"A critical error occurred during the mapping process: {e}"
-        print(error_message)
-        llm_mapping_status['status'] = 'error'
-        llm_mapping_status['message'] = error_message
+# Polls only while a dashboard is subscribed, so creating it at import time opens nothing
+mapping_events = JobStatusBroadcaster(lambda: get_job_status(get_db()))
 
-@app.route('/api/trigger_llm_mapping', methods=['POST'])
+@views.route('/api/trigger_llm_mapping', methods=['POST'])
 def trigger_llm_mapping():
-    """Triggers the LLM mapping process in a background thread."""
-    global llm_mapping_status
-
-    if llm_mapping_status['status'] == 'running':
+    """Queues an LLM mapping job; any worker process picks it up."""
+    job_id = enqueue_job(get_db())
+    if job_id is None:
         return jsonify({"message": "Mapping process is already running."}), 409  # 409 Conflict
 
-    llm_mapping_status = {
-        "status": "running",
-        "message": "Mapping process started...",
-        "progress": 0,
-        "total": 0
-    }
-    
-    # Start the background thread
-    thread = threading.Thread(target=run_llm_mapping_process)
-    thread.start()
-
-    return jsonify({"message": "Mapping process initiated successfully."}), 202 # 202 Accepted
+    current_app.extensions['mapping_workers'].wake()
+    return jsonify({"message": "Mapping process initiated successfully.", "job_id": str(job_id)}), 202 # 202 Accepted
 
-@app.route('/api/llm_mapping_status')
+@views.route('/api/llm_mapping_status')
 def get_llm_mapping_status():
     """Returns the current status of the LLM mapping process."""
-    global llm_mapping_status
-    return jsonify(llm_mapping_status)
+    return jsonify(get_job_status(get_db()))
+
+@views.route('/api/llm_mapping_events')
+def llm_mapping_events():
+    """Streams the status of the LLM mapping process as Server-Sent Events until it finishes."""
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}  # no buffering in nginx
+    return Response(mapping_events.stream(), mimetype='text/event-stream', headers=headers)
+
+
+def create_app(start_mapping_workers=MAPPING_WORKERS > 0):
+    """Creates the Flask application.
+
+    MongoDB is reached through the shared client in database.py, which connects on first use. Creating
+    the indexes is opt-in (ENSURE_INDEXES_ON_STARTUP=1); otherwise run `python index_manager.py ensure`.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(views)
+    # Server-Timing header on every response and the Prometheus metrics at /metrics
+    instrumentation.init_app(app)
+
+    if os.environ.get('ENSURE_INDEXES_ON_STARTUP', '0') == '1':
+        try:
+            ensure_indexes(get_db())
+        except (PyMongoError, ValueError) as e:
+            # The pool reconnects on its own; requests fail until MongoDB is reachable
+            print(f"\nWARNING: Could not check the MongoDB indexes: {e}")
+            print("Please ensure MONGODB_URI is set correctly in your .env file.\n")
+
+    # Jobs live in the mapping_jobs collection; every process runs workers that claim them under a lease
+    mapping_workers = MappingWorkerPool(get_db)
+    if start_mapping_workers:
+        mapping_workers.start()
+    app.extensions['mapping_workers'] = mapping_workers
+    return app
 
 
 if __name__ == '__main__':
     # Using host='0.0.0.0' allows access from outside the container and helps avoid localhost vs 127.0.0.1 issues.
+    app = create_app()
     app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
\ No newline at end of file
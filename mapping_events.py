@@ -0,0 +1,102 @@
+# mapping_events.py
+# Server-Sent Events for the LLM mapping job. One thread per process reads the job status and fans
+# changes out to every connected dashboard, so watchers cost open connections instead of requests.
+
+import json
+import os
+import threading
+import time
+
+EVENT_POLL_INTERVAL = float(os.getenv("MAPPING_EVENTS_POLL_INTERVAL", "1"))
+HEARTBEAT_INTERVAL = 15  # seconds; keeps proxies from closing an idle stream
+RECONNECT_DELAY_MS = 3000
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def format_event(event, data):
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def status_events(previous, status):
+    """Returns the (event, data) pairs announcing the change from the previous to the current job status.
+
+    'batch' reports newly completed batches, 'progress' any other change of a queued or running job,
+    and 'done' the final status, after which the stream ends.
+    """
+    events = []
+    previous_batches = (previous or {}).get("completed_batches", 0) if (previous or {}).get("job_id") == status.get("job_id") else 0
+    if status.get("completed_batches", 0) > previous_batches:
+        events.append(("batch", {"completed_batches": status["completed_batches"], "message": status.get("message")}))
+    events.append(("progress" if status.get("status") in ACTIVE_STATUSES else "done", status))
+    return events
+
+
+class JobStatusBroadcaster:
+    """Polls the job status while at least one client is subscribed and notifies all of them of changes."""
+
+    def __init__(self, get_status, interval=EVENT_POLL_INTERVAL):
+        self.get_status = get_status
+        self.interval = interval
+        self._condition = threading.Condition()
+        self._status = None
+        self._version = 0
+        self._subscribers = 0
+        self._thread = None
+
+    def _poll(self):
+        while True:
+            with self._condition:
+                if self._subscribers == 0:
+                    self._thread = None
+                    return
+            try:
+                status = self.get_status()
+            except Exception as e:
+                print(f"Could not read the mapping job status: {e}")
+                status = None
+            with self._condition:
+                if status is not None and status != self._status:
+                    self._status = status
+                    self._version += 1
+                    self._condition.notify_all()
+            time.sleep(self.interval)
+
+    def _subscribe(self):
+        """Registers a client and returns the snapshot version it starts from."""
+        with self._condition:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, name="mapping-events", daemon=True)
+                self._thread.start()
+            return self._version
+
+    def _unsubscribe(self):
+        with self._condition:
+            self._subscribers -= 1
+
+    def stream(self):
+        """Yields the SSE stream of one client until the job reaches a final status."""
+        seen_version = self._subscribe()
+        try:
+            yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+            # The shared snapshot can be up to one interval old, so each client starts from a fresh read
+            status = self.get_status()
+            previous = None
+            while True:
+                if status != previous:
+                    for event, data in status_events(previous, status):
+                        yield format_event(event, data)
+                    if status.get("status") not in ACTIVE_STATUSES:
+                        return
+                    previous = status
+                with self._condition:
+                    self._condition.wait_for(lambda: self._version != seen_version, timeout=HEARTBEAT_INTERVAL)
+                    status, version = self._status, self._version
+                if version == seen_version or status is None:
+                    # Comment line: ignored by EventSource, but lets the server notice a closed connection
+                    yield ": keep-alive\n\n"
+                    status = previous
+                seen_version = version
+        finally:
+            self._unsubscribe()
@@ -0,0 +1,336 @@
+# mapping_jobs.py
+# Durable LLM mapping jobs: job state lives in the mapping_jobs collection, so every web worker reports
+# the same progress, only one job can be active at a time, and a job whose worker died is resumed by
+# another worker once its lease expires.
+#
+# Usage:
+#   python mapping_jobs.py enqueue   # queue a mapping job
+#   python mapping_jobs.py worker    # run a worker that processes queued jobs until interrupted
+
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from category_mapping import get_mappings
+from data_version import MAPPINGS_COLLECTION
+from database import get_db
+from llm_mapper import (
+    FIELDS_TO_MAP,
+    LLMResponseCache,
+    get_unmapped_terms_by_field,
+    map_fields,
+    save_mappings_to_db,
+)
+from term_normalization import CanonIndex, expand_variants, prenormalize_terms
+
+JOBS_COLLECTION = "mapping_jobs"
+MAPPING_WORKERS = int(os.getenv("MAPPING_WORKERS", "1"))
+JOB_LEASE_SECONDS = int(os.getenv("MAPPING_JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("MAPPING_JOB_POLL_INTERVAL", "5"))
+MAX_JOB_ATTEMPTS = 3
+
+QUEUED, RUNNING, FINISHED, ERROR = "queued", "running", "finished", "error"
+IDLE_STATUS = {"status": "idle", "message": "Process has not been started yet.", "progress": 0, "total": 0}
+
+
+# Databases whose jobs collection has its indexes, by (client id, database name); the client is kept so its id
+# is not reused
+_indexed_databases = {}
+_indexes_lock = threading.Lock()
+
+
+class JobLeaseLost(Exception):
+    """Raised inside a running job when another worker has taken over its lease."""
+
+
+class JobInterrupted(Exception):
+    """Raised inside a running job after a checkpoint when its worker is shutting down."""
+
+
+def job_indexes():
+    return [
+        # At most one job carries 'active': True; a second insert fails atomically across all processes
+        IndexModel([("active", ASCENDING)], name="single_active_job", unique=True, partialFilterExpression={"active": True}),
+        IndexModel([("created_at", DESCENDING)], name="created_at_desc"),
+    ]
+
+
+def ensure_job_indexes(db):
+    """Creates the indexes of the jobs collection once per process and database.
+
+    enqueue_job depends on single_active_job, so it must exist even where index_manager has not run.
+    """
+    key = (id(db.client), db.name)
+    with _indexes_lock:
+        if key not in _indexed_databases:
+            db[JOBS_COLLECTION].create_indexes(job_indexes())
+            _indexed_databases[key] = db.client
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue_job(db):
+    """Queues a mapping job and returns its _id, or None if a job is already queued or running.
+
+    Only one job can be active because of the single_active_job index, which is created before the first insert.
+    """
+    ensure_job_indexes(db)
+    job = {
+        "status": QUEUED,
+        "active": True,
+        "message": "Mapping process queued...",
+        "progress": 0,
+        "total": 0,
+        "attempts": 0,
+        "created_at": _now(),
+        "updated_at": _now(),
+    }
+    try:
+        return db[JOBS_COLLECTION].insert_one(job).inserted_id
+    except DuplicateKeyError:
+        return None
+
+
+def get_job_status(db):
+    """Returns the status of the most recent job in the shape of /api/llm_mapping_status."""
+    job = db[JOBS_COLLECTION].find_one(sort=[("created_at", DESCENDING)])
+    if job is None:
+        return dict(IDLE_STATUS)
+    status = {key: job.get(key, IDLE_STATUS.get(key)) for key in ("status", "message", "progress", "total")}
+    status["job_id"] = str(job["_id"])
+    status["completed_batches"] = job.get("completed_batches", 0)
+    if "savings" in job:
+        status["savings"] = job["savings"]
+    return status
+
+
+def claim_job(db, owner):
+    """Atomically takes the lease of a queued job, or of a running job whose lease has expired."""
+    now = _now()
+    return db[JOBS_COLLECTION].find_one_and_update(
+        {
+            "active": True,
+            "$or": [{"status": QUEUED}, {"status": RUNNING, "lease_expires_at": {"$lt": now}}],
+        },
+        {
+            "$set": {"status": RUNNING, "lease_owner": owner, "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS), "updated_at": now},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def renew_lease(db, job_id, owner):
+    """Extends the lease; returns False if the job is no longer held by owner."""
+    result = db[JOBS_COLLECTION].update_one(
+        {"_id": job_id, "lease_owner": owner, "status": RUNNING},
+        {"$set": {"lease_expires_at": _now() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+    )
+    return result.matched_count == 1
+
+
+def update_job(db, job_id, owner, inc=None, **fields):
+    """Updates a job held by owner. Raises JobLeaseLost if another worker has taken it over."""
+    update = {"$set": {**fields, "updated_at": _now()}}
+    if inc:
+        update["$inc"] = inc
+    result = db[JOBS_COLLECTION].update_one({"_id": job_id, "lease_owner": owner}, update)
+    if result.matched_count == 0:
+        raise JobLeaseLost(f"Job {job_id} is no longer held by {owner}.")
+
+
+def release_job(db, job_id, owner):
+    """Puts a job held by owner back in the queue without counting the attempt, e.g. on shutdown."""
+    db[JOBS_COLLECTION].update_one(
+        {"_id": job_id, "lease_owner": owner},
+        {
+            "$set": {"status": QUEUED, "message": "Mapping process interrupted; waiting for another worker.", "updated_at": _now()},
+            "$unset": {"lease_owner": "", "lease_expires_at": ""},
+            "$inc": {"attempts": -1},
+        },
+    )
+
+
+def finish_job(db, job_id, owner, status, message):
+    db[JOBS_COLLECTION].update_one(
+        {"_id": job_id, "lease_owner": owner},
+        {
+            "$set": {"status": status, "message": message, "updated_at": _now(), "finished_at": _now()},
+            "$unset": {"active": "", "lease_owner": "", "lease_expires_at": ""},
+        },
+    )
+
+
+def run_mapping_job(db, job, owner, stop_event=None):
+    """Maps all unmapped terms, checkpointing the mappings of every completed batch.
+
+    Mapped terms are no longer returned by get_unmapped_terms_by_field, so a resumed job only works on
+    what the previous attempt had not finished; its progress continues from the stored value.
+    Once stop_event is set, the job ends at its next checkpoint with JobInterrupted.
+    Returns (status, message).
+    """
+    job_id = job["_id"]
+    print(f"Mapping job {job_id} started by {owner} (attempt {job['attempts']}).")
+
+    # 1. Get the list of already existing canonical terms
+    existing_canons = list(db[MAPPINGS_COLLECTION].distinct("target"))
+    print(f"Found {len(existing_canons)} unique canonical terms.")
+
+    # 2. Collect the unmapped terms of every field in one pass
+    update_job(db, job_id, owner, message=f"Analyzing {len(FIELDS_TO_MAP)} fields for new terms.")
+    terms_by_field = {field: terms for field, terms in get_unmapped_terms_by_field(db, FIELDS_TO_MAP).items() if terms}
+
+    # 3. Resolve trivial variants of existing terms locally and send one representative per variant group
+    canon_index = CanonIndex(existing_canons, get_mappings(db))
+    resolved_by_field, llm_terms_by_field, variants_by_field, savings = prenormalize_terms(terms_by_field, canon_index)
+    had_errors = False
+    for field, resolved in resolved_by_field.items():
+        if resolved and save_mappings_to_db(db, field, resolved)["errors"]:
+            had_errors = True
+
+    progress = job.get("progress", 0)
+    total = progress + sum(len(terms) for terms in llm_terms_by_field.values())
+    update_job(
+        db, job_id, owner, total=total,
+        message=f"Sending {total - progress} terms for {len(terms_by_field)} fields to the LLM.",
+    )
+
+    def on_batch_done(field, mapped, settled):
+        # The checkpoint: the batch's mappings (and those of their variants) are saved before progress moves on
+        nonlocal had_errors
+        mappings = expand_variants(mapped, variants_by_field.get(field, {}))
+        if mappings and save_mappings_to_db(db, field, mappings)["errors"]:
+            had_errors = True
+        update_job(db, job_id, owner, inc={"progress": settled, "completed_batches": 1},
+                   message=f"Saved {len(mappings)} mappings for '{field}'.")
+        if stop_event is not None and stop_event.is_set():
+            raise JobInterrupted(f"Job {job_id} interrupted by {owner} after a checkpoint.")
+
+    # 4. Map all fields concurrently; batches answered in an earlier attempt come from the response cache.
+    # All fields are mapped against the same preferred canons, since their batches run at the same time.
+    response_cache = LLMResponseCache(db)
+    _, failed_terms = map_fields(
+        {field: terms for field, terms in llm_terms_by_field.items() if terms}, existing_canons,
+        on_batch_done=on_batch_done, response_cache=response_cache,
+    )
+    savings.update(response_cache.stats())
+    savings["tokens_saved"] += savings["cache_tokens_saved"]
+    update_job(db, job_id, owner, savings=savings)
+    print(f"LLM savings: {savings}")
+
+    if failed_terms or had_errors:
+        return ERROR, f"Process completed with errors. {failed_terms} terms could not be mapped."
+    return FINISHED, f"Mapping process completed successfully. Processed {len(FIELDS_TO_MAP)} fields."
+
+
+class MappingWorkerPool:
+    """Background threads that claim mapping jobs from the jobs collection and run them under a lease."""
+
+    def __init__(self, get_database=get_db, workers=MAPPING_WORKERS):
+        self.get_database = get_database
+        self.workers = workers
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            owner = f"{socket.gethostname()}:{os.getpid()}:{index}:{uuid.uuid4().hex[:8]}"
+            thread = threading.Thread(target=self._run, args=(owner,), name=f"mapping-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        """Lets idle workers look for a job right away instead of at their next poll."""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Stops polling and lets a job in progress end at its next checkpoint and return to the queue.
+
+        A job that does not reach a checkpoint within timeout keeps its lease until it expires and is
+        then resumed elsewhere.
+        """
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, owner):
+        db = self.get_database()
+        while not self._stop.is_set():
+            try:
+                job = claim_job(db, owner)
+                if job is not None:
+                    self._process(db, job, owner)
+                    continue
+            except Exception as e:
+                print(f"Mapping worker {owner}: {e}")
+            self._wake.wait(JOB_POLL_INTERVAL)
+            self._wake.clear()
+
+    def _process(self, db, job, owner):
+        if job["attempts"] > MAX_JOB_ATTEMPTS:
+            finish_job(db, job["_id"], owner, ERROR, f"Mapping job gave up after {MAX_JOB_ATTEMPTS} attempts.")
+            return
+        heartbeat_stop = threading.Event()
+
+        def heartbeat():
+            while not heartbeat_stop.wait(JOB_LEASE_SECONDS / 3):
+                if not renew_lease(db, job["_id"], owner):
+                    return
+
+        threading.Thread(target=heartbeat, name=f"mapping-lease-{job['_id']}", daemon=True).start()
+        try:
+            status, message = run_mapping_job(db, job, owner, stop_event=self._stop)
+        except JobLeaseLost as e:
+            print(f"Mapping worker {owner}: {e}")
+            return
+        except JobInterrupted as e:
+            print(f"Mapping worker {owner}: {e}")
+            release_job(db, job["_id"], owner)
+            return
+        except Exception as e:
+            status, message = ERROR, f"A critical error occurred during the mapping process: {e}"
+        finally:
+            heartbeat_stop.set()
+        print(message)
+        finish_job(db, job["_id"], owner, status, message)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue and process LLM mapping jobs.")
+    parser.add_argument("command", choices=["enqueue", "worker"])
+    args = parser.parse_args(argv)
+
+    db = get_db()
+    if args.command == "enqueue":
+        job_id = enqueue_job(db)
+        print(f"Queued mapping job {job_id}." if job_id else "A mapping job is already queued or running.")
+        return 0 if job_id else 1
+
+    pool = MappingWorkerPool(lambda: db)
+    pool.start()
+    print(f"Processing mapping jobs with {pool.workers} worker(s). Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# markdown_render.py
+# Markdown-to-HTML rendering of LLM answers with an in-process cache and a persisted pre-render.
+#
+# Usage:
+#   python markdown_render.py prerender [--limit N] [--workers P]   # newest documents first
+
+import argparse
+import hashlib
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import markdown
+from pymongo import UpdateOne
+
+from aggregation_cache import AggregationCache
+from data_version import SOURCE_COLLECTION
+from database import get_db
+
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables"]
+ANSWER_PROJECTION = {"reply.completion.choices.message.content": 1, "rendered_html.source_hash": 1}
+MARKDOWN_CACHE_SIZE = int(os.getenv("MARKDOWN_CACHE_SIZE", "512"))
+PRERENDER_BATCH_SIZE = 50
+
+# Rendered HTML depends only on the Markdown source, so entries never expire; the LRU bounds memory.
+_rendered_cache = AggregationCache(max_entries=MARKDOWN_CACHE_SIZE, ttl=float("inf"))
+
+
+def get_answer_markdown(doc):
+    """Returns the Markdown answer of a document. Raises KeyError, IndexError or TypeError if it is missing."""
+    return doc["reply"]["completion"]["choices"][0]["message"]["content"]
+
+
+def content_hash(markdown_content):
+    return hashlib.sha256(markdown_content.encode("utf-8")).hexdigest()
+
+
+def render_markdown(markdown_content):
+    return markdown.markdown(markdown_content, extensions=MARKDOWN_EXTENSIONS)
+
+
+def render_answer(doc):
+    """Returns the answer as HTML, using the persisted rendering or the in-process cache when possible."""
+    markdown_content = get_answer_markdown(doc)
+    source_hash = content_hash(markdown_content)
+    persisted = doc.get("rendered_html") or {}
+    if persisted.get("source_hash") == source_hash and "html" in persisted:
+        return persisted["html"]
+    return _rendered_cache.get(source_hash, lambda: render_markdown(markdown_content))
+
+
+def render_cache_stats():
+    return _rendered_cache.stats()
+
+
+def render_batch(items):
+    """Renders [(doc_id, markdown_content), ...] in a worker process and returns [(doc_id, source_hash, html)]."""
+    return [(doc_id, content_hash(content), render_markdown(content)) for doc_id, content in items]
+
+
+def _pending_batches(collection, limit):
+    batch = []
+    cursor = collection.find({}, ANSWER_PROJECTION).sort("_id", -1)
+    if limit:
+        cursor = cursor.limit(limit)
+    for doc in cursor:
+        try:
+            content = get_answer_markdown(doc)
+        except (KeyError, IndexError, TypeError):
+            continue
+        if (doc.get("rendered_html") or {}).get("source_hash") == content_hash(content):
+            continue
+        batch.append((doc["_id"], content))
+        if len(batch) == PRERENDER_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _write_rendered(collection, results):
+    collection.bulk_write(
+        [
+            UpdateOne({"_id": doc_id}, {"$set": {"rendered_html": {"source_hash": source_hash, "html": html}}})
+            for doc_id, source_hash, html in results
+        ],
+        ordered=False,
+    )
+    return len(results)
+
+
+def prerender_answers(db, limit=None, workers=None):
+    """Renders the answers of the newest documents in parallel and stores them in 'rendered_html'.
+
+    Documents whose stored rendering matches their current Markdown are skipped. Returns the number rendered.
+    """
+    collection = db[SOURCE_COLLECTION]
+    workers = workers or os.cpu_count() or 1
+    rendered = 0
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in _pending_batches(collection, limit):
+            pending.append(executor.submit(render_batch, batch))
+            # Executor.map would read the whole collection up front; a bounded window keeps memory flat
+            if len(pending) >= 2 * workers:
+                rendered += _write_rendered(collection, pending.popleft().result())
+        while pending:
+            rendered += _write_rendered(collection, pending.popleft().result())
+    return rendered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-render the Markdown answers of the ama_log collection.")
+    parser.add_argument("command", choices=["prerender"])
+    parser.add_argument("--limit", type=int, default=None, help="Only the newest N documents (default: all).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    args = parser.parse_args(argv)
+
+    rendered = prerender_answers(get_db(), limit=args.limit, workers=args.workers)
+    print(f"Rendered {rendered} answers.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
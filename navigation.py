@@ -0,0 +1,75 @@
+# navigation.py
+# Document navigation for the viewer: the current document, its neighbours and the collection bounds.
+
+import threading
+
+from data_version import SOURCE_COLLECTION, get_data_version
+
+
+def _neighbour_pipeline(id_filter, direction):
+    return [
+        {"$match": {"_id": id_filter}},
+        {"$sort": {"_id": direction}},
+        {"$limit": 1},
+        {"$project": {"_id": 1}},
+    ]
+
+
+def build_document_with_neighbours_pipeline(doc_id, projection=None):
+    """Builds one aggregation returning the document plus the _id of its previous and next document.
+
+    Each branch is an indexed _id lookup, so the whole page needs a single round trip. Requires MongoDB 4.4+.
+    """
+    pipeline = [{"$match": {"_id": doc_id}}]
+    if projection:
+        pipeline.append({"$project": projection})
+    pipeline.append({"$unionWith": {"coll": SOURCE_COLLECTION, "pipeline": _neighbour_pipeline({"$lt": doc_id}, -1)}})
+    pipeline.append({"$unionWith": {"coll": SOURCE_COLLECTION, "pipeline": _neighbour_pipeline({"$gt": doc_id}, 1)}})
+    return pipeline
+
+
+def split_neighbours(rows, doc_id):
+    """Sorts the rows of the neighbours pipeline into (doc, previous_id, next_id)."""
+    doc = previous_id = next_id = None
+    for row in rows:
+        if row["_id"] == doc_id:
+            doc = row
+        elif row["_id"] < doc_id:
+            previous_id = row["_id"]
+        else:
+            next_id = row["_id"]
+    return doc, previous_id, next_id
+
+
+def fetch_with_neighbours(db, doc_id, projection=None):
+    """Returns (doc, previous_id, next_id); doc is None if the document does not exist."""
+    rows = db[SOURCE_COLLECTION].aggregate(build_document_with_neighbours_pipeline(doc_id, projection))
+    return split_neighbours(rows, doc_id)
+
+
+class NavigationIndex:
+    """Caches the first and last _id of the collection until its data version changes.
+
+    Deleting a document bumps the version and new inserts change the newest _id that is part of it,
+    so the bounds are re-read exactly when they can have changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._bounds = (None, None)
+
+    def bounds(self, db):
+        """Returns (first_id, last_id), both None for an empty collection."""
+        version = get_data_version(db).source
+        with self._lock:
+            if version == self._version:
+                return self._bounds
+        collection = db[SOURCE_COLLECTION]
+        first_doc = collection.find_one(sort=[("_id", 1)], projection={"_id": 1})
+        last_doc = collection.find_one(sort=[("_id", -1)], projection={"_id": 1})
+        bounds = (first_doc["_id"] if first_doc else None, last_doc["_id"] if last_doc else None)
+        with self._lock:
+            self._version = version
+            self._bounds = bounds
+        return bounds
@@ -0,0 +1,297 @@
+# network_graph.py
+# Co-occurrence network of biblical references and main themes shown on the network graph view.
+#
+# The network is cached in ama_log_network_cache as one counter document per edge
+# ({'_id': {'source': ..., 'target': ...}, 'value': n}) plus a state document holding the
+# high-water mark: the newest ama_log _id whose edges are already counted. A layout document
+# stores precomputed node coordinates so that the browser does not need to run a simulation.
+
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from data_version import NETWORK_CACHE_COLLECTION, SOURCE_COLLECTION, bump_version
+from network_layout import compute_force_layout, link_keys, node_key, place_new_nodes
+from projections import get_path
+
+SOURCE_FIELD = "tags.bibelreferenzen"
+TARGET_FIELD = "tags.hauptthemen"
+SHADOW_COLLECTION = f"{NETWORK_CACHE_COLLECTION}_shadow"
+STATE_ID = "state"
+LAYOUT_ID = "layout"
+NETWORK_LAYOUT_ENABLED = os.getenv("NETWORK_LAYOUT", "1") == "1"
+EDGE_WRITE_BATCH_SIZE = 1000
+
+# Serializes rebuilds, refreshes and deletions within this process so that edge counters and the
+# high-water mark are updated together. Across processes, a refresh claims its range of documents by
+# moving the high-water mark atomically before it applies the edge counts (see _claim_range).
+_cache_lock = threading.Lock()
+
+
+def _edges_filter():
+    return {
+        SOURCE_FIELD: {"$exists": True, "$ne": []},
+        TARGET_FIELD: {"$exists": True, "$ne": []},
+    }
+
+
+def build_edge_pipeline(id_filter=None):
+    """Builds the aggregation that counts how often each reference occurs together with each theme."""
+    match = _edges_filter()
+    if id_filter:
+        match["_id"] = id_filter
+    return [
+        {"$match": match},
+        {"$unwind": f"${SOURCE_FIELD}"},
+        {"$unwind": f"${TARGET_FIELD}"},
+        {
+            "$group": {
+                "_id": {"source": f"${SOURCE_FIELD}", "target": f"${TARGET_FIELD}"},
+                "value": {"$sum": 1},
+            }
+        },
+    ]
+
+
+def build_new_documents_query(high_water_id, newest_id):
+    """Builds the find filter and projection of documents inserted after the high-water mark, up to newest_id."""
+    id_filter = {"$lte": newest_id}
+    if high_water_id is not None:
+        id_filter["$gt"] = high_water_id
+    return {"_id": id_filter, **_edges_filter()}, {SOURCE_FIELD: 1, TARGET_FIELD: 1}
+
+
+def build_links_pipeline():
+    """Builds the aggregation that returns the links ({source, target, value}) of the full network."""
+    return build_edge_pipeline() + [
+        {"$project": {"_id": 0, "source": "$_id.source", "target": "$_id.target", "value": "$value"}}
+    ]
+
+
+def build_nodes(links):
+    """Extracts the unique reference and theme nodes from a list of links."""
+    nodes_set = set()
+    for link in links:
+        nodes_set.update(link_keys(link))
+    return [{"id": node_id, "type": node_type} for node_id, node_type in nodes_set]
+
+
+def generate_network_data(db):
+    """Computes the full network ({'nodes': [...], 'links': [...]}) directly from the source collection."""
+    links_data = list(db[SOURCE_COLLECTION].aggregate(build_links_pipeline()))
+    return {"nodes": build_nodes(links_data), "links": links_data}
+
+
+def _tag_values(doc, field_path):
+    value = get_path(doc, field_path)
+    if value is None:
+        return []
+    # $unwind treats a scalar like a one-element array; the incremental path must count the same way
+    return value if isinstance(value, list) else [value]
+
+
+def document_edges(doc):
+    """Returns a Counter of the (source, target) pairs one document contributes, matching the $unwind semantics."""
+    sources = _tag_values(doc, SOURCE_FIELD)
+    targets = _tag_values(doc, TARGET_FIELD)
+    return Counter((source, target) for source in sources for target in targets)
+
+
+def _apply_edge_deltas(cache_collection, edge_deltas):
+    updates = [
+        UpdateOne({"_id": {"source": source, "target": target}}, {"$inc": {"value": delta}}, upsert=True)
+        for (source, target), delta in edge_deltas.items()
+        if delta
+    ]
+    for start in range(0, len(updates), EDGE_WRITE_BATCH_SIZE):
+        cache_collection.bulk_write(updates[start : start + EDGE_WRITE_BATCH_SIZE], ordered=False)
+    decremented = [{"source": source, "target": target} for (source, target), delta in edge_deltas.items() if delta < 0]
+    if decremented:
+        cache_collection.delete_many({"_id": {"$in": decremented}, "value": {"$lte": 0}})
+
+
+def _newest_source_id(db):
+    newest_doc = db[SOURCE_COLLECTION].find_one(sort=[("_id", -1)], projection={"_id": 1})
+    return newest_doc["_id"] if newest_doc else None
+
+
+def _write_state(collection, high_water_id):
+    collection.replace_one(
+        {"_id": STATE_ID},
+        {"_id": STATE_ID, "high_water_id": high_water_id, "updated_at": datetime.now(timezone.utc)},
+        upsert=True,
+    )
+
+
+def _claim_range(collection, high_water_id, newest_id):
+    """Moves the high-water mark from high_water_id to newest_id, unless another refresher has moved it.
+
+    _cache_lock only serializes the threads of one process; this compare-and-set makes sure that of
+    several processes refreshing at once, exactly one applies the deltas of a range of documents.
+    """
+    claimed = collection.find_one_and_update(
+        {"_id": STATE_ID, "high_water_id": high_water_id},
+        {"$set": {"high_water_id": newest_id, "updated_at": datetime.now(timezone.utc)}},
+    )
+    return claimed is not None
+
+
+def get_network_state(db):
+    """Returns the state document of the cache, or None if the cache has never been built."""
+    return db[NETWORK_CACHE_COLLECTION].find_one({"_id": STATE_ID})
+
+
+def rebuild_network_cache(db):
+    """Recomputes every edge into a shadow collection and swaps it in with a single rename.
+
+    Readers keep seeing the previous cache until the rename, so the cache is never empty.
+    """
+    with _cache_lock:
+        high_water_id = _newest_source_id(db)
+        id_filter = {"$lte": high_water_id} if high_water_id else None
+        db[SOURCE_COLLECTION].aggregate(build_edge_pipeline(id_filter) + [{"$out": SHADOW_COLLECTION}])
+        if NETWORK_LAYOUT_ENABLED:
+            links = _read_links(db[SHADOW_COLLECTION])
+            _write_layout(db[SHADOW_COLLECTION], compute_force_layout(build_nodes(links), links))
+        _write_state(db[SHADOW_COLLECTION], high_water_id)
+        db[SHADOW_COLLECTION].rename(NETWORK_CACHE_COLLECTION, dropTarget=True)
+    bump_version(db, NETWORK_CACHE_COLLECTION)
+
+
+def refresh_network_cache(db):
+    """Adds the edges of documents inserted after the high-water mark and returns how many were processed."""
+    with _cache_lock:
+        state = get_network_state(db)
+        if state is None:
+            raise LookupError("The network cache has not been built yet.")
+        high_water_id = state.get("high_water_id")
+        newest_id = _newest_source_id(db)
+        if newest_id is None or newest_id == high_water_id:
+            return 0
+
+        edge_deltas = Counter()
+        processed = 0
+        query, projection = build_new_documents_query(high_water_id, newest_id)
+        new_docs = db[SOURCE_COLLECTION].find(query, projection=projection)
+        for doc in new_docs:
+            edge_deltas.update(document_edges(doc))
+            processed += 1
+
+        cache_collection = db[NETWORK_CACHE_COLLECTION]
+        if not _claim_range(cache_collection, high_water_id, newest_id):
+            # Another process has moved the high-water mark since it was read and counts these documents
+            return 0
+        # A crash between the claim and the edge writes leaves the claimed documents uncounted; a full
+        # rebuild repairs the counters in that case.
+        _apply_edge_deltas(cache_collection, edge_deltas)
+        if NETWORK_LAYOUT_ENABLED:
+            _extend_layout(cache_collection)
+    bump_version(db, NETWORK_CACHE_COLLECTION)
+    return processed
+
+
+def update_network_cache(db, full=False):
+    """Refreshes the cache incrementally, or rebuilds it if requested or if it does not exist yet."""
+    if full or get_network_state(db) is None:
+        rebuild_network_cache(db)
+        return {"mode": "rebuild"}
+    return {"mode": "incremental", "processed_documents": refresh_network_cache(db)}
+
+
+def remove_document_edges(db, doc):
+    """Subtracts the edges of a deleted document if they had already been counted."""
+    with _cache_lock:
+        state = get_network_state(db)
+        high_water_id = state.get("high_water_id") if state else None
+        if high_water_id is None or doc["_id"] > high_water_id:
+            return
+        edge_deltas = Counter({edge: -count for edge, count in document_edges(doc).items()})
+        if not edge_deltas:
+            return
+        _apply_edge_deltas(db[NETWORK_CACHE_COLLECTION], edge_deltas)
+    bump_version(db, NETWORK_CACHE_COLLECTION)
+
+
+def _read_links(cache_collection):
+    return [
+        {"source": edge["_id"]["source"], "target": edge["_id"]["target"], "value": edge["value"]}
+        for edge in cache_collection.find({"_id": {"$type": "object"}, "value": {"$gt": 0}})
+    ]
+
+
+def _read_layout(cache_collection):
+    layout = cache_collection.find_one({"_id": LAYOUT_ID}) or {}
+    return {node_key(node): (node["x"], node["y"]) for node in layout.get("nodes", [])}
+
+
+def _write_layout(cache_collection, positions):
+    nodes = [{"id": node_id, "type": node_type, "x": x, "y": y} for (node_id, node_type), (x, y) in positions.items()]
+    cache_collection.replace_one({"_id": LAYOUT_ID}, {"_id": LAYOUT_ID, "nodes": nodes}, upsert=True)
+
+
+def _extend_layout(cache_collection):
+    positions = _read_layout(cache_collection)
+    if not positions:
+        return
+    links = _read_links(cache_collection)
+    _write_layout(cache_collection, place_new_nodes(positions, build_nodes(links), links))
+
+
+def load_network(db):
+    """Returns the cached network ({'nodes': [...], 'links': [...]}), or None if it has not been built.
+
+    Nodes carry fixed 'x'/'y' coordinates in [0, 1] when a layout has been computed.
+    """
+    cache_collection = db[NETWORK_CACHE_COLLECTION]
+    if get_network_state(db) is None:
+        return None
+    links = _read_links(cache_collection)
+    nodes = build_nodes(links)
+    positions = _read_layout(cache_collection)
+    for node in nodes:
+        if node_key(node) in positions:
+            node["x"], node["y"] = positions[node_key(node)]
+    return {"nodes": nodes, "links": links}
+
+
+def _top_k_links(links, top_k):
+    # A link survives if it is among the top_k heaviest links of either endpoint
+    kept = set()
+    for endpoint in ("source", "target"):
+        links_by_node = {}
+        for index, link in enumerate(links):
+            links_by_node.setdefault(link[endpoint], []).append(index)
+        for indices in links_by_node.values():
+            indices.sort(key=lambda index: links[index]["value"], reverse=True)
+            kept.update(indices[:top_k])
+    return [link for index, link in enumerate(links) if index in kept]
+
+
+def _cap_nodes(links, max_nodes):
+    # Adds links from the heaviest down as long as their endpoints fit into max_nodes, so the
+    # remaining graph keeps its strongest connections instead of isolated high-degree nodes.
+    kept_nodes = set()
+    kept_links = []
+    for link in sorted(links, key=lambda link: link["value"], reverse=True):
+        new_nodes = set(link_keys(link)) - kept_nodes
+        if len(kept_nodes) + len(new_nodes) <= max_nodes:
+            kept_nodes.update(new_nodes)
+            kept_links.append(link)
+    return kept_links
+
+
+def prune_network(network_data, min_weight=None, top_k=None, max_nodes=None):
+    """Reduces a network to its strongest links; nodes without remaining links are dropped."""
+    links = network_data["links"]
+    if min_weight:
+        links = [link for link in links if link["value"] >= min_weight]
+    if top_k:
+        links = _top_k_links(links, top_k)
+    if max_nodes:
+        links = _cap_nodes(links, max_nodes)
+    remaining = {key for link in links for key in link_keys(link)}
+    nodes = [node for node in network_data["nodes"] if node_key(node) in remaining]
+    return {"nodes": nodes, "links": links}
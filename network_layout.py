@@ -0,0 +1,111 @@
+# network_layout.py
+# Server-side force-directed layout (Fruchterman-Reingold) for the network graph, vectorized with NumPy.
+
+import os
+
+import numpy as np
+
+LAYOUT_ITERATIONS = int(os.getenv("NETWORK_LAYOUT_ITERATIONS", "60"))
+# Rows of the pairwise repulsion matrix computed at once; bounds memory to BLOCK x nodes floats.
+REPULSION_BLOCK_SIZE = 512
+GRAVITY = 0.05
+
+SOURCE_NODE_TYPE = "bibelreferenz"
+TARGET_NODE_TYPE = "hauptthema"
+
+
+def node_key(node):
+    # A reference and a theme may share the same label, so the type is part of the identity
+    return (node["id"], node["type"])
+
+
+def link_keys(link):
+    """Returns the node keys of a link's source and target."""
+    return (link["source"], SOURCE_NODE_TYPE), (link["target"], TARGET_NODE_TYPE)
+
+
+def _edge_arrays(links, index_by_key):
+    endpoints = [link_keys(link) for link in links]
+    sources = np.array([index_by_key[source_key] for source_key, _ in endpoints], dtype=np.int64)
+    targets = np.array([index_by_key[target_key] for _, target_key in endpoints], dtype=np.int64)
+    weights = np.log1p(np.array([link["value"] for link in links], dtype=np.float64))
+    if len(weights):
+        weights /= weights.max()
+    return sources, targets, weights
+
+
+def _repulsion(positions, k_squared):
+    # sum_j (p_i - p_j) * w_ij == p_i * sum_j w_ij - (W @ P)_i, with w_ij = k^2 / |p_i - p_j|^2. Written this
+    # way the pairwise work is two matrix products instead of a (block x nodes x 2) difference tensor.
+    squared_norms = (positions**2).sum(axis=1)
+    displacement = np.empty_like(positions)
+    for start in range(0, len(positions), REPULSION_BLOCK_SIZE):
+        block = positions[start : start + REPULSION_BLOCK_SIZE]
+        distance_squared = squared_norms[start : start + len(block), None] + squared_norms[None, :] - 2 * block @ positions.T
+        weights = k_squared / np.maximum(distance_squared, 1e-9)
+        weights[np.arange(len(block)), np.arange(start, start + len(block))] = 0.0
+        displacement[start : start + len(block)] = block * weights.sum(axis=1)[:, None] - weights @ positions
+    return displacement
+
+
+def _attraction(positions, sources, targets, weights, k):
+    delta = positions[sources] - positions[targets]
+    distance = np.sqrt((delta**2).sum(axis=-1))
+    force = delta * (distance * weights / k)[:, None]
+    displacement = np.zeros_like(positions)
+    np.add.at(displacement, sources, -force)
+    np.add.at(displacement, targets, force)
+    return displacement
+
+
+def _normalize(positions):
+    low = positions.min(axis=0)
+    span = np.maximum(positions.max(axis=0) - low, 1e-9)
+    return (positions - low) / span
+
+
+def compute_force_layout(nodes, links, iterations=LAYOUT_ITERATIONS, seed=0):
+    """Returns {(id, type): (x, y)} with coordinates normalized to [0, 1]."""
+    if not nodes:
+        return {}
+    index_by_key = {node_key(node): index for index, node in enumerate(nodes)}
+    sources, targets, weights = _edge_arrays(links, index_by_key)
+
+    positions = np.random.default_rng(seed).random((len(nodes), 2))
+    k = np.sqrt(1.0 / len(nodes))
+    temperature = 0.1
+    cooling = temperature / max(iterations, 1)
+    for _ in range(iterations):
+        displacement = _repulsion(positions, k * k) + _attraction(positions, sources, targets, weights, k)
+        # Gravity keeps disconnected components from drifting apart indefinitely
+        displacement -= GRAVITY * (positions - 0.5)
+        length = np.maximum(np.sqrt((displacement**2).sum(axis=-1)), 1e-9)
+        positions += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+
+    positions = _normalize(positions)
+    return {key: (float(positions[index, 0]), float(positions[index, 1])) for key, index in index_by_key.items()}
+
+
+def place_new_nodes(positions, nodes, links, seed=0):
+    """Adds coordinates for nodes missing from positions at the centroid of their placed neighbours.
+
+    Used after incremental refreshes, where rerunning the full layout would defeat the purpose.
+    """
+    rng = np.random.default_rng(seed)
+    neighbours = {}
+    for link in links:
+        source_key, target_key = link_keys(link)
+        neighbours.setdefault(source_key, []).append(target_key)
+        neighbours.setdefault(target_key, []).append(source_key)
+
+    placed = dict(positions)
+    for node in nodes:
+        key = node_key(node)
+        if key in placed:
+            continue
+        anchors = [placed[neighbour] for neighbour in neighbours.get(key, []) if neighbour in placed]
+        centre = np.mean(anchors, axis=0) if anchors else np.array([0.5, 0.5])
+        x, y = np.clip(centre + rng.normal(scale=0.02, size=2), 0.0, 1.0)
+        placed[key] = (float(x), float(y))
+    return placed
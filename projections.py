@@ -0,0 +1,34 @@
+# projections.py
+# Field projections per document view, so each route only transfers the fields its template uses, and
+# access to the dotted field paths they select.
+
+TITLE_FIELD = "question_abstraction.semantic.information_goal"
+ANSWER_FIELD = "reply.completion.choices.message.content"
+
+ID_PROJECTION = {"_id": 1}
+
+VIEW_PROJECTIONS = {
+    # The raw document without fields derived by the viewer itself
+    "all": {"rendered_html": 0},
+    "answer": {ANSWER_FIELD: 1, "rendered_html": 1, TITLE_FIELD: 1},
+    "tags": {"tags": 1, TITLE_FIELD: 1},
+    "question_abstraction": {"question_abstraction": 1},
+}
+
+# Views without content of their own only need the page title
+DEFAULT_VIEW_PROJECTION = {TITLE_FIELD: 1}
+
+
+def projection_for_view(show_view):
+    """Returns the projection for a view mode of /view/<id>."""
+    return VIEW_PROJECTIONS.get(show_view, DEFAULT_VIEW_PROJECTION)
+
+
+def get_path(doc, path, default=None):
+    """Returns the value at a dotted field path of a document, or default if the path does not exist."""
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return default
+        value = value[part]
+    return value
@@ -0,0 +1,203 @@
+# term_normalization.py
+# Local resolution of trivial term variants (case, whitespace, Unicode form, punctuation, small spelling
+# differences) to existing canonical terms, so that the LLM only sees terms that need judgement.
+
+import json
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+TERM_SIMILARITY_THRESHOLD = float(os.getenv("TERM_SIMILARITY_THRESHOLD", "0.85"))
+NGRAM_SIZE = 3
+# Preferred canons offered per prompt: the best matches of each term, capped for the whole batch
+CANON_CANDIDATES_PER_TERM = 5
+CANON_CANDIDATES_PER_BATCH = int(os.getenv("LLM_CANON_CANDIDATES", "100"))
+# Query rows scored at once; bounds memory to BLOCK x canons floats
+SCORE_BLOCK_SIZE = 64
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_term(term):
+    """Returns the comparison key of a term: NFKC, casefolded, punctuation removed, whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", term).casefold()
+    text = "".join(" " if unicodedata.category(char).startswith("P") else char for char in text)
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def char_ngrams(normalized, n=NGRAM_SIZE):
+    # Padding lets short terms and word boundaries contribute n-grams of their own
+    padded = f" {normalized} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def ngram_similarity(grams_a, grams_b):
+    """Jaccard similarity of two n-gram sets."""
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token), used only to report savings."""
+    return len(text) // 4 + 1
+
+
+def term_tokens(term):
+    # A term appears once in the prompt and once, with its target, in the reply
+    return 2 * estimate_tokens(json.dumps(term, ensure_ascii=False))
+
+
+class CanonIndex:
+    """Looks up the canonical term for a new term by exact normalized match or by n-gram similarity."""
+
+    def __init__(self, canons, mappings=None, threshold=TERM_SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._exact = {}
+        # Mapped terms resolve to their target; canons resolve to themselves and take precedence
+        for original_term, canonical_term in (mappings or {}).items():
+            if isinstance(original_term, str) and isinstance(canonical_term, str):
+                self._exact.setdefault(normalize_term(original_term), canonical_term)
+        for canon in canons:
+            if isinstance(canon, str):
+                self._exact[normalize_term(canon)] = canon
+        self._grams = {}
+        self._postings = {}
+        for normalized, canon in self._exact.items():
+            grams = char_ngrams(normalized)
+            self._grams[normalized] = grams
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(normalized)
+
+    def resolve(self, term):
+        """Returns the canonical term for term, or None if no existing term is close enough."""
+        normalized = normalize_term(term)
+        if normalized in self._exact:
+            return self._exact[normalized]
+        grams = char_ngrams(normalized)
+        # Only keys sharing at least one n-gram can reach the threshold
+        candidates = set().union(*(self._postings.get(gram, ()) for gram in grams))
+        best_key, best_score = None, self.threshold
+        for candidate in candidates:
+            score = ngram_similarity(grams, self._grams[candidate])
+            if score >= best_score:
+                best_key, best_score = candidate, score
+        return self._exact[best_key] if best_key is not None else None
+
+
+def prenormalize_terms(terms_by_field, canon_index):
+    """Resolves what can be resolved locally and collapses variants among the remaining terms.
+
+    Returns (resolved_by_field, llm_terms_by_field, variants_by_field, savings):
+    resolved_by_field maps terms to existing canons; llm_terms_by_field keeps one representative per
+    normalized form; variants_by_field[field][representative] lists the terms that share its mapping.
+    """
+    resolved_by_field, llm_terms_by_field, variants_by_field = {}, {}, {}
+    savings = {"terms_resolved_locally": 0, "terms_deduplicated": 0, "tokens_saved": 0}
+    for field_path, terms in terms_by_field.items():
+        resolved, representatives = {}, {}
+        for term in sorted(terms, key=str):
+            canon = canon_index.resolve(term) if isinstance(term, str) else None
+            if canon is not None:
+                resolved[term] = canon
+                savings["terms_resolved_locally"] += 1
+                savings["tokens_saved"] += term_tokens(term)
+                continue
+            key = normalize_term(term) if isinstance(term, str) else json.dumps(term, sort_keys=True, default=str)
+            if key in representatives:
+                variants_by_field.setdefault(field_path, {}).setdefault(representatives[key], []).append(term)
+                savings["terms_deduplicated"] += 1
+                savings["tokens_saved"] += term_tokens(term)
+            else:
+                representatives[key] = term
+        resolved_by_field[field_path] = resolved
+        llm_terms_by_field[field_path] = list(representatives.values())
+    return resolved_by_field, llm_terms_by_field, variants_by_field, savings
+
+
+def expand_variants(mappings, variants):
+    """Gives every variant the mapping of its representative."""
+    expanded = dict(mappings)
+    for representative, others in variants.items():
+        if representative in mappings:
+            for term in others:
+                expanded[term] = mappings[representative]
+    return expanded
+
+
+class CanonTfidfIndex:
+    """Character n-gram TF-IDF vectors of the canonical terms, for picking the canons relevant to a batch.
+
+    The vectors are stored as postings (canon, weight) per n-gram, so scoring a query touches only the
+    canons sharing one of its n-grams and the index stays small for large vocabularies.
+    """
+
+    def __init__(self, canons):
+        self.canons = sorted({canon for canon in canons if isinstance(canon, str)})
+        self._gram_ids = {}
+        canon_rows, gram_cols = [], []
+        for row, canon in enumerate(self.canons):
+            for gram in char_ngrams(normalize_term(canon)):
+                canon_rows.append(row)
+                gram_cols.append(self._gram_ids.setdefault(gram, len(self._gram_ids)))
+        canon_rows = np.array(canon_rows, dtype=np.int64)
+        gram_cols = np.array(gram_cols, dtype=np.int64)
+
+        document_frequency = np.bincount(gram_cols, minlength=len(self._gram_ids))
+        self._idf = np.log((1 + len(self.canons)) / (1 + document_frequency)) + 1
+        # An n-gram unseen in the canons still counts towards the query norm, with the highest idf
+        self._unseen_idf = np.log(1 + len(self.canons)) + 1
+        weights = self._idf[gram_cols]
+        norms = np.sqrt(np.bincount(canon_rows, weights=weights**2, minlength=len(self.canons)))
+        weights = weights / norms[canon_rows] if len(weights) else weights
+
+        order = np.argsort(gram_cols, kind="stable")
+        self._posting_canons = canon_rows[order]
+        self._posting_weights = weights[order]
+        self._indptr = np.concatenate([[0], np.cumsum(document_frequency)])
+
+    def _query_vectors(self, terms):
+        rows, grams, weights = [], [], []
+        for row, term in enumerate(terms):
+            term_grams = char_ngrams(normalize_term(term)) if isinstance(term, str) else set()
+            known = [self._gram_ids[gram] for gram in term_grams if gram in self._gram_ids]
+            known_weights = self._idf[known]
+            norm = np.sqrt((known_weights**2).sum() + (len(term_grams) - len(known)) * self._unseen_idf**2)
+            if norm == 0:
+                continue
+            rows.extend([row] * len(known))
+            grams.extend(known)
+            weights.extend(known_weights / norm)
+        return np.array(rows, dtype=np.int64), np.array(grams, dtype=np.int64), np.array(weights)
+
+    def scores(self, terms):
+        """Returns the cosine similarity of every term to every canon as a (terms x canons) array."""
+        rows, grams, query_weights = self._query_vectors(terms)
+        # Expand every (term, n-gram) pair into the postings of that n-gram
+        starts = self._indptr[grams]
+        lengths = self._indptr[grams + 1] - starts
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        postings = np.arange(lengths.sum()) + offsets
+        flat_index = np.repeat(rows, lengths) * len(self.canons) + self._posting_canons[postings]
+        contributions = np.repeat(query_weights, lengths) * self._posting_weights[postings]
+        return np.bincount(flat_index, weights=contributions, minlength=len(terms) * len(self.canons)).reshape(
+            len(terms), len(self.canons)
+        )
+
+    def select(self, terms, per_term=CANON_CANDIDATES_PER_TERM, limit=CANON_CANDIDATES_PER_BATCH):
+        """Returns up to limit canons most similar to any of the terms, sorted by name."""
+        if not self.canons or not terms:
+            return []
+        best = np.zeros(len(self.canons))
+        candidate_count = min(per_term, len(self.canons))
+        for start in range(0, len(terms), SCORE_BLOCK_SIZE):
+            block_scores = self.scores(terms[start:start + SCORE_BLOCK_SIZE])
+            top = np.argpartition(-block_scores, candidate_count - 1, axis=1)[:, :candidate_count]
+            top_scores = np.take_along_axis(block_scores, top, axis=1)
+            np.maximum.at(best, top.ravel(), top_scores.ravel())
+        candidates = np.flatnonzero(best > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argsort(-best[candidates], kind="stable")[:limit]]
+        # Sorted by name so that the same batch always yields the same prompt (and response cache key)
+        return sorted(self.canons[index] for index in candidates)
@@ -1,5 +1,14 @@
+import os
+
 import pytest
-from main import app as flask_app
+
+# The suite must not need a live MongoDB or create indexes in the database MONGODB_URI points at
+os.environ["ENSURE_INDEXES_ON_STARTUP"] = "0"
+
+from main import create_app
+
+# Mapping workers would claim jobs from the test database in the background
+flask_app = create_app(start_mapping_workers=False)
 
 @pytest.fixture
 def app():
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from aggregation_cache import AggregationCache
+
+
+def test_second_lookup_is_served_from_cache():
+    """
+    Tests that a cached value is returned without calling compute() again.
+    """
+    cache = AggregationCache(max_entries=4, ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [{"_id": "Gnade", "count": 3}]
+
+    first = cache.get(("tags.hauptthemen", True, 1), compute)
+    second = cache.get(("tags.hauptthemen", True, 1), compute)
+
+    assert first == second
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+
+def test_new_data_version_is_a_miss():
+    """
+    Tests that changing the version part of the key forces a recomputation.
+    """
+    cache = AggregationCache(max_entries=4, ttl=60)
+    cache.get(("tags.hauptthemen", True, 1), lambda: "old")
+
+    assert cache.get(("tags.hauptthemen", True, 2), lambda: "new") == "new"
+    assert cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    """
+    Tests that the cache never holds more than max_entries values.
+    """
+    cache = AggregationCache(max_entries=2, ttl=60)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    cache.get("a", lambda: 1)
+    cache.get("c", lambda: 3)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.get("a", lambda: "recomputed") == 1
+    assert cache.get("b", lambda: "recomputed") == "recomputed"
+
+
+def test_expired_entry_is_served_stale_while_refreshing():
+    """
+    Tests that an expired entry is returned immediately and recomputed in the background.
+    """
+    cache = AggregationCache(max_entries=4, ttl=0.01)
+    cache.get("key", lambda: "stale")
+    time.sleep(0.02)
+
+    refreshed = threading.Event()
+
+    def slow_compute():
+        refreshed.wait(1)
+        return "fresh"
+
+    assert cache.get("key", slow_compute) == "stale"
+    refreshed.set()
+    for _ in range(100):
+        if cache.stats()["refreshes"]:
+            break
+        time.sleep(0.01)
+
+    assert cache.stats()["stale_hits"] == 1
+    assert cache.stats()["refreshes"] == 1
+    cache.ttl = 60
+    assert cache.get("key", lambda: "unused") == "fresh"
@@ -0,0 +1,80 @@
+import mongomock
+import pytest
+
+import category_mapping
+import http_cache
+import main
+from aggregation_cache import AggregationCache
+import aggregations
+from aggregations import HIGH_CARDINALITY_FIELDS, QUESTION_DIMENSIONS, aggregate_dimensions, aggregate_field
+from benchmarks.corpus import seed_database
+from data_version import invalidate_local_version
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().ama_test
+    seed_database(database, 300, seed=11)
+    # The mapping snapshot and the data version are process-wide; start from this database's mappings
+    monkeypatch.setattr(category_mapping, "_snapshot", category_mapping.MappingSnapshot())
+    invalidate_local_version()
+    yield database
+    invalidate_local_version()
+
+
+def _counts(rows):
+    # Rows with equal counts may come in any order
+    return sorted((str(row["_id"]), row["count"]) for row in rows)
+
+
+@pytest.mark.parametrize("mode", ["facet", "parallel"])
+def test_modes_match_per_field_aggregation(db, mode):
+    """
+    Tests that both categorization modes return, per dimension, what aggregate_field returns for that field.
+    """
+    result = aggregate_dimensions(db, QUESTION_DIMENSIONS, mode=mode)
+
+    assert list(result) == list(QUESTION_DIMENSIONS)
+    for name, (field_path, apply_mapping) in QUESTION_DIMENSIONS.items():
+        expected = aggregate_field(db, field_path, apply_mapping)
+        assert _counts(result[name]) == _counts(expected)
+        assert [row["count"] for row in result[name]] == sorted((row["count"] for row in expected), reverse=True)
+
+
+def test_high_cardinality_fields_stay_out_of_the_facet(monkeypatch):
+    """
+    Tests that with one information_goal per document the goals are counted by their own aggregation, not inside the $facet.
+    """
+    db = mongomock.MongoClient().ama_unique
+    seed_database(db, 200, seed=3, unique_goals=True)
+    monkeypatch.setattr(category_mapping, "_snapshot", category_mapping.MappingSnapshot())
+    invalidate_local_version()
+    facets = []
+    build_facet_pipeline = aggregations.build_facet_pipeline
+    monkeypatch.setattr(aggregations, "build_facet_pipeline", lambda dimensions: facets.append(dimensions) or build_facet_pipeline(dimensions))
+
+    result = aggregate_dimensions(db, QUESTION_DIMENSIONS, mode="facet")
+
+    assert "information_goal" not in facets[0]
+    assert "question_abstraction.semantic.information_goal" in HIGH_CARDINALITY_FIELDS
+    assert len(result["information_goal"]) > 150
+    assert _counts(result["information_goal"]) == _counts(
+        aggregate_field(db, "question_abstraction.semantic.information_goal", apply_mapping=True)
+    )
+
+
+def test_questions_categorization_response_shape(db, client, monkeypatch):
+    """
+    Tests that /api/questions_categorization returns one list of {_id, count} rows per dimension, most frequent first.
+    """
+    monkeypatch.setattr(main, "get_db", lambda: db)
+    monkeypatch.setattr(http_cache, "get_db", lambda: db)
+    monkeypatch.setattr(main, "aggregation_cache", AggregationCache())
+
+    data = client.get("/api/questions_categorization").get_json()
+
+    assert set(data) == set(QUESTION_DIMENSIONS)
+    for rows in data.values():
+        assert rows and all(set(row) == {"_id", "count"} for row in rows)
+        assert [row["count"] for row in rows] == sorted((row["count"] for row in rows), reverse=True)
+    assert _counts(data["category"]) == _counts(aggregate_dimensions(db, QUESTION_DIMENSIONS)["category"])
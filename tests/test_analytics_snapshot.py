@@ -0,0 +1,132 @@
+import threading
+
+import mongomock
+from bson import ObjectId
+
+from analytics_snapshot import AnalyticsSnapshot, field_values
+from category_mapping import fold_counts
+from data_version import SOURCE_COLLECTION, bump_version, invalidate_local_version
+
+FIELDS = ["tags.hauptthemen", "question_abstraction.categorization.category"]
+
+
+def _doc(index, themes=None, category=None):
+    doc = {"_id": ObjectId(f"{index:024x}"), "tags": {}, "question_abstraction": {"categorization": {}}}
+    if themes is not None:
+        doc["tags"]["hauptthemen"] = themes
+    if category is not None:
+        doc["question_abstraction"]["categorization"]["category"] = category
+    return doc
+
+
+def test_field_values_follow_the_aggregation_pipeline():
+    """
+    Tests that values are extracted like build_field_pipeline counts them, including missing and empty values.
+    """
+    assert field_values(_doc(1, themes=["Gnade", "Glaube"]), "tags.hauptthemen") == ["Gnade", "Glaube"]
+    assert field_values(_doc(1, themes="Gnade"), "tags.hauptthemen") == ["Gnade"]
+    assert field_values(_doc(1, themes=["Gnade", ""]), "tags.hauptthemen") == []
+    assert field_values(_doc(1), "tags.hauptthemen") == []
+    assert field_values(_doc(1, category="Ethik"), "question_abstraction.categorization.category") == ["Ethik"]
+    assert field_values(_doc(1, category=""), "question_abstraction.categorization.category") == []
+    assert field_values(_doc(1), "question_abstraction.semantic.domain") == []
+
+
+def test_incremental_append_matches_a_rebuild(tmp_path):
+    """
+    Tests that appending documents to a generation yields the same frequencies as writing all of them at once.
+    """
+    docs = [
+        _doc(1, themes=["Gnade", "Glaube"], category="Ethik"),
+        _doc(2, themes=["gnade"], category="Theologie"),
+        _doc(3, themes=["Glaube", "Liebe"], category="Ethik"),
+        _doc(4, category="Ethik"),
+    ]
+    incremental = AnalyticsSnapshot(str(tmp_path / "incremental"), FIELDS)
+    first = incremental.write_documents(docs[:2], (0, str(docs[1]["_id"])))
+    second = incremental.write_documents(docs[2:], (0, str(docs[3]["_id"])), base=first)
+    rebuilt = AnalyticsSnapshot(str(tmp_path / "rebuilt"), FIELDS).write_documents(docs, (0, str(docs[3]["_id"])))
+
+    assert second.document_count == 4
+    # Appending writes a new segment and keeps the mapped files of the existing one
+    assert second.segment_names == first.segment_names + [second.segment_names[-1]]
+    assert second.segments[0] is first.segments[0]
+    assert second.high_water_id == docs[3]["_id"]
+    for field_path in FIELDS:
+        assert second.frequencies(field_path) == rebuilt.frequencies(field_path)
+    assert second.frequencies("tags.hauptthemen") == [
+        {"_id": "Glaube", "count": 2}, {"_id": "Gnade", "count": 1}, {"_id": "gnade", "count": 1},
+        {"_id": "Liebe", "count": 1},
+    ]
+    assert second.frequencies("question_abstraction.categorization.category")[0] == {"_id": "Ethik", "count": 3}
+
+
+def test_mapped_frequencies_match_fold_counts(tmp_path):
+    """
+    Tests that folding the snapshot counts into canonical terms gives the result of fold_counts.
+    """
+    docs = [_doc(1, themes=["Gnade", "gnade", "Liebe"]), _doc(2, themes=["gnade ", "Liebe"]), _doc(3, themes=["Hoffnung"])]
+    mappings = {"gnade": "Gnade", "gnade ": "Gnade", "Hope": "Hoffnung"}
+    generation = AnalyticsSnapshot(str(tmp_path), FIELDS).write_documents(docs, (0, str(docs[2]["_id"])))
+
+    expected = fold_counts(generation.frequencies("tags.hauptthemen"), mappings)
+
+    assert generation.frequencies("tags.hauptthemen", mappings, mappings_version=1) == expected
+    assert expected[0] == {"_id": "Gnade", "count": 3}
+
+
+def test_folds_are_cached_per_field_until_the_mappings_change(tmp_path):
+    """
+    Tests that the folds of several fields are kept side by side and dropped for a new mappings version.
+    """
+    docs = [_doc(1, themes=["gnade"], category="ethik")]
+    generation = AnalyticsSnapshot(str(tmp_path), FIELDS).write_documents(docs, (0, str(docs[0]["_id"])))
+    mappings = {"gnade": "Gnade", "ethik": "Ethik"}
+
+    themes = generation.canonical_fold("tags.hauptthemen", mappings, mappings_version=1)
+    categories = generation.canonical_fold("question_abstraction.categorization.category", mappings, mappings_version=1)
+
+    assert generation.canonical_fold("tags.hauptthemen", mappings, mappings_version=1) is themes
+    assert generation.canonical_fold("question_abstraction.categorization.category", mappings, 1) is categories
+    assert generation.canonical_fold("tags.hauptthemen", {}, mappings_version=2)[0] == ["gnade"]
+
+
+def test_readers_without_rebuild_never_rebuild_in_their_thread(tmp_path, monkeypatch):
+    """
+    Tests that current(rebuild=False) only appends in the calling thread and leaves builds and rebuilds to a background thread.
+    """
+    db = mongomock.MongoClient().ama_test
+    db[SOURCE_COLLECTION].insert_many([_doc(1, themes=["Gnade"]), _doc(2, themes=["Glaube"])])
+    invalidate_local_version()
+    snapshot = AnalyticsSnapshot(str(tmp_path), FIELDS)
+    writes = []
+    write_documents = snapshot.write_documents
+
+    def recording_write_documents(documents, source_version, base=None):
+        writes.append((threading.current_thread() is threading.main_thread(), base is None))
+        return write_documents(documents, source_version, base)
+
+    monkeypatch.setattr(snapshot, "write_documents", recording_write_documents)
+
+    # No snapshot yet: None while it is built in the background
+    assert snapshot.current(db, rebuild=False) is None
+    snapshot._background_refresh.join()
+    built = snapshot.current(db, rebuild=False)
+    assert built.document_count == 2
+
+    # New documents are appended by the reader
+    db[SOURCE_COLLECTION].insert_one(_doc(3, themes=["Liebe"]))
+    invalidate_local_version()
+    appended = snapshot.current(db, rebuild=False)
+    assert appended.document_count == 3
+
+    # After a delete the previous snapshot is served while the rebuild runs in the background
+    db[SOURCE_COLLECTION].delete_one({"_id": ObjectId(f"{1:024x}")})
+    bump_version(db, SOURCE_COLLECTION)
+    assert snapshot.current(db, rebuild=False) is appended
+    snapshot._background_refresh.join()
+    rebuilt = snapshot.current(db, rebuild=False)
+
+    assert rebuilt.document_count == 2
+    assert len(rebuilt.segments) == 1
+    assert writes == [(False, True), (True, False), (False, True)]
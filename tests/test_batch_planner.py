@@ -0,0 +1,41 @@
+from batch_planner import AdaptiveBatchSize, BatchPlanner, MAX_TERM_ATTEMPTS, term_cost
+
+
+def test_batches_respect_token_budget_and_batch_size():
+    """
+    Tests that batches are cut at the token budget or the current batch size, whichever comes first.
+    """
+    terms = [f"term {i:02d}" for i in range(10)]
+    planner = BatchPlanner({"f": terms}, base_tokens=10, budget=10 + 3 * term_cost("term 00"), batch_size=AdaptiveBatchSize(initial=5))
+
+    assert planner.next_batch() == ("f", terms[:3])
+    planner.budget = 10_000
+    assert planner.next_batch() == ("f", terms[3:8])
+
+
+def test_failed_batches_are_bisected_and_single_terms_given_up():
+    """
+    Tests that a failed batch is requeued in two halves and that a term failing on its own is dropped after its attempts.
+    """
+    planner = BatchPlanner({"f": ["a", "b", "c", "d"]}, budget=10_000)
+    field_path, batch = planner.next_batch()
+    planner.report_failure(field_path, batch)
+
+    assert planner.next_batch() == ("f", ["a", "b"])
+    assert planner.next_batch() == ("f", ["c", "d"])
+    for _ in range(MAX_TERM_ATTEMPTS):
+        planner.report_failure("f", ["a"])
+    assert planner.failed_terms["f"] == ["a"]
+
+
+def test_incomplete_reply_requeues_missing_terms_and_shrinks_batches():
+    """
+    Tests that only the requested terms are taken from a reply, missing ones are requeued and the batch size shrinks.
+    """
+    planner = BatchPlanner({"f": ["a", "b", "c"]}, budget=10_000, batch_size=AdaptiveBatchSize(initial=100))
+    field_path, batch = planner.next_batch()
+    mapped = planner.report_success(field_path, batch, {"a": "A", "b": "B", "x": "X"}, latency=1.0)
+
+    assert mapped == {"a": "A", "b": "B"}
+    assert planner.next_batch() == ("f", ["c"])
+    assert planner.batch_size.value == 50
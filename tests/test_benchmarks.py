@@ -0,0 +1,44 @@
+from benchmarks.corpus import CorpusGenerator
+from benchmarks.run import find_regressions
+
+
+def test_corpus_is_reproducible_and_skewed():
+    """
+    Tests that the same seed yields the same documents and that a few themes account for most tags.
+    """
+    first = list(CorpusGenerator(500, seed=7).documents())
+    second = list(CorpusGenerator(500, seed=7).documents())
+    assert first == second
+    assert len({doc["_id"] for doc in first}) == 500
+    assert [doc["_id"] for doc in first] == sorted(doc["_id"] for doc in first)
+
+    counts = {}
+    for doc in first:
+        for theme in doc["tags"]["hauptthemen"]:
+            counts[theme] = counts.get(theme, 0) + 1
+    top_ten = sum(sorted(counts.values(), reverse=True)[:10])
+    assert top_ten > sum(counts.values()) / 2
+
+
+def test_mappings_cover_part_of_the_vocabulary():
+    """
+    Tests that the generated category_mappings map some, but not all, of the terms to canonical terms.
+    """
+    generator = CorpusGenerator(1000)
+    mapped = {mapping["_id"] for mapping in generator.mappings()}
+    assert generator.themes[0] in mapped
+    assert generator.themes[-1] not in mapped
+
+
+def test_find_regressions_compares_medians():
+    """
+    Tests that only benchmarks slower than the baseline by more than the tolerance are reported.
+    """
+    baseline = {"results": {"1000": {"aggregate_dimensions": {"median": 1.0}, "view_document:all": {"median": 0.01}}}}
+    report = {"results": {"1000": {"aggregate_dimensions": {"median": 1.2}, "view_document:all": {"median": 0.02},
+                                   "mapping_pipeline": {"median": 5.0}}}}
+
+    regressions = find_regressions(report, baseline, tolerance=0.25)
+
+    assert len(regressions) == 1
+    assert regressions[0].startswith("view_document:all at 1000 documents")
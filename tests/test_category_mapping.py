@@ -0,0 +1,28 @@
+from category_mapping import fold_counts
+
+
+def test_fold_counts_merges_terms_with_the_same_canonical_form():
+    """
+    Tests that grouped raw terms are merged by their mapped target and sorted by frequency.
+    """
+    rows = [
+        {"_id": "Gnade", "count": 2},
+        {"_id": "liebe", "count": 4},
+        {"_id": "Liebe", "count": 3},
+        {"_id": "Nächstenliebe", "count": 1},
+    ]
+    mappings = {"liebe": "Liebe", "Nächstenliebe": "Liebe"}
+
+    assert fold_counts(rows, mappings) == [
+        {"_id": "Liebe", "count": 8},
+        {"_id": "Gnade", "count": 2},
+    ]
+
+
+def test_fold_counts_passes_through_unhashable_values():
+    """
+    Tests that values which cannot be looked up (e.g. arrays) are kept as they are.
+    """
+    rows = [{"_id": ["a", "b"], "count": 5}, {"_id": None, "count": 1}]
+
+    assert fold_counts(rows, {}) == [{"_id": ["a", "b"], "count": 5}, {"_id": None, "count": 1}]
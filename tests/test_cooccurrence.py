@@ -0,0 +1,74 @@
+import math
+
+from bson import ObjectId
+
+from analytics_snapshot import AnalyticsSnapshot
+from cooccurrence import build_matrix
+
+FIELDS = ["tags.bibelreferenzen", "tags.hauptthemen"]
+
+
+def _doc(index, references, themes):
+    return {"_id": ObjectId(f"{index:024x}"), "tags": {"bibelreferenzen": references, "hauptthemen": themes}}
+
+
+DOCS = [
+    _doc(1, ["Joh 3,16", "Röm 3,23"], ["Gnade", "Glaube"]),
+    _doc(2, ["Joh 3,16"], ["Gnade", "gnade"]),
+    _doc(3, ["Ps 23,1"], ["Trost"]),
+    _doc(4, [], ["Glaube", "Trost"]),
+]
+
+
+def _generation(tmp_path):
+    return AnalyticsSnapshot(str(tmp_path), FIELDS).write_documents(DOCS, (0, str(DOCS[-1]["_id"])))
+
+
+def test_counts_match_a_brute_force_count(tmp_path):
+    """
+    Tests that the sparse product counts every pair once per document that contains both terms.
+    """
+    matrix = build_matrix(_generation(tmp_path), "tags.bibelreferenzen", "tags.hauptthemen")
+
+    expected = {}
+    for doc in DOCS:
+        for reference in set(doc["tags"]["bibelreferenzen"]):
+            for theme in set(doc["tags"]["hauptthemen"]):
+                expected[(reference, theme)] = expected.get((reference, theme), 0) + 1
+    pairs = matrix.top_pairs(top_k=100)
+
+    assert {(pair["source"], pair["target"]): pair["count"] for pair in pairs} == expected
+    assert pairs[0] == {"source": "Joh 3,16", "target": "Gnade", "count": 2, "weight": 2.0}
+
+
+def test_pmi_and_lift_use_document_frequencies(tmp_path):
+    """
+    Tests that lift is the observed over the expected number of shared documents and PMI its log2.
+    """
+    matrix = build_matrix(_generation(tmp_path), "tags.bibelreferenzen", "tags.hauptthemen")
+
+    lift = {(pair["source"], pair["target"]): pair["weight"] for pair in matrix.top_pairs("lift", top_k=100)}
+    pmi = {(pair["source"], pair["target"]): pair["weight"] for pair in matrix.top_pairs("pmi", top_k=100)}
+
+    # Ps 23,1 occurs in 1 of 4 documents, Trost in 2, both together in 1
+    assert lift[("Ps 23,1", "Trost")] == 2.0
+    assert math.isclose(pmi[("Ps 23,1", "Trost")], 1.0)
+    # Joh 3,16 occurs in 2 documents, Glaube in 2, both together in 1
+    assert lift[("Joh 3,16", "Glaube")] == 1.0
+
+
+def test_canonical_terms_and_neighbours_within_one_dimension(tmp_path):
+    """
+    Tests that folded variants count once per document and that a term is not its own neighbour.
+    """
+    generation = _generation(tmp_path)
+    fold = generation.canonical_fold("tags.hauptthemen", {"gnade": "Gnade"}, mappings_version=1)
+    matrix = build_matrix(generation, "tags.hauptthemen", "tags.hauptthemen", fold, fold)
+
+    neighbours = matrix.neighbours("Glaube", top_k=10)
+
+    assert [(pair["target"], pair["count"]) for pair in neighbours] == [("Gnade", 1), ("Trost", 1)]
+    assert matrix.neighbours("gnade") is None
+    assert matrix.neighbours("Unbekannt") is None
+    assert all(pair["source"] != pair["target"] for pair in matrix.top_pairs(top_k=100))
+    assert matrix.top_pairs("count", top_k=1, min_count=2) == []
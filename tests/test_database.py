@@ -0,0 +1,32 @@
+import database
+
+
+def test_shared_client_is_lazy_and_reused(monkeypatch):
+    """
+    Tests that the client is created once per process without connecting, and shared by every caller.
+    """
+    monkeypatch.setenv("MONGODB_URI", "mongodb://127.0.0.1:1")
+    database.close_client()
+    try:
+        # Nothing listens on port 1; building the client must not try to reach it
+        client = database.get_client()
+        assert database.get_client() is client
+        assert database.get_db().client is client
+        assert database.get_db().name == database.DB_NAME
+        assert client.options.pool_options.max_pool_size == database.MONGO_MAX_POOL_SIZE
+    finally:
+        database.close_client()
+
+
+def test_forked_process_gets_its_own_client(monkeypatch):
+    """
+    Tests that a process with a different pid (a forked worker) does not reuse the parent's client.
+    """
+    monkeypatch.setenv("MONGODB_URI", "mongodb://127.0.0.1:1")
+    database.close_client()
+    try:
+        parent_client = database.get_client()
+        monkeypatch.setattr(database.os, "getpid", lambda: -1)
+        assert database.get_client() is not parent_client
+    finally:
+        database.close_client()
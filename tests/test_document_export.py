@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+import category_mapping
+import main
+from data_version import MAPPINGS_COLLECTION, SOURCE_COLLECTION
+from document_export import MAX_PAGE_SIZE, build_projection, canonical_terms, parse_fields, to_csv, to_ndjson
+
+
+def test_parse_fields_rejects_operators():
+    """
+    Tests that field lists are split on commas and that paths which could smuggle in operators are rejected.
+    """
+    assert parse_fields("tags.hauptthemen, question_abstraction") == ["tags.hauptthemen", "question_abstraction"]
+    with pytest.raises(ValueError):
+        parse_fields("tags,$where")
+
+
+def test_build_projection_drops_covered_sub_paths():
+    """
+    Tests that a sub-path is dropped from the projection when its parent path is already included.
+    """
+    assert build_projection(["tags.hauptthemen", "tags", "question_abstraction"]) == {
+        "question_abstraction": 1,
+        "tags": 1,
+    }
+
+
+def test_canonical_terms_apply_mappings():
+    """
+    Tests that mapped terms are replaced by their canonical value and unmapped terms are kept.
+    """
+    doc = {"tags": {"hauptthemen": ["Gnade", "Liebe"]}}
+    canonical = canonical_terms(doc, {"Gnade": "Gnade Gottes"})
+    assert canonical["tags.hauptthemen"] == ["Gnade Gottes", "Liebe"]
+
+
+def test_export_formats():
+    """
+    Tests that NDJSON writes one JSON object per line and that CSV starts with a header row, even without records.
+    """
+    doc_id = ObjectId()
+    records = [{"_id": doc_id, "tags": {"hauptthemen": ["Gnade"]}}]
+    assert list(to_ndjson(records)) == [f'{{"_id": "{doc_id}", "tags": {{"hauptthemen": ["Gnade"]}}}}\n']
+    assert "".join(to_csv([], ["tags"])) == "_id,tags\r\n"
+    assert "".join(to_csv(records, ["tags"])).splitlines()[1] == f'{doc_id},"{{""hauptthemen"": [""Gnade""]}}"'
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock.MongoClient().ama_test
+    database[SOURCE_COLLECTION].insert_many([
+        {"_id": ObjectId(f"{index:024x}"), "tags": {"hauptthemen": ["gnade", f"Thema {index}"]}, "reply": "..."}
+        for index in range(1, 6)
+    ])
+    database[MAPPINGS_COLLECTION].insert_one({"_id": "gnade", "target": "Gnade"})
+    monkeypatch.setattr(main, "get_db", lambda: database)
+    # The mapping snapshot is process-wide; start from this database's mappings
+    monkeypatch.setattr(category_mapping, "_snapshot", category_mapping.MappingSnapshot())
+    return database
+
+
+def test_documents_route_continues_with_next_after(db, client):
+    """
+    Tests that following next_after returns every document once, in _id order, with only the requested fields.
+    """
+    ids, after = [], ""
+    while after is not None:
+        page = client.get(f"/api/documents?limit=2&fields=tags&after={after}").get_json()
+        assert len(page["documents"]) <= 2
+        assert all(set(doc) == {"_id", "tags"} for doc in page["documents"])
+        ids += [doc["_id"] for doc in page["documents"]]
+        after = page["next_after"]
+
+    assert ids == [f"{index:024x}" for index in range(1, 6)]
+
+
+def test_documents_route_clamps_the_limit(db, client, monkeypatch):
+    """
+    Tests that limit is clamped to at least 1 and at most MAX_PAGE_SIZE.
+    """
+    monkeypatch.setattr(main, "MAX_PAGE_SIZE", 3)
+
+    assert len(client.get("/api/documents?limit=0").get_json()["documents"]) == 1
+    assert len(client.get(f"/api/documents?limit={MAX_PAGE_SIZE + 1}").get_json()["documents"]) == 3
+
+
+@pytest.mark.parametrize("url", [
+    "/api/documents?fields=tags,$where",
+    "/api/documents?limit=many",
+    "/api/documents?after=not-an-id",
+    "/api/export?fields=tags;reply",
+    "/api/export?format=xml",
+])
+def test_invalid_parameters_return_400(db, client, url):
+    """
+    Tests that invalid fields, limits, ids and formats are rejected with a JSON error.
+    """
+    response = client.get(url)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_export_ndjson_with_canonical_terms(db, client):
+    """
+    Tests that the NDJSON export streams one record per document, with the canonical terms when mapped=1.
+    """
+    response = client.get("/api/export?fields=tags.hauptthemen&mapped=1")
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert response.mimetype == "application/x-ndjson"
+    assert len(records) == 5
+    assert records[0]["tags.hauptthemen"] == ["gnade", "Thema 1"]
+    assert records[0]["canonical"]["tags.hauptthemen"] == ["Gnade", "Thema 1"]
+    assert "reply" not in records[0]
+
+
+def test_export_csv_with_canonical_terms(db, client):
+    """
+    Tests that the CSV export has a header row and one row per document, with the canonical terms as a JSON cell.
+    """
+    response = client.get(f"/api/export?format=csv&fields=tags.hauptthemen&mapped=1&after={1:024x}")
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+    assert response.mimetype == "text/csv"
+    assert "attachment" in response.headers["Content-Disposition"]
+    assert rows[0] == ["_id", "tags.hauptthemen", "canonical"]
+    assert [row[0] for row in rows[1:]] == [f"{index:024x}" for index in range(2, 6)]
+    assert json.loads(rows[1][2])["tags.hauptthemen"] == ["Gnade", "Thema 2"]
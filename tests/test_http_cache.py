@@ -0,0 +1,108 @@
+import gzip
+import json
+
+from flask import Flask, jsonify
+
+import http_cache
+from data_version import DataVersion
+
+
+def make_app(monkeypatch, version):
+    monkeypatch.setattr(http_cache, "get_db", lambda: None)
+    monkeypatch.setattr(http_cache, "get_data_version", lambda db: version["current"])
+    app = Flask(__name__)
+    calls = []
+
+    @app.route("/api/items/<kind>")
+    @http_cache.conditional_json("source")
+    def items(kind):
+        calls.append(kind)
+        if kind == "invalid":
+            return jsonify({"error": "Invalid kind."}), 400
+        if kind == "stale":
+            response = jsonify([])
+            response.cache_control.no_store = True
+            return response
+        return jsonify([{"_id": f"{kind}-{i}", "count": i} for i in range(200)])
+
+    return app.test_client(), calls
+
+
+def test_matching_etag_returns_304_without_running_the_view(monkeypatch):
+    """
+    Tests that a request carrying the current ETag is answered with 304 before the view runs, and that a data change yields a new ETag.
+    """
+    version = {"current": DataVersion(source=(1, "a"), mappings=0, network_cache=0)}
+    client, calls = make_app(monkeypatch, version)
+
+    first = client.get("/api/items/tags")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert "must-revalidate" in first.headers["Cache-Control"]
+
+    repeat = client.get("/api/items/tags", headers={"If-None-Match": etag})
+    assert repeat.status_code == 304
+    assert repeat.data == b""
+    assert calls == ["tags"]
+
+    version["current"] = DataVersion(source=(2, "a"), mappings=0, network_cache=0)
+    changed = client.get("/api/items/tags", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_etag_ignores_unrelated_versions_but_not_the_query(monkeypatch):
+    """
+    Tests that only the declared version fields and the request URL determine the ETag.
+    """
+    version = {"current": DataVersion(source=(1, "a"), mappings=0, network_cache=0)}
+    client, _ = make_app(monkeypatch, version)
+    etag = client.get("/api/items/tags").headers["ETag"]
+
+    version["current"] = DataVersion(source=(1, "a"), mappings=5, network_cache=3)
+    assert client.get("/api/items/tags").headers["ETag"] == etag
+    assert client.get("/api/items/tags?top_k=2").headers["ETag"] != etag
+
+
+def test_bodies_are_gzipped_for_clients_that_accept_it(monkeypatch):
+    """
+    Tests that large bodies are compressed when the client sends Accept-Encoding: gzip, and sent as is otherwise.
+    """
+    version = {"current": DataVersion(source=(1, "a"), mappings=0, network_cache=0)}
+    client, _ = make_app(monkeypatch, version)
+
+    plain = client.get("/api/items/tags")
+    compressed = client.get("/api/items/tags", headers={"Accept-Encoding": "gzip, deflate"})
+
+    assert "Content-Encoding" not in plain.headers
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert json.loads(gzip.decompress(compressed.data)) == plain.get_json()
+
+
+def test_error_responses_are_not_cached(monkeypatch):
+    """
+    Tests that an error response passes through without ETag or Cache-Control headers.
+    """
+    version = {"current": DataVersion(source=(1, "a"), mappings=0, network_cache=0)}
+    client, _ = make_app(monkeypatch, version)
+
+    response = client.get("/api/items/invalid", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 400
+    assert "ETag" not in response.headers
+    assert "Content-Encoding" not in response.headers
+
+
+def test_no_store_responses_get_no_etag(monkeypatch):
+    """
+    Tests that a response the view marks no-store is passed through without an ETag, so it is not revalidated as current.
+    """
+    version = {"current": DataVersion(source=(1, "a"), mappings=0, network_cache=0)}
+    client, _ = make_app(monkeypatch, version)
+
+    response = client.get("/api/items/stale")
+
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert response.headers["Cache-Control"] == "no-store"
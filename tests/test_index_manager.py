@@ -0,0 +1,55 @@
+from index_manager import SAMPLE_ID, audited_query_shapes, declared_indexes, find_problem_stages
+
+
+def test_problem_stages_are_reported_only_for_the_winning_plan():
+    """
+    Tests that COLLSCAN and SORT stages are found in nested winning plans but ignored in rejected plans.
+    """
+    explain_output = {
+        "stages": [
+            {
+                "$cursor": {
+                    "queryPlanner": {
+                        "winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}},
+                        "rejectedPlans": [{"stage": "COLLSCAN"}],
+                    }
+                }
+            },
+            {"$group": {"_id": "$tags.hauptthemen"}},
+        ]
+    }
+
+    assert find_problem_stages(explain_output) == ["in-memory sort", "collection scan"]
+
+
+def test_index_scan_has_no_problems():
+    """
+    Tests that a plan served by an index is reported as clean.
+    """
+    explain_output = {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}}
+
+    assert find_problem_stages(explain_output) == []
+
+
+def test_tag_arrays_have_partial_indexes():
+    """
+    Tests that every tag array used by the dashboards and the network graph is indexed.
+    """
+    index_names = {index_model.document["name"] for index_model in declared_indexes()["ama_log"]}
+
+    for field_path in ["tags.bibelreferenzen", "tags.hauptthemen", "tags.theologische_konzepte"]:
+        assert f"{field_path}_partial" in index_names
+
+
+def test_audit_covers_every_query_shape():
+    """
+    Tests that the audit explains the navigation pipeline, including its $unionWith neighbour lookups, the keyset pages and the network refresh.
+    """
+    shapes = {name: query for name, _, _, query in audited_query_shapes()}
+
+    assert {"navigation:first", "navigation:last"} <= set(shapes)
+    union_stages = [stage for stage in shapes["navigation:document_with_neighbours"] if "$unionWith" in stage]
+    assert len(union_stages) == 2
+    assert shapes["documents:keyset"]["filter"] == {"_id": {"$gt": SAMPLE_ID}}
+    assert shapes["documents:keyset"]["sort"] == {"_id": 1}
+    assert shapes["network:refresh_new_documents"]["filter"]["_id"] == {"$gt": SAMPLE_ID, "$lte": SAMPLE_ID}
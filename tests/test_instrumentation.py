@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+from flask import Flask, render_template_string
+
+import instrumentation
+from instrumentation import Counter, Histogram, mongo_command_listener
+
+
+def test_histogram_renders_cumulative_buckets():
+    """
+    Tests that a histogram is rendered in the Prometheus text format with cumulative buckets, sum and count.
+    """
+    histogram = Histogram("test_latency_seconds", "Test latency.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, route="/a")
+    histogram.observe(0.5, route="/a")
+    histogram.observe(5, route="/a")
+
+    lines = histogram.collect()
+
+    assert "# TYPE test_latency_seconds histogram" in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{route="/a"} 3' in lines
+
+
+def test_counter_escapes_label_values():
+    """
+    Tests that counters accumulate per label value and escape quotes in label values.
+    """
+    counter = Counter("test_events_total", "Test events.", ("kind",))
+    counter.inc(kind='say "hi"')
+    counter.inc(2, kind='say "hi"')
+
+    assert 'test_events_total{kind="say \\"hi\\""} 3' in counter.collect()
+
+
+def test_requests_report_mongo_commands_and_render_time():
+    """
+    Tests that commands seen by the listener during a request appear in its Server-Timing header and in the route metrics.
+    """
+    app = Flask(__name__)
+    instrumentation.init_app(app)
+
+    @app.route("/items/<item_id>")
+    def item(item_id):
+        for _ in range(3):
+            mongo_command_listener.succeeded(SimpleNamespace(command_name="find", duration_micros=2000))
+        with instrumentation.timed("markdown"):
+            pass
+        return render_template_string("<p>{{ item_id }}</p>", item_id=item_id)
+
+    before = instrumentation.HTTP_REQUEST_MONGO_COMMANDS.count(route="/items/<item_id>")
+    response = app.test_client().get("/items/42")
+
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith('db;dur=6.0;desc="3 commands"')
+    assert "markdown;dur=" in timing and "render;dur=" in timing and "total;dur=" in timing
+    assert instrumentation.HTTP_REQUEST_MONGO_COMMANDS.count(route="/items/<item_id>") == before + 1
+
+    # Outside a request, commands only reach the process metrics
+    mongo_command_listener.succeeded(SimpleNamespace(command_name="find", duration_micros=1000))
+    metrics = app.test_client().get("/metrics").get_data(as_text=True)
+    assert 'http_request_mongodb_commands_bucket{route="/items/<item_id>",le="3"}' in metrics
+    assert "mongodb_command_duration_seconds_count" in metrics
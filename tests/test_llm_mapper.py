@@ -0,0 +1,111 @@
+import time
+from datetime import datetime, timezone
+
+import mongomock
+import pytest
+
+import llm_mapper
+from benchmarks.stub_llm import StubLLMServer
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    # Maps every term to its upper-case form and rate-limits the first request
+    with StubLLMServer(delay=0.3, canonical=str.upper, rate_limited_calls=1) as server:
+        monkeypatch.setattr(llm_mapper, "backoff_delay", lambda attempt: 0.01)
+        yield server
+
+
+def test_map_fields_runs_batches_concurrently_and_retries(stub_llm):
+    """
+    Tests that batches of several fields run concurrently, that a rate-limited batch is retried and that all terms get mapped.
+    """
+    terms_by_field = {
+        "tags.hauptthemen": [f"thema {i}" for i in range(8)],
+        "tags.theologische_konzepte": [f"konzept {i}" for i in range(8)],
+    }
+    started = time.monotonic()
+    mappings_by_field, failed_terms = llm_mapper.map_fields(
+        terms_by_field, max_batch_terms=2, concurrency=8, api_key="test", base_url=stub_llm.url
+    )
+    elapsed = time.monotonic() - started
+
+    assert failed_terms == 0
+    assert mappings_by_field["tags.hauptthemen"]["thema 3"] == "THEMA 3"
+    assert len(mappings_by_field["tags.theologische_konzepte"]) == 8
+    # 8 batches at 0.3s each: sequential would take 2.4s, concurrent about two rounds because of the retry
+    assert elapsed < 1.5
+
+
+def test_truncated_replies_are_split_until_every_term_is_mapped(stub_llm):
+    """
+    Tests that a batch whose reply is cut off is bisected and retried instead of losing all of its terms.
+    """
+    stub_llm.delay = 0.0
+    stub_llm.max_terms = 3
+    terms = [f"begriff {i}" for i in range(20)]
+    mappings_by_field, failed_terms = llm_mapper.map_fields(
+        {"tags.hauptthemen": terms}, concurrency=2, api_key="test", base_url=stub_llm.url
+    )
+
+    assert failed_terms == 0
+    assert mappings_by_field["tags.hauptthemen"] == {term: term.upper() for term in terms}
+
+
+def test_backoff_delay_is_capped():
+    """
+    Tests that the jittered backoff never exceeds the cap.
+    """
+    assert all(0 <= llm_mapper.backoff_delay(attempt, base=1.0, cap=5.0) <= 5.0 for attempt in range(10))
+
+
+def test_mapping_updates_record_field_and_timestamp():
+    """
+    Tests that each mapping becomes an upsert that stores its target, source field and write time.
+    """
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    updates = llm_mapper.build_mapping_updates("tags.hauptthemen", {"Gnade": "Gnade Gottes"}, now=now)
+
+    assert len(updates) == 1
+    assert updates[0]._filter == {"_id": "Gnade"}
+    assert updates[0]._doc == {"$set": {"target": "Gnade Gottes", "field_path": "tags.hauptthemen", "updated_at": now}}
+    assert updates[0]._upsert is True
+
+
+def test_unmapped_terms_pipeline_is_a_single_facet_with_server_side_anti_join():
+    """
+    Tests that every field gets a $facet branch with a dot-free name that anti-joins against category_mappings.
+    """
+    field_paths = ["question_abstraction.categorization.category", "question_abstraction.semantic.domain"]
+    pipeline = llm_mapper.build_unmapped_terms_pipeline(field_paths)
+    facet = pipeline[-1]["$facet"]
+
+    assert len(facet) == len(field_paths)
+    assert not any("." in name for name in facet)
+    for branch in facet.values():
+        lookups = [stage["$lookup"] for stage in branch if "$lookup" in stage]
+        assert lookups and lookups[0]["from"] == llm_mapper.MAPPINGS_COLLECTION
+
+
+def test_high_cardinality_fields_are_listed_outside_the_facet(monkeypatch):
+    """
+    Tests that tag fields get a cursored aggregation of their own and that every field still lists exactly its unmapped terms.
+    """
+    db = mongomock.MongoClient().ama_test
+    db["ama_log"].insert_many([
+        {"tags": {"hauptthemen": ["Gnade", "Glaube"]}, "question_abstraction": {"categorization": {"category": "Ethik"}}},
+        {"tags": {"hauptthemen": ["Liebe"]}, "question_abstraction": {"categorization": {"category": "Theologie"}}},
+    ])
+    db[llm_mapper.MAPPINGS_COLLECTION].insert_one({"_id": "Gnade", "target": "Gnade"})
+    faceted = []
+    build_unmapped_terms_pipeline = llm_mapper.build_unmapped_terms_pipeline
+    monkeypatch.setattr(
+        llm_mapper, "build_unmapped_terms_pipeline",
+        lambda field_paths: faceted.extend(field_paths) or build_unmapped_terms_pipeline(field_paths),
+    )
+
+    unmapped = llm_mapper.get_unmapped_terms_by_field(db, ["tags.hauptthemen", "question_abstraction.categorization.category"])
+
+    assert faceted == ["question_abstraction.categorization.category"]
+    assert sorted(unmapped["tags.hauptthemen"]) == ["Glaube", "Liebe"]
+    assert sorted(unmapped["question_abstraction.categorization.category"]) == ["Ethik", "Theologie"]
@@ -0,0 +1,22 @@
+from mapping_events import format_event, status_events
+
+
+def test_status_events_report_batches_progress_and_final_status():
+    """
+    Tests that a change of the job status becomes a 'batch' event for new batches plus a 'progress' or final 'done' event.
+    """
+    running = {"job_id": "1", "status": "running", "progress": 10, "total": 40, "completed_batches": 1, "message": "m"}
+    advanced = dict(running, progress=30, completed_batches=3)
+    finished = dict(advanced, status="finished", progress=40)
+
+    assert [event for event, _ in status_events(None, running)] == ["batch", "progress"]
+    assert status_events(running, advanced)[0] == ("batch", {"completed_batches": 3, "message": "m"})
+    assert [event for event, _ in status_events(advanced, finished)] == ["done"]
+    assert [event for event, _ in status_events(None, {"status": "idle"})] == ["done"]
+
+
+def test_format_event():
+    """
+    Tests the wire format of a Server-Sent Event.
+    """
+    assert format_event("done", {"status": "idle"}) == 'event: done\ndata: {"status": "idle"}\n\n'
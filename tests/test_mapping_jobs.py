@@ -0,0 +1,126 @@
+import functools
+import threading
+from datetime import timedelta
+
+import mongomock
+import pytest
+
+import llm_mapper
+import main
+import mapping_jobs
+from benchmarks.stub_llm import StubLLMServer
+from mapping_jobs import (
+    IDLE_STATUS, JOBS_COLLECTION, QUEUED, RUNNING, JobInterrupted, _now, claim_job, enqueue_job, job_indexes,
+    release_job, run_mapping_job,
+)
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().ama_test
+
+
+def test_only_one_job_can_be_active():
+    """
+    Tests that the jobs collection declares a unique index over active jobs only, so finished jobs are kept as history.
+    """
+    index = next(index.document for index in job_indexes() if index.document["name"] == "single_active_job")
+
+    assert index["unique"] is True
+    assert index["partialFilterExpression"] == {"active": True}
+
+
+def test_idle_status_matches_the_status_api():
+    """
+    Tests that the status reported before any job exists has the fields the tags dashboard reads.
+    """
+    assert set(IDLE_STATUS) == {"status", "message", "progress", "total"}
+    assert IDLE_STATUS["status"] == "idle"
+
+
+def test_a_second_job_is_rejected_while_one_is_active(db, client, monkeypatch):
+    """
+    Tests that enqueueing while a job is queued returns None and that the trigger route answers 409.
+    """
+    monkeypatch.setattr(main, "get_db", lambda: db)
+
+    assert client.post("/api/trigger_llm_mapping").status_code == 202
+    assert enqueue_job(db) is None
+    assert client.post("/api/trigger_llm_mapping").status_code == 409
+    assert db[JOBS_COLLECTION].count_documents({}) == 1
+
+
+def test_enqueue_creates_the_index_it_relies_on():
+    """
+    Tests that enqueueing twice on a database without any indexes rejects the second job.
+    """
+    db = mongomock.MongoClient().ama_bare
+
+    assert enqueue_job(db) is not None
+    assert enqueue_job(db) is None
+    assert "single_active_job" in db[JOBS_COLLECTION].index_information()
+    assert db[JOBS_COLLECTION].count_documents({}) == 1
+
+
+def test_claim_takes_over_expired_leases_only(db):
+    """
+    Tests that a running job is claimed by another worker once its lease has expired, but not before.
+    """
+    job_id = enqueue_job(db)
+    assert claim_job(db, "worker-a")["lease_owner"] == "worker-a"
+    assert claim_job(db, "worker-b") is None
+
+    db[JOBS_COLLECTION].update_one({"_id": job_id}, {"$set": {"lease_expires_at": _now() - timedelta(seconds=1)}})
+    job = claim_job(db, "worker-b")
+
+    assert job["_id"] == job_id
+    assert job["status"] == RUNNING
+    assert job["lease_owner"] == "worker-b"
+    assert job["attempts"] == 2
+
+
+def test_release_requeues_the_job(db):
+    """
+    Tests that a released job is queued again without its lease or the attempt, and can be claimed at once.
+    """
+    job_id = enqueue_job(db)
+    claim_job(db, "worker-a")
+
+    release_job(db, job_id, "worker-a")
+    job = db[JOBS_COLLECTION].find_one({"_id": job_id})
+
+    assert job["status"] == QUEUED
+    assert job["attempts"] == 0
+    assert "lease_owner" not in job
+    assert claim_job(db, "worker-b")["_id"] == job_id
+
+
+def test_resumed_job_skips_checkpointed_batches(db, monkeypatch):
+    """
+    Tests that a job interrupted after a checkpoint resumes with the terms the first attempt had not mapped.
+    """
+    terms = [f"begriff {i}" for i in range(6)]
+    db["ama_log"].insert_many([{"tags": {"hauptthemen": [term]}} for term in terms])
+    # One batch of two terms at a time, so the first checkpoint covers exactly one batch
+    monkeypatch.setattr(mapping_jobs, "map_fields", functools.partial(llm_mapper.map_fields, max_batch_terms=2, concurrency=1))
+
+    with StubLLMServer(delay=0.0, canonical=str.upper) as stub:
+        monkeypatch.setattr(llm_mapper, "STRAICO_BASE_URL", stub.url)
+        monkeypatch.setattr(llm_mapper, "STRAICO_API_KEY", "test")
+        job_id = enqueue_job(db)
+        stop_event = threading.Event()
+        stop_event.set()
+        with pytest.raises(JobInterrupted):
+            run_mapping_job(db, claim_job(db, "worker-a"), "worker-a", stop_event)
+        release_job(db, job_id, "worker-a")
+        calls_before = stub.calls
+
+        status, _ = run_mapping_job(db, claim_job(db, "worker-b"), "worker-b")
+
+    job = db[JOBS_COLLECTION].find_one({"_id": job_id})
+    assert status == mapping_jobs.FINISHED
+    assert calls_before == 1
+    assert stub.calls - calls_before == 2
+    assert job["progress"] == job["total"] == len(terms)
+    assert job["completed_batches"] == 3
+    assert {mapping["_id"] for mapping in db["category_mappings"].find()} == set(terms)
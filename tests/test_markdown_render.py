@@ -0,0 +1,27 @@
+from markdown_render import content_hash, render_answer
+
+
+def _doc(markdown_content, rendered_html=None):
+    doc = {"reply": {"completion": {"choices": [{"message": {"content": markdown_content}}]}}}
+    if rendered_html is not None:
+        doc["rendered_html"] = rendered_html
+    return doc
+
+
+def test_persisted_rendering_is_used_when_the_source_is_unchanged():
+    """
+    Tests that a stored rendering with a matching source hash is returned without parsing the Markdown.
+    """
+    content = "# Gnade"
+    doc = _doc(content, {"source_hash": content_hash(content), "html": "<h1>stored</h1>"})
+
+    assert render_answer(doc) == "<h1>stored</h1>"
+
+
+def test_outdated_persisted_rendering_is_ignored():
+    """
+    Tests that a stored rendering of an older answer version is not shown.
+    """
+    doc = _doc("| a | b |\n|---|---|\n| 1 | 2 |", {"source_hash": "outdated", "html": "<p>old</p>"})
+
+    assert "<table>" in render_answer(doc)
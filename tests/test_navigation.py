@@ -71,3 +71,19 @@ def test_navigation_buttons_on_first_document(client):
     if collection.count_documents({}) > 1:
         assert 'disabled' not in next_button.get('class', []), "Next button should be enabled on the first page if it's not the only document."
 
+
+def test_split_neighbours_identifies_document_and_neighbours():
+    """
+    Tests that the rows of the single navigation query are assigned to the document, its predecessor and its successor.
+    """
+    from bson import ObjectId
+    from navigation import split_neighbours
+
+    previous_id, doc_id, next_id = sorted(ObjectId() for _ in range(3))
+    rows = [{'_id': doc_id, 'tags': {}}, {'_id': previous_id}, {'_id': next_id}]
+
+    doc, found_previous_id, found_next_id = split_neighbours(rows, doc_id)
+
+    assert doc == {'_id': doc_id, 'tags': {}}
+    assert found_previous_id == previous_id
+    assert found_next_id == next_id
@@ -0,0 +1,97 @@
+import mongomock
+import pytest
+from bson import ObjectId
+
+import data_version
+from data_version import SOURCE_COLLECTION, bump_version, invalidate_local_version
+from navigation import NavigationIndex, fetch_with_neighbours
+
+
+class UnionWithCollection:
+    """Runs the trailing $unionWith stages, which mongomock lacks, as separate mongomock aggregations."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def aggregate(self, pipeline):
+        first_union = next(index for index, stage in enumerate(pipeline) if "$unionWith" in stage)
+        assert all("$unionWith" in stage for stage in pipeline[first_union:])
+        rows = list(self.collection.aggregate(pipeline[:first_union]))
+        for stage in pipeline[first_union:]:
+            union = stage["$unionWith"]
+            rows += list(self.collection.database[union["coll"]].aggregate(union["pipeline"]))
+        return iter(rows)
+
+
+def _id(index):
+    return ObjectId(f"{index:024x}")
+
+
+@pytest.fixture
+def db():
+    database = mongomock.MongoClient().ama_test
+    database[SOURCE_COLLECTION].insert_many([{"_id": _id(index), "reply": f"Antwort {index}"} for index in (1, 2, 3)])
+    invalidate_local_version()
+    yield database
+    invalidate_local_version()
+
+
+@pytest.mark.parametrize("index, previous_id, next_id", [(1, None, _id(2)), (2, _id(1), _id(3)), (3, _id(2), None)])
+def test_fetch_with_neighbours(db, index, previous_id, next_id):
+    """
+    Tests that the document comes back with the _id of its neighbours, and without one at either end of the collection.
+    """
+    collection = {SOURCE_COLLECTION: UnionWithCollection(db[SOURCE_COLLECTION])}
+
+    doc, previous, following = fetch_with_neighbours(collection, _id(index))
+
+    assert doc == {"_id": _id(index), "reply": f"Antwort {index}"}
+    assert (previous, following) == (previous_id, next_id)
+
+
+def test_fetch_with_neighbours_applies_the_projection_and_reports_missing_documents(db):
+    """
+    Tests that the projection only applies to the document itself and that an unknown _id yields no document but its neighbours.
+    """
+    collection = {SOURCE_COLLECTION: UnionWithCollection(db[SOURCE_COLLECTION])}
+
+    doc, previous, following = fetch_with_neighbours(collection, _id(2), projection={"_id": 1})
+    assert doc == {"_id": _id(2)}
+    assert (previous, following) == (_id(1), _id(3))
+
+    db[SOURCE_COLLECTION].delete_one({"_id": _id(2)})
+    assert fetch_with_neighbours(collection, _id(2)) == (None, _id(1), _id(3))
+
+
+def test_navigation_index_follows_inserts_and_deletes(db):
+    """
+    Tests that the cached bounds are re-read after an insert changes the newest _id and after a delete bumps the version.
+    """
+    index = NavigationIndex()
+    assert index.bounds(db) == (_id(1), _id(3))
+
+    db[SOURCE_COLLECTION].insert_one({"_id": _id(4)})
+    # Another process's insert becomes visible once the data version is re-read
+    invalidate_local_version()
+    assert index.bounds(db) == (_id(1), _id(4))
+
+    db[SOURCE_COLLECTION].delete_one({"_id": _id(1)})
+    bump_version(db, SOURCE_COLLECTION)
+    assert index.bounds(db) == (_id(2), _id(4))
+
+    db[SOURCE_COLLECTION].delete_many({})
+    bump_version(db, SOURCE_COLLECTION)
+    assert index.bounds(db) == (None, None)
+
+
+def test_navigation_index_reuses_bounds_while_the_version_is_unchanged(db, monkeypatch):
+    """
+    Tests that the bounds are not re-read while the data version stays the same.
+    """
+    monkeypatch.setattr(data_version, "VERSION_CHECK_INTERVAL", 3600)
+    index = NavigationIndex()
+    index.bounds(db)
+    # Not visible: the version is cached and nothing bumped it
+    db[SOURCE_COLLECTION].delete_one({"_id": _id(1)})
+
+    assert index.bounds(db) == (_id(1), _id(3))
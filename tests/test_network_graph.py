@@ -0,0 +1,166 @@
+import mongomock
+import pytest
+from bson import ObjectId
+
+import network_graph
+from data_version import NETWORK_CACHE_COLLECTION, SOURCE_COLLECTION
+from network_graph import (
+    build_nodes, document_edges, generate_network_data, get_network_state, load_network, prune_network,
+    rebuild_network_cache, refresh_network_cache, remove_document_edges, update_network_cache,
+)
+from network_layout import compute_force_layout
+
+
+def test_document_edges_match_the_double_unwind():
+    """
+    Tests that a document contributes one edge per reference x theme combination, duplicates included.
+    """
+    doc = {"tags": {"bibelreferenzen": ["Joh 3,16", "Röm 8,28", "Joh 3,16"], "hauptthemen": ["Liebe", "Gnade"]}}
+
+    edges = document_edges(doc)
+
+    assert edges[("Joh 3,16", "Liebe")] == 2
+    assert edges[("Röm 8,28", "Gnade")] == 1
+    assert sum(edges.values()) == 6
+
+
+def test_document_without_themes_has_no_edges():
+    """
+    Tests that documents missing one side of the network do not contribute edges.
+    """
+    assert not document_edges({"tags": {"bibelreferenzen": ["Ps 23"]}})
+    assert not document_edges({"_id": 1})
+
+
+def _network(links):
+    return {"nodes": build_nodes(links), "links": links}
+
+
+def test_prune_network_applies_min_weight_and_top_k():
+    """
+    Tests that weak links are dropped and a link survives if it is among the top_k of either endpoint.
+    """
+    links = [
+        {"source": "Joh 3,16", "target": "Liebe", "value": 9},
+        {"source": "Joh 3,16", "target": "Gnade", "value": 4},
+        {"source": "Joh 3,16", "target": "Glaube", "value": 1},
+        {"source": "Ps 23", "target": "Glaube", "value": 3},
+    ]
+
+    pruned = prune_network(_network(links), min_weight=2, top_k=1)
+
+    assert {(link["source"], link["target"]) for link in pruned["links"]} == {
+        ("Joh 3,16", "Liebe"),
+        ("Joh 3,16", "Gnade"),
+        ("Ps 23", "Glaube"),
+    }
+    assert {node["id"] for node in pruned["nodes"]} == {"Joh 3,16", "Liebe", "Gnade", "Ps 23", "Glaube"}
+
+
+def test_prune_network_caps_the_number_of_nodes():
+    """
+    Tests that max_nodes keeps the strongest links whose endpoints fit into the cap.
+    """
+    links = [
+        {"source": "Joh 3,16", "target": "Liebe", "value": 9},
+        {"source": "Ps 23", "target": "Glaube", "value": 3},
+    ]
+
+    pruned = prune_network(_network(links), max_nodes=3)
+
+    assert pruned["links"] == [links[0]]
+    assert len(pruned["nodes"]) == 2
+
+
+def test_force_layout_returns_normalized_coordinates_for_every_node():
+    """
+    Tests that the precomputed layout places every node inside the unit square.
+    """
+    links = [
+        {"source": "Joh 3,16", "target": "Liebe", "value": 9},
+        {"source": "Ps 23", "target": "Liebe", "value": 3},
+    ]
+    nodes = build_nodes(links)
+
+    positions = compute_force_layout(nodes, links, iterations=10)
+
+    assert set(positions) == {(node["id"], node["type"]) for node in nodes}
+    assert all(0.0 <= coordinate <= 1.0 for position in positions.values() for coordinate in position)
+
+
+def _doc(index, references, themes):
+    return {"_id": ObjectId(f"{index:024x}"), "tags": {"bibelreferenzen": references, "hauptthemen": themes}}
+
+
+def _link_values(network):
+    return {(link["source"], link["target"]): link["value"] for link in network["links"]}
+
+
+@pytest.fixture
+def db():
+    database = mongomock.MongoClient().ama_test
+    database[SOURCE_COLLECTION].insert_many([
+        _doc(1, ["Joh 3,16"], ["Liebe", "Gnade"]),
+        _doc(2, ["Joh 3,16", "Ps 23"], ["Liebe"]),
+    ])
+    return database
+
+
+def test_rebuild_swaps_in_the_full_network(db):
+    """
+    Tests that a rebuild counts every edge into the shadow collection, renames it over the cache and drops the shadow.
+    """
+    assert load_network(db) is None
+
+    assert update_network_cache(db) == {"mode": "rebuild"}
+    network = load_network(db)
+
+    assert _link_values(network) == _link_values(generate_network_data(db))
+    assert get_network_state(db)["high_water_id"] == ObjectId(f"{2:024x}")
+    assert network_graph.SHADOW_COLLECTION not in db.list_collection_names()
+    assert all("x" in node and "y" in node for node in network["nodes"])
+
+
+def test_refresh_adds_only_new_documents(db):
+    """
+    Tests that an incremental refresh counts the documents inserted since the last update and matches a rebuild.
+    """
+    rebuild_network_cache(db)
+    db[SOURCE_COLLECTION].insert_many([_doc(3, ["Ps 23"], ["Liebe", "Trost"]), _doc(4, ["Joh 3,16"], [])])
+
+    assert refresh_network_cache(db) == 1
+    assert refresh_network_cache(db) == 0
+    assert _link_values(load_network(db)) == _link_values(generate_network_data(db))
+    assert get_network_state(db)["high_water_id"] == ObjectId(f"{4:024x}")
+
+
+def test_concurrent_refreshes_count_new_documents_once(db, monkeypatch):
+    """
+    Tests that a refresh which read the high-water mark before another process moved it does not apply its counts.
+    """
+    rebuild_network_cache(db)
+    stale_state = get_network_state(db)
+    db[SOURCE_COLLECTION].insert_one(_doc(3, ["Ps 23"], ["Liebe"]))
+    assert refresh_network_cache(db) == 1
+
+    # A second process that read the state before the first refresh claimed the range
+    monkeypatch.setattr(network_graph, "get_network_state", lambda db: stale_state)
+
+    assert refresh_network_cache(db) == 0
+    assert _link_values(load_network(db))[("Ps 23", "Liebe")] == 2
+
+
+def test_removed_documents_subtract_their_edges(db):
+    """
+    Tests that deleting a counted document decrements its edges and drops those that reach zero.
+    """
+    rebuild_network_cache(db)
+    doc = db[SOURCE_COLLECTION].find_one({"_id": ObjectId(f"{2:024x}")})
+    db[SOURCE_COLLECTION].delete_one({"_id": doc["_id"]})
+
+    remove_document_edges(db, doc)
+    # A document above the high-water mark has not been counted and is ignored
+    remove_document_edges(db, _doc(9, ["Joh 3,16"], ["Liebe"]))
+
+    assert _link_values(load_network(db)) == {("Joh 3,16", "Liebe"): 1, ("Joh 3,16", "Gnade"): 1}
+    assert db[NETWORK_CACHE_COLLECTION].count_documents({"value": {"$lte": 0}}) == 0
@@ -0,0 +1,11 @@
+from projections import VIEW_PROJECTIONS
+
+
+def test_view_projections_have_no_path_collisions():
+    """
+    Tests that no projection contains a field together with one of its sub-fields, which MongoDB rejects.
+    """
+    for view, projection in VIEW_PROJECTIONS.items():
+        for path in projection:
+            for other_path in projection:
+                assert not other_path.startswith(path + "."), f"'{path}' and '{other_path}' collide in view '{view}'"
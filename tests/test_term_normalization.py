@@ -0,0 +1,53 @@
+from term_normalization import CanonIndex, CanonTfidfIndex, expand_variants, normalize_term, prenormalize_terms
+
+
+def test_normalize_term_ignores_case_whitespace_unicode_form_and_punctuation():
+    """
+    Tests that trivial variants of a term share the same normalized form.
+    """
+    assert normalize_term("  Gnade  Gottes. ") == normalize_term("gnade gottes")
+    assert normalize_term("Ｇｎａｄｅ") == normalize_term("Gnade")
+    assert normalize_term("Sünde") == normalize_term("Sünde")
+
+
+def test_canon_index_resolves_exact_and_close_variants_only():
+    """
+    Tests that variants resolve to existing canons or to the target of a mapped term, while unrelated terms do not.
+    """
+    index = CanonIndex(["Rechtfertigung", "Gnade"], {"Barmherzigkeit": "Gnade"}, threshold=0.7)
+
+    assert index.resolve("rechtfertigung!") == "Rechtfertigung"
+    assert index.resolve("Rechtfertigungg") == "Rechtfertigung"
+    assert index.resolve("barmherzigkeit") == "Gnade"
+    assert index.resolve("Eschatologie") is None
+
+
+def test_prenormalize_terms_sends_one_representative_per_variant_group():
+    """
+    Tests that locally resolved terms and duplicate variants are left out of the LLM terms and reported as savings.
+    """
+    terms_by_field = {"tags.hauptthemen": ["gnade", "Neuer Bund", "neuer bund", "NEUER BUND "]}
+    resolved, llm_terms, variants, savings = prenormalize_terms(terms_by_field, CanonIndex(["Gnade"]))
+
+    assert resolved["tags.hauptthemen"] == {"gnade": "Gnade"}
+    assert len(llm_terms["tags.hauptthemen"]) == 1
+    assert savings["terms_resolved_locally"] == 1
+    assert savings["terms_deduplicated"] == 2
+    assert savings["tokens_saved"] > 0
+
+    representative = llm_terms["tags.hauptthemen"][0]
+    expanded = expand_variants({representative: "Neuer Bund"}, variants["tags.hauptthemen"])
+    assert set(expanded) == {"Neuer Bund", "neuer bund", "NEUER BUND "}
+
+
+def test_canon_tfidf_index_selects_a_bounded_set_of_relevant_canons():
+    """
+    Tests that only canons similar to the batch terms are selected and that the selection never exceeds its limit.
+    """
+    canons = ["Gnade", "Heiliger Geist", "Abendmahl", "Taufe"] + [f"Kanon {i}" for i in range(500)]
+    index = CanonTfidfIndex(canons)
+
+    selected = index.select(["Gnade Gottes", "Heiligen Geist"], per_term=2, limit=10)
+    assert "Gnade" in selected and "Heiliger Geist" in selected
+    assert "Abendmahl" not in selected
+    assert len(index.select([f"Kanon {i}x" for i in range(200)], limit=10)) == 10